@@ -5,7 +5,7 @@ import markupsafe
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
-from flask_login import LoginManager
+from flask_login import LoginManager, current_user
 from werkzeug.middleware.proxy_fix import ProxyFix
 from email_smtp import EmailSender
 from flask_wtf.csrf import CSRFProtect, generate_csrf
@@ -56,6 +56,9 @@ def create_app():
     def inject_csrf_token():
         return dict(csrf_token=generate_csrf)
     
+    # Usuário logado também nas macros importadas sem contexto (células das listagens)
+    app.jinja_env.globals['current_user'] = current_user
+    
     # Registra blueprints
     from routes.auth import auth_bp
     from routes.pessoas import pessoas_bp
@@ -67,6 +70,7 @@ def create_app():
     from routes.relatorios import relatorios_bp
     from routes.qr_routes import qr_bp
     from routes.users import users_bp
+    from routes.api import api_bp
     
     app.register_blueprint(auth_bp)
     app.register_blueprint(pessoas_bp)
@@ -78,6 +82,7 @@ def create_app():
     app.register_blueprint(relatorios_bp)
     app.register_blueprint(qr_bp)
     app.register_blueprint(users_bp, url_prefix='/usuarios')
+    app.register_blueprint(api_bp)
     
     return app
 
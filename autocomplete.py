@@ -0,0 +1,255 @@
+"""
+Índice de prefixos em memória para o autocomplete de CPF, CNPJ e nomes.
+
+Cada worker mantém um vetor ordenado de chaves normalizadas (CPF/CNPJ só com
+dígitos e nomes sem acentos em minúsculas, a partir de cada palavra), e a
+busca por prefixo é um bisect seguido de uma leitura sequencial: poucos
+microssegundos, sem ir ao banco.
+
+O índice é montado no primeiro uso, atualizado incrementalmente pelos commits
+deste worker (commit_hooks) e remontado periodicamente (por uma requisição de
+cada vez; as demais usam o índice atual) para incorporar as alterações feitas
+pelos outros workers. Se o número de chaves passar de MAX_KEYS o índice é
+desligado de vez neste worker e a busca vai para o banco, sobre as colunas
+normalizadas indexadas.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from app import db
+from commit_hooks import on_commit, INSERT, UPDATE, DELETE
+from listing import starts_with
+from models import Pessoa, Empresa
+from utils import only_digits, normalize_search
+
+PESSOA = 'pessoa'
+EMPRESA = 'empresa'
+
+# Limite de chaves no índice (cada registro gera uma chave por palavra do nome
+# mais a do documento); acima disso a busca vai para o banco
+MAX_KEYS = 200_000
+
+# Tamanho máximo de cada chave de nome (limita a memória por registro)
+MAX_KEY_LENGTH = 40
+
+# Intervalo para remontar o índice com as alterações dos outros workers
+REFRESH_SECONDS = 300
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 25
+
+
+def _name_keys(nome_normalizado):
+    """Chaves de um nome: o nome completo e o trecho a partir de cada palavra"""
+    words = (nome_normalizado or '').split()
+    return {' '.join(words[i:])[:MAX_KEY_LENGTH] for i in range(len(words))}
+
+
+class PrefixIndex:
+    """
+    Vetor ordenado de (chave, tipo, documento) com os rótulos em um dicionário
+    à parte, para que cada registro seja guardado uma única vez.
+
+    Uma montagem por vez (_build_lock). As alterações recebidas durante a
+    montagem são reaplicadas sobre o resultado dela, então nenhum commit deste
+    worker se perde na troca do vetor.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._keys = []
+        self._labels = {}
+        self._built_at = None
+        # Alterações recebidas durante uma montagem (None fora dela)
+        self._replay = None
+        self.enabled = True
+
+    def _entries(self, kind, document, name):
+        keys = _name_keys(normalize_search(name))
+        digits = only_digits(document)
+        if digits:
+            keys.add(digits)
+        return [(key, kind, document) for key in keys]
+
+    def build(self):
+        """Monta o índice a partir do banco (apenas as colunas necessárias)"""
+        with self._build_lock:
+            self._build()
+
+    def _build(self):
+        with self._lock:
+            self._replay = []
+        try:
+            keys = []
+            labels = {}
+            sources = (
+                (PESSOA, db.session.query(Pessoa.cpf, Pessoa.nome)),
+                (EMPRESA, db.session.query(Empresa.cnpj, Empresa.nome_empresa)),
+            )
+            for kind, query in sources:
+                for document, name in query.yield_per(1000):
+                    labels[(kind, document)] = name
+                    keys.extend(self._entries(kind, document, name))
+                    if len(keys) > MAX_KEYS:
+                        # Índice grande demais para a memória do worker: não
+                        # é mais montado, a busca vai para o banco
+                        with self._lock:
+                            self._disable()
+                            self._replay = None
+                            self._built_at = time.monotonic()
+                        return
+            keys.sort()
+        except Exception:
+            with self._lock:
+                self._replay = None
+            raise
+
+        with self._lock:
+            self._keys, self._labels = keys, labels
+            self.enabled = True
+            for op, kind, document, name in self._replay:
+                op(kind, document, name)
+            self._replay = None
+            self._built_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        if self._built_at is not None and (
+                not self.enabled or time.monotonic() - self._built_at <= REFRESH_SECONDS):
+            return
+        # No primeiro uso espera a montagem em andamento; numa remontagem, quem
+        # chega enquanto outra requisição remonta usa o índice atual
+        if not self._build_lock.acquire(blocking=self._built_at is None):
+            return
+        try:
+            if self._built_at is None or (
+                    self.enabled and time.monotonic() - self._built_at > REFRESH_SECONDS):
+                self._build()
+        finally:
+            self._build_lock.release()
+
+    def _disable(self):
+        self._keys, self._labels = [], {}
+        self.enabled = False
+
+    def _add(self, kind, document, name):
+        if not self.enabled:
+            return
+        self._labels[(kind, document)] = name
+        for entry in self._entries(kind, document, name):
+            # Idempotente: a reaplicação pode encontrar o registro já lido do banco
+            position = bisect_left(self._keys, entry)
+            if position == len(self._keys) or self._keys[position] != entry:
+                self._keys.insert(position, entry)
+        if len(self._keys) > MAX_KEYS:
+            self._disable()
+
+    def _remove(self, kind, document, name):
+        if not self.enabled:
+            return
+        self._labels.pop((kind, document), None)
+        for entry in self._entries(kind, document, name):
+            position = bisect_left(self._keys, entry)
+            if position < len(self._keys) and self._keys[position] == entry:
+                del self._keys[position]
+
+    def _change(self, op, kind, document, name):
+        with self._lock:
+            if self._replay is not None:
+                self._replay.append((op, kind, document, name))
+            if self._built_at is not None:
+                op(kind, document, name)
+
+    def add(self, kind, document, name):
+        self._change(self._add, kind, document, name)
+
+    def remove(self, kind, document, name):
+        self._change(self._remove, kind, document, name)
+
+    def search(self, term, kind=None, limit=DEFAULT_LIMIT):
+        """
+        Busca registros cujo documento ou alguma palavra do nome comece com o termo.
+
+        Args:
+            term (str): Texto digitado (CPF/CNPJ com ou sem máscara, ou nome)
+            kind (str): PESSOA, EMPRESA ou None para ambos
+            limit (int): Quantidade máxima de resultados
+
+        Returns:
+            list: Lista de (tipo, documento, nome), sem repetições
+        """
+        self._ensure_fresh()
+        prefix = _search_prefix(term)
+        if not prefix:
+            return []
+        if not self.enabled:
+            return _search_database(prefix, kind, limit)
+
+        results = []
+        seen = set()
+        with self._lock:
+            position = bisect_left(self._keys, (prefix,))
+            while position < len(self._keys) and len(results) < limit:
+                key, entry_kind, document = self._keys[position]
+                if not key.startswith(prefix):
+                    break
+                position += 1
+                if (kind and entry_kind != kind) or (entry_kind, document) in seen:
+                    continue
+                if (entry_kind, document) not in self._labels:
+                    # Chave de um registro já excluído
+                    continue
+                seen.add((entry_kind, document))
+                results.append((entry_kind, document, self._labels.get((entry_kind, document))))
+        return results
+
+    def __len__(self):
+        return len(self._keys)
+
+
+def _search_prefix(term):
+    """Normaliza o termo digitado como as chaves do índice"""
+    term = normalize_search(term)
+    if term and all(c.isdigit() or c in '.-/ ' for c in term):
+        return only_digits(term)
+    return term[:MAX_KEY_LENGTH]
+
+
+def _search_database(prefix, kind, limit):
+    """Busca pelo banco quando o índice em memória está desligado"""
+    sources = (
+        (PESSOA, Pessoa.cpf, Pessoa.nome, Pessoa.cpf_digitos, Pessoa.nome_normalizado),
+        (EMPRESA, Empresa.cnpj, Empresa.nome_empresa, Empresa.cnpj_digitos, Empresa.nome_normalizado),
+    )
+    results = []
+    for source_kind, document, name, digits_column, name_column in sources:
+        if kind not in (None, source_kind) or len(results) >= limit:
+            continue
+        if prefix.isdigit():
+            condition = starts_with(digits_column, prefix)
+        else:
+            condition = db.or_(starts_with(name_column, prefix),
+                               name_column.contains(f' {prefix}', autoescape=True))
+        query = db.session.query(document, name).filter(condition).order_by(name_column)
+        results.extend((source_kind, doc, label) for doc, label in query.limit(limit - len(results)))
+    return results
+
+
+autocomplete_index = PrefixIndex()
+
+
+def _apply_changes(kind, document_key, name_key):
+    """Cria o callback de commit que replica as alterações no índice"""
+    def apply(changes):
+        for change in changes:
+            if change.op in (UPDATE, DELETE):
+                previous = change.previous
+                autocomplete_index.remove(kind, previous[document_key], previous[name_key])
+            if change.op in (INSERT, UPDATE):
+                autocomplete_index.add(kind, change.values[document_key], change.values[name_key])
+    apply.__name__ = f'autocomplete_{kind}'
+    return apply
+
+
+on_commit(Pessoa, _apply_changes(PESSOA, 'cpf', 'nome'))
+on_commit(Empresa, _apply_changes(EMPRESA, 'cnpj', 'nome_empresa'))
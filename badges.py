@@ -0,0 +1,164 @@
+"""
+Folhas de crachás em PDF (A4) com nome, CPF, empresa e o QR de check-in.
+
+O PDF é desenhado com o canvas do reportlab; os QR são desenhados como
+retângulos vetoriais (um por trecho contínuo de módulos escuros), sem
+imagens. Com no máximo MAX_BADGES crachás, o arquivo inteiro fica em memória
+até ser enviado (cerca de 6 KB por crachá).
+
+As fontes são as padrão do PDF (Helvetica, sem embutir).
+"""
+import io
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen.canvas import Canvas
+
+from qr_code import person_payload, packed_matrix
+from utils import VERDE_VIGIAPP
+
+# Crachás por página: (colunas, linhas)
+LAYOUTS = {
+    4: (2, 2),
+    8: (2, 4),
+    10: (2, 5),
+}
+DEFAULT_PER_PAGE = 8
+
+MAX_BADGES = 2000
+
+PAGE_MARGIN = 10 * mm
+BADGE_GAP = 4 * mm
+BADGE_PADDING = 4 * mm
+
+
+class Badge:
+    """Dados impressos em um crachá"""
+    __slots__ = ('cpf', 'nome', 'empresa')
+
+    def __init__(self, cpf, nome, empresa=None):
+        self.cpf = cpf
+        self.nome = nome
+        self.empresa = empresa
+
+
+def _fit(text, font, size, width):
+    """Corta o texto com reticências para caber na largura"""
+    text = text or ''
+    if stringWidth(text, font, size) <= width:
+        return text
+    while text and stringWidth(text + '...', font, size) > width:
+        text = text[:-1]
+    return text.rstrip() + '...'
+
+
+def _wrap(text, font, size, width, max_lines):
+    """Quebra o texto em até `max_lines` linhas (a última cortada se necessário)"""
+    lines = []
+    words = (text or '').split()
+    while words and len(lines) < max_lines:
+        line = words.pop(0)
+        while words and stringWidth(f'{line} {words[0]}', font, size) <= width:
+            line = f'{line} {words.pop(0)}'
+        if len(lines) == max_lines - 1 and words:
+            line = f"{line} {' '.join(words)}"
+            words = []
+        lines.append(_fit(line, font, size, width))
+    return lines
+
+
+def _draw_qr(canvas, n, modules, x, y, size):
+    """Módulos escuros do QR como retângulos (um por trecho contínuo de cada linha)"""
+    # Em unidades de módulo: coordenadas inteiras, mais curtas no PDF
+    canvas.saveState()
+    canvas.translate(x, y)
+    canvas.scale(size / n, size / n)
+    path = canvas.beginPath()
+    for row in range(n):
+        offset = row * n
+        column = 0
+        while column < n:
+            if modules[offset + column]:
+                start = column
+                while column < n and modules[offset + column]:
+                    column += 1
+                path.rect(start, n - row - 1, column - start, 1)
+            else:
+                column += 1
+    canvas.setFillColor(colors.black)
+    canvas.drawPath(path, stroke=0, fill=1)
+    canvas.restoreState()
+
+
+def _draw_badge(canvas, badge, matrix, x, y, width, height):
+    # Contorno para recorte
+    canvas.setStrokeGray(0.6)
+    canvas.setLineWidth(0.5)
+    canvas.rect(x, y, width, height, stroke=1, fill=0)
+
+    # Faixa superior
+    band = min(9 * mm, height * 0.2)
+    canvas.setFillColor(VERDE_VIGIAPP)
+    canvas.rect(x, y + height - band, width, band, stroke=0, fill=1)
+    canvas.setFillColor(colors.white)
+    canvas.setFont('Helvetica-Bold', 10)
+    canvas.drawString(x + BADGE_PADDING, y + height - band + (band - 10) / 2 + 2, 'VigiAPP')
+
+    # QR à esquerda, do tamanho da área abaixo da faixa
+    inner_height = height - band - 2 * BADGE_PADDING
+    qr_size = min(inner_height, width * 0.45)
+    n, modules = matrix
+    _draw_qr(canvas, n, modules, x + BADGE_PADDING, y + BADGE_PADDING + (inner_height - qr_size) / 2, qr_size)
+
+    # Nome, CPF e empresa à direita
+    text_x = x + 2 * BADGE_PADDING + qr_size
+    text_width = x + width - BADGE_PADDING - text_x
+    line_y = y + height - band - BADGE_PADDING - 12
+    canvas.setFillColor(colors.black)
+    canvas.setFont('Helvetica-Bold', 12)
+    for line in _wrap(badge.nome, 'Helvetica-Bold', 12, text_width, 2):
+        canvas.drawString(text_x, line_y, line)
+        line_y -= 15
+    line_y -= 4
+    canvas.setFont('Helvetica', 10)
+    canvas.drawString(text_x, line_y, f'CPF: {badge.cpf}')
+    if badge.empresa:
+        line_y -= 13
+        canvas.setFillGray(0.3)
+        canvas.setFont('Helvetica', 9)
+        canvas.drawString(text_x, line_y, _fit(badge.empresa, 'Helvetica', 9, text_width))
+
+
+def generate_badge_sheet(badges, per_page=DEFAULT_PER_PAGE):
+    """
+    Gera o PDF dos crachás.
+
+    Args:
+        badges (list): Lista de Badge, na ordem de impressão
+        per_page (int): Crachás por página (uma das chaves de LAYOUTS)
+
+    Returns:
+        bytes: Conteúdo do arquivo PDF
+    """
+    columns, rows = LAYOUTS[per_page]
+    page_width, page_height = A4
+    width = (page_width - 2 * PAGE_MARGIN - (columns - 1) * BADGE_GAP) / columns
+    height = (page_height - 2 * PAGE_MARGIN - (rows - 1) * BADGE_GAP) / rows
+
+    buffer = io.BytesIO()
+    canvas = Canvas(buffer, pagesize=A4, pageCompression=1)
+    canvas.setTitle('Crachás')
+    canvas.setProducer('VigiAPP')
+    for index, badge in enumerate(badges):
+        slot = index % per_page
+        if slot == 0 and index:
+            canvas.showPage()
+        column, row = slot % columns, slot // columns
+        x = PAGE_MARGIN + column * (width + BADGE_GAP)
+        y = page_height - PAGE_MARGIN - (row + 1) * height - row * BADGE_GAP
+        _draw_badge(canvas, badge, packed_matrix(person_payload(badge.cpf)), x, y, width, height)
+    canvas.showPage()
+    canvas.save()
+    return buffer.getvalue()
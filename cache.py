@@ -0,0 +1,134 @@
+"""
+Cache em memória com expiração (TTL) e descarte do item menos usado (LRU).
+
+Cada worker mantém seus próprios caches. A invalidação das alterações feitas
+neste worker é imediata (via commit_hooks); as feitas pelos outros workers
+aparecem quando a entrada expira, por isso o TTL deve ser curto.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from flask import jsonify, request
+
+# Marca de ausência da chave no cache
+MISSING = object()
+
+# Caches criados, por nome, para o relatório de estatísticas
+_caches = {}
+
+
+class CacheEntry:
+    """Valor guardado no cache com o ETag calculado uma única vez"""
+    def __init__(self, value, expires_at):
+        self.value = value
+        self.expires_at = expires_at
+        # Conteúdo binário (ex.: imagens) é usado diretamente no hash
+        content = value if isinstance(value, bytes) else json.dumps(
+            value, sort_keys=True, default=str
+        ).encode('utf-8')
+        self.etag = hashlib.sha1(content).hexdigest()
+
+
+class TTLCache:
+    """
+    Cache LRU limitado a `maxsize` entradas, cada uma válida por `ttl` segundos.
+
+    Args:
+        name (str): Nome usado nas estatísticas
+        maxsize (int): Quantidade máxima de entradas
+        ttl (int): Validade de cada entrada em segundos
+    """
+    def __init__(self, name, maxsize=1024, ttl=120):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        _caches[name] = self
+
+    def get(self, key):
+        """Retorna a CacheEntry da chave ou MISSING se ausente/expirada"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, value):
+        """Guarda o valor e retorna a CacheEntry criada"""
+        entry = CacheEntry(value, time.monotonic() + self.ttl)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def get_or_load(self, key, loader):
+        """
+        Retorna a entrada da chave, carregando com loader() em caso de falta.
+
+        Um resultado None ("registro não existe") não é guardado: o cadastro
+        feito em outro worker só invalidaria o cache dele, e este continuaria
+        respondendo "não encontrado" até a entrada expirar.
+        """
+        entry = self.get(key)
+        if entry is MISSING:
+            value = loader()
+            if value is None:
+                return CacheEntry(None, time.monotonic())
+            entry = self.set(key, value)
+        return entry
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entradas': len(self._entries),
+            'limite': self.maxsize,
+            'ttl': self.ttl,
+            'acertos': self.hits,
+            'faltas': self.misses,
+            'descartes': self.evictions,
+            'taxa_acerto': round(self.hits / total, 3) if total else None,
+        }
+
+
+def cache_stats():
+    """Estatísticas de todos os caches deste worker"""
+    return {name: cache.stats() for name, cache in _caches.items()}
+
+
+def cached_json_response(entry, not_found_status=404):
+    """
+    Resposta JSON de uma CacheEntry com ETag; devolve 304 quando o navegador
+    já tem a mesma versão. Valor None vira {} com `not_found_status`.
+    """
+    if entry.value is None:
+        return jsonify({}), not_found_status
+
+    response = jsonify(entry.value)
+    response.set_etag(entry.etag)
+    # O navegador pode guardar, mas deve revalidar a cada uso
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
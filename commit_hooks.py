@@ -0,0 +1,141 @@
+"""
+Notificações de alterações confirmadas (após o COMMIT) por modelo.
+
+Os caches em memória de cada worker (autocomplete, consultas por CPF/CNPJ
+etc.) precisam saber quando um registro foi inserido, alterado ou excluído.
+As alterações são coletadas no after_flush, enquanto os objetos ainda estão
+carregados, e só são entregues aos callbacks no after_commit; um rollback
+descarta tudo o que foi coletado.
+
+Uso:
+    def atualizar(changes):
+        for change in changes:
+            ...
+
+    on_commit(Pessoa, atualizar)
+"""
+import logging
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+INSERT = 'insert'
+UPDATE = 'update'
+DELETE = 'delete'
+
+_PENDING_KEY = 'commit_hooks_pending'
+
+# Callbacks registrados por classe de modelo
+_callbacks = {}
+
+
+class Change:
+    """
+    Alteração de um registro.
+
+    Args:
+        op (str): INSERT, UPDATE ou DELETE
+        values (dict): Valores das colunas após a alteração (antes, no DELETE)
+        old_values (dict): Valores anteriores das colunas alteradas (UPDATE)
+    """
+    def __init__(self, op, values, old_values=None):
+        self.op = op
+        self.values = values
+        self.old_values = old_values or {}
+
+    @property
+    def previous(self):
+        """Valores das colunas antes da alteração"""
+        return {**self.values, **self.old_values}
+
+    def __repr__(self):
+        return f'<Change {self.op} {self.values}>'
+
+
+def on_commit(model, callback):
+    """
+    Registra um callback chamado após cada COMMIT que altere registros do modelo.
+
+    Args:
+        model: Classe do modelo (ex.: Pessoa)
+        callback: Função que recebe a lista de Change do modelo, na ordem do flush
+    """
+    _callbacks.setdefault(model, []).append(callback)
+
+
+def record_change(session, model, op, values, old_values=None):
+    """
+    Registra manualmente uma alteração feita fora do ORM (ex.: UPDATE em lote
+    com query.update()), para que os callbacks sejam avisados no COMMIT.
+    """
+    if model in _callbacks:
+        session.info.setdefault(_PENDING_KEY, []).append((model, Change(op, values, old_values)))
+
+
+def _snapshot(obj, mapper):
+    state = inspect(obj)
+    return {
+        attr.key: state.dict.get(attr.key)
+        for attr in mapper.column_attrs
+    }
+
+
+def _old_values(obj, mapper):
+    """Valores anteriores das colunas alteradas (vazio se nenhuma coluna mudou)"""
+    state = inspect(obj)
+    old = {}
+    for attr in mapper.column_attrs:
+        history = state.attrs[attr.key].history
+        if history.has_changes():
+            old[attr.key] = history.deleted[0] if history.deleted else None
+    return old
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    # No after_flush as listas new/dirty/deleted e o histórico dos atributos
+    # ainda refletem o estado anterior ao flush, e as chaves geradas já existem
+    pending = session.info.setdefault(_PENDING_KEY, [])
+
+    for obj in session.new:
+        mapper = inspect(obj).mapper
+        if mapper.class_ in _callbacks:
+            pending.append((mapper.class_, Change(INSERT, _snapshot(obj, mapper))))
+
+    for obj in session.dirty:
+        mapper = inspect(obj).mapper
+        if mapper.class_ in _callbacks:
+            old_values = _old_values(obj, mapper)
+            if old_values:
+                pending.append((mapper.class_, Change(UPDATE, _snapshot(obj, mapper), old_values)))
+
+    for obj in session.deleted:
+        mapper = inspect(obj).mapper
+        if mapper.class_ in _callbacks:
+            pending.append((mapper.class_, Change(DELETE, _snapshot(obj, mapper))))
+
+
+@event.listens_for(Session, 'after_commit')
+def _dispatch(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+
+    by_model = {}
+    for model, change in pending:
+        by_model.setdefault(model, []).append(change)
+
+    for model, changes in by_model.items():
+        for callback in _callbacks.get(model, []):
+            # O COMMIT já aconteceu: uma falha no callback não pode virar erro
+            # para o usuário, apenas fica registrada
+            try:
+                callback(changes)
+            except Exception:
+                logger.exception(f'Erro no callback de commit {callback.__name__} para {model.__name__}')
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard(session):
+    session.info.pop(_PENDING_KEY, None)
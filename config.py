@@ -79,6 +79,29 @@ class Config:
     # Configurações de logging (mantendo sua edição anterior)
     LOG_TO_STDOUT = os.environ.get('LOG_TO_STDOUT')
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    
+    # Cache dos relatórios em PDF (arquivos em disco, limitado por tamanho)
+    REPORT_CACHE_DIR = os.environ.get('REPORT_CACHE_DIR') or \
+        os.path.join(basedir, 'instance', 'relatorios')
+    REPORT_CACHE_MAX_MB = int(os.getenv('REPORT_CACHE_MAX_MB', '200'))
+    
+    # Geração de relatórios em segundo plano (threads por worker do gunicorn)
+    REPORT_JOB_WORKERS = int(os.getenv('REPORT_JOB_WORKERS', '2'))
+    REPORT_JOB_QUEUE = int(os.getenv('REPORT_JOB_QUEUE', '8'))
+    
+    # Threads por worker que redimensionam as imagens enviadas das entregas
+    IMAGE_JOB_WORKERS = int(os.getenv('IMAGE_JOB_WORKERS', '2'))
+    
+    # Repositório das imagens enviadas das entregas (arquivos nomeados pelo
+    # hash do conteúdo, fora de static/)
+    UPLOAD_STORE_DIR = os.environ.get('UPLOAD_STORE_DIR') or \
+        os.path.join(basedir, 'instance', 'uploads', 'entregas')
+    
+    # Envio das imagens das entregas depois da checagem de login: '' (pelo
+    # Python), 'x-accel' (nginx: IMAGE_ACCEL_PREFIX é uma location internal
+    # apontando para UPLOAD_STORE_DIR) ou 'x-sendfile' (Apache/lighttpd)
+    IMAGE_SENDFILE = os.getenv('IMAGE_SENDFILE', '').lower()
+    IMAGE_ACCEL_PREFIX = os.getenv('IMAGE_ACCEL_PREFIX', '/_imagens_entregas/')
 
     @classmethod
     def validate_email_config(cls):
@@ -0,0 +1,154 @@
+"""
+Contadores do painel da portaria: pessoas no campus, entregas e
+correspondências pendentes e ocorrências do dia por gravidade.
+
+Cada worker guarda os contadores em memória. Os commits deste worker os
+ajustam na hora (commit_hooks); as alterações dos outros workers aparecem
+quando os contadores expiram (COUNTERS_TTL) e são recalculados. O recálculo
+só lê índices parciais (registros em aberto) e o índice por data das
+ocorrências, nunca a tabela inteira; a página do painel apenas lê a memória.
+"""
+import threading
+import time
+
+from sqlalchemy import func, or_
+
+from app import db
+from commit_hooks import on_commit, INSERT, UPDATE, DELETE
+from models import Ingresso, Entrega, Correspondencia, Ocorrencia
+from utils import get_brasil_datetime
+
+# Validade dos contadores em segundos (alterações feitas em outros workers)
+COUNTERS_TTL = 30
+
+GRAVIDADES = ['baixa', 'media', 'alta', 'critica']
+
+
+def _ingresso_aberto(values):
+    return values.get('saida') is None
+
+
+def _entrega_pendente(values):
+    return values.get('data_envio') is None or values.get('hora_envio') is None
+
+
+def _correspondencia_pendente(values):
+    return values.get('data_destinacao') is None or values.get('hora_destinacao') is None
+
+
+class DashboardCounters:
+    """Contadores do painel, recalculados a cada COUNTERS_TTL segundos"""
+    def __init__(self, ttl=COUNTERS_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._values = None
+        self._loaded_at = None
+        self._day = None
+
+    def _load(self):
+        """Recalcula os contadores a partir dos índices parciais e do índice por data"""
+        hoje = get_brasil_datetime().date()
+        no_campus = db.session.query(func.count(Ingresso.cpf)).filter(
+            Ingresso.saida.is_(None)
+        ).scalar()
+        entregas = db.session.query(func.count(Entrega.id)).filter(
+            or_(Entrega.data_envio.is_(None), Entrega.hora_envio.is_(None))
+        ).scalar()
+        correspondencias = db.session.query(func.count(Correspondencia.id_correspondencia)).filter(
+            or_(Correspondencia.data_destinacao.is_(None), Correspondencia.hora_destinacao.is_(None))
+        ).scalar()
+        ocorrencias = dict(
+            db.session.query(Ocorrencia.gravidade, func.count(Ocorrencia.id_ocorrencia)).filter(
+                Ocorrencia.data_registro == hoje
+            ).group_by(Ocorrencia.gravidade).all()
+        )
+
+        values = {
+            'no_campus': no_campus,
+            'entregas_pendentes': entregas,
+            'correspondencias_pendentes': correspondencias,
+            'ocorrencias_hoje': {gravidade: ocorrencias.pop(gravidade, 0) for gravidade in GRAVIDADES},
+        }
+        # Gravidades fora da lista (registros antigos) também são mostradas
+        for gravidade, quantidade in ocorrencias.items():
+            values['ocorrencias_hoje'][gravidade or 'sem gravidade'] = quantidade
+
+        with self._lock:
+            self._values = values
+            self._loaded_at = time.monotonic()
+            self._day = hoje
+
+    def snapshot(self):
+        """
+        Cópia dos contadores atuais (recalcula se expiraram ou se o dia mudou).
+
+        Returns:
+            dict: no_campus, entregas_pendentes, correspondencias_pendentes,
+            ocorrencias_hoje ({gravidade: quantidade}) e atualizado_ha (segundos)
+        """
+        if (self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl
+                or self._day != get_brasil_datetime().date()):
+            self._load()
+        with self._lock:
+            values = dict(self._values)
+            values['ocorrencias_hoje'] = dict(self._values['ocorrencias_hoje'])
+            values['atualizado_ha'] = round(time.monotonic() - self._loaded_at, 1)
+        return values
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def adjust(self, name, delta):
+        """Soma `delta` ao contador (ignorado enquanto os contadores não foram carregados)"""
+        if not delta:
+            return
+        with self._lock:
+            if self._values is not None:
+                self._values[name] = max(0, self._values[name] + delta)
+
+    def adjust_ocorrencia(self, dia, gravidade, delta):
+        """Soma `delta` às ocorrências do dia, se `dia` for o dia dos contadores"""
+        with self._lock:
+            if self._values is None or dia != self._day:
+                return
+            gravidade = gravidade or 'sem gravidade'
+            ocorrencias = self._values['ocorrencias_hoje']
+            ocorrencias[gravidade] = max(0, ocorrencias.get(gravidade, 0) + delta)
+
+
+dashboard_counters = DashboardCounters()
+
+
+def _open_delta(change, is_open):
+    """+1 se o registro passou a estar em aberto, -1 se deixou de estar"""
+    if change.op == INSERT:
+        return 1 if is_open(change.values) else 0
+    if change.op == DELETE:
+        return -1 if is_open(change.values) else 0
+    return int(is_open(change.values)) - int(is_open(change.previous))
+
+
+def _counter_updater(name, is_open):
+    def update(changes):
+        dashboard_counters.adjust(name, sum(_open_delta(change, is_open) for change in changes))
+    update.__name__ = f'_atualizar_{name}'
+    return update
+
+
+on_commit(Ingresso, _counter_updater('no_campus', _ingresso_aberto))
+on_commit(Entrega, _counter_updater('entregas_pendentes', _entrega_pendente))
+on_commit(Correspondencia, _counter_updater('correspondencias_pendentes', _correspondencia_pendente))
+
+
+def _atualizar_ocorrencias(changes):
+    for change in changes:
+        if change.op in (UPDATE, DELETE):
+            before = change.previous
+            dashboard_counters.adjust_ocorrencia(before.get('data_registro'), before.get('gravidade'), -1)
+        if change.op in (INSERT, UPDATE):
+            after = change.values
+            dashboard_counters.adjust_ocorrencia(after.get('data_registro'), after.get('gravidade'), 1)
+
+
+on_commit(Ocorrencia, _atualizar_ocorrencias)
@@ -0,0 +1,106 @@
+"""
+Versão dos dados de cada tabela, compartilhada entre os workers pelo banco.
+
+Toda transação que insere, altera ou exclui registros de uma tabela
+acompanhada incrementa o contador dela em data_versions, na mesma transação.
+Um cache cuja chave inclui as versões das tabelas de origem fica inválido
+automaticamente no primeiro COMMIT que as altere, em qualquer worker.
+
+Uso:
+    track('ingressos', 'pessoas')
+    versions(['ingressos', 'pessoas'])   # {'ingressos': 12, 'pessoas': 3}
+"""
+import logging
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from models import DataVersion
+
+logger = logging.getLogger(__name__)
+
+# Tabelas cujas alterações incrementam a versão
+_tracked = set()
+
+# Engines em que a tabela data_versions existe (conferido uma vez por engine)
+_available = {}
+
+
+def track(*tables):
+    """Passa a contar as alterações das tabelas informadas"""
+    _tracked.update(tables)
+
+
+def _is_available(connection):
+    engine = connection.engine
+    if engine not in _available:
+        _available[engine] = inspect(connection).has_table(DataVersion.__tablename__)
+        if not _available[engine]:
+            logger.warning('Tabela data_versions não encontrada; execute python migrations.py upgrade')
+    return _available[engine]
+
+
+def dialect_insert(dialect_name):
+    """insert() do dialeto, com suporte a ON CONFLICT (PostgreSQL e SQLite)"""
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def _bump(connection, tables):
+    """Incrementa a versão das tabelas (cria a linha na primeira alteração)"""
+    if not tables or not _is_available(connection):
+        return
+    table = DataVersion.__table__
+    insert = dialect_insert(connection.dialect.name)
+    # Ordem fixa para que transações concorrentes travem as linhas na mesma ordem
+    stmt = insert(table).values([{'tabela': name, 'versao': 1} for name in sorted(tables)])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.tabela],
+        set_={'versao': table.c.versao + 1}
+    )
+    connection.execute(stmt)
+
+
+def versions(tables):
+    """
+    Versão atual de cada tabela.
+
+    Returns:
+        dict: {tabela: versão}; None se a tabela data_versions não existir
+    """
+    from app import db
+    connection = db.session.connection()
+    if not _is_available(connection):
+        return None
+    rows = db.session.query(DataVersion.tabela, DataVersion.versao).filter(
+        DataVersion.tabela.in_(list(tables))
+    ).all()
+    current = {name: 0 for name in tables}
+    current.update(rows)
+    return current
+
+
+@event.listens_for(Session, 'after_flush')
+def _flushed_tables(session, flush_context):
+    # new/dirty/deleted ainda refletem o que acabou de ser gravado
+    tables = set()
+    for obj in list(session.new) + list(session.deleted):
+        tables.add(inspect(obj).mapper.local_table.name)
+    for obj in session.dirty:
+        if session.is_modified(obj, include_collections=False):
+            tables.add(inspect(obj).mapper.local_table.name)
+    _bump(session.connection(), tables & _tracked)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _bulk_statement(orm_execute_state):
+    # INSERT/UPDATE/DELETE em lote (query.update(), session.execute(update(...)))
+    # não passam pelo flush
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update
+            or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and mapper.local_table.name in _tracked:
+        _bump(orm_execute_state.session.connection(), {mapper.local_table.name})
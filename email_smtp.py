@@ -207,7 +207,7 @@ class EmailSender:
         
         # Status de saída formatado com estilo
         if ingresso.saida:
-            status_saida = f'<span style="color: green;">{ingresso.saida}</span>'
+            status_saida = f'<span style="color: green;">{ingresso.saida.strftime("%H:%M")}</span>'
         else:
             status_saida = '<span style="color: orange; font-style: italic;">Não registrada</span>'
         
@@ -238,8 +238,8 @@ class EmailSender:
                         
                         <h3>Informações do Ingresso:</h3>
                         <div style="background-color: #f5f5f5; padding: 10px; border-radius: 5px;">
-                            <p><strong>Data:</strong> {ingresso.data}</p>
-                            <p><strong>Entrada:</strong> <span style="color: blue;">{ingresso.entrada}</span></p>
+                            <p><strong>Data:</strong> {ingresso.data.strftime('%d/%m/%Y')}</p>
+                            <p><strong>Entrada:</strong> <span style="color: blue;">{ingresso.entrada.strftime('%H:%M')}</span></p>
                             <p><strong>Saída:</strong> {status_saida}</p>
                             <p><strong>Motivo:</strong> {ingresso.motivo}</p>
                             <p><strong>Pessoa/Setor:</strong> {ingresso.pessoa_setor}</p>
@@ -433,8 +433,8 @@ class EmailSender:
                         <p><strong>Telefone:</strong> {empresa.telefone_empresa or "-"}</p>
                         
                         <h3>Informações da Entrega:</h3>
-                        <p><strong>Data de Registro:</strong> {entrega.data_registro}</p>
-                        <p><strong>Hora de Registro:</strong> {entrega.hora_registro}</p>
+                        <p><strong>Data de Registro:</strong> {entrega.data_registro.strftime('%d/%m/%Y')}</p>
+                        <p><strong>Hora de Registro:</strong> {entrega.hora_registro.strftime('%H:%M')}</p>
                         <p><strong>Nota Fiscal:</strong> {entrega.nota_fiscal or "-"}</p>
                         <p><strong>Observações:</strong> {entrega.observacoes or "-"}</p>
                         <p><em>Email enviado em: {diaehoradeenvio}</em></p>
@@ -128,11 +128,21 @@ class PessoaForm(FlaskForm):
     empresa = StringField('Empresa', validators=[Optional(), Length(max=100)])
     submit = SubmitField('Salvar')
 
+class CrachasForm(FlaskForm):
+    cpfs = TextAreaField('CPFs (um por linha)', validators=[Optional()])
+    empresa = StringField('Ou todas as pessoas da empresa', validators=[Optional(), Length(max=100)])
+    por_pagina = SelectField('Crachás por página', choices=[
+        ('4', '4 por página'),
+        ('8', '8 por página'),
+        ('10', '10 por página')
+    ], default='8')
+    submit = SubmitField('Gerar Crachás')
+
 class IngressoForm(FlaskForm):
     cpf = StringField('CPF', validators=[DataRequired(), validate_cpf])
-    data = StringField('Data', validators=[DataRequired()])
-    entrada = StringField('Entrada', validators=[DataRequired()])
-    saida = StringField('Saída', validators=[Optional()])
+    data = DateField('Data', validators=[DataRequired()], format='%d/%m/%Y')
+    entrada = TimeField('Entrada', validators=[DataRequired()], format='%H:%M')
+    saida = TimeField('Saída', validators=[Optional()], format='%H:%M')
     motivo = StringField('Motivo', validators=[DataRequired(), Length(max=200)])
     pessoa_setor = StringField('Pessoa/Setor', validators=[DataRequired(), Length(max=100)])
     observacoes = TextAreaField('Observações', validators=[Optional()])
@@ -149,10 +159,10 @@ class EmpresaForm(FlaskForm):
 
 class EntregaForm(FlaskForm):
     cnpj = StringField('CNPJ', validators=[DataRequired(), validate_cnpj])
-    data_registro = StringField('Data de Registro', validators=[DataRequired()])
-    hora_registro = StringField('Hora de Registro', validators=[DataRequired()])
-    data_envio = StringField('Data da Entrega', validators=[Optional()])
-    hora_envio = StringField('Hora da Entrega', validators=[Optional()])
+    data_registro = DateField('Data de Registro', validators=[DataRequired()], format='%d/%m/%Y')
+    hora_registro = TimeField('Hora de Registro', validators=[DataRequired()], format='%H:%M')
+    data_envio = DateField('Data da Entrega', validators=[Optional()], format='%d/%m/%Y')
+    hora_envio = TimeField('Hora da Entrega', validators=[Optional()], format='%H:%M')
     nota_fiscal = StringField('Nota Fiscal', validators=[Optional(), Length(max=50)])
     imagens = MultipleFileField('Imagens da Entrega', validators=[Optional()])
     observacoes = TextAreaField('Observações', validators=[Optional()])
@@ -201,4 +211,11 @@ class RelatorioForm(FlaskForm):
     ], validators=[DataRequired()])
     data_inicio = DateField('Data Início', validators=[DataRequired()], format='%Y-%m-%d')
     data_fim = DateField('Data Fim', validators=[DataRequired()], format='%Y-%m-%d')
+    formato = SelectField('Formato', choices=[
+        ('pdf', 'PDF'),
+        ('csv', 'CSV (planilha)'),
+        ('xlsx', 'Excel (XLSX)'),
+        ('jsonl', 'JSON-lines')
+    ], default='pdf', validators=[DataRequired()])
+    segundo_plano = BooleanField('Gerar o PDF em segundo plano', default=True)
     submit = SubmitField('Gerar Relatório')
@@ -0,0 +1,568 @@
+"""
+Processamento das imagens das entregas em segundo plano.
+
+As fotos enviadas são gravadas como chegaram no repositório endereçado pelo
+conteúdo (upload_store) e registradas com status pendente; a requisição
+termina em seguida. Um pool pequeno de
+threads de cada worker do gunicorn gera as versões reduzidas (o PIL libera o
+GIL durante a decodificação e o redimensionamento) e marca a imagem como
+pronta. Enquanto isso as telas mostram um marcador no lugar da imagem.
+
+Versões de cada imagem (no repositório, ao lado do original: <hash>.<tamanho>.<formato>):
+    miniatura  ~160 px no maior lado, para as listagens
+    previa     800 px no maior lado, para ver a imagem
+    original   o arquivo enviado, sem alterações
+A miniatura e a prévia são gravadas em WebP e em JPEG progressivo (para
+navegadores sem WebP e para os anexos do e-mail), na orientação do EXIF e sem
+metadados além do perfil de cor. As fotos JPEG são decodificadas já em
+resolução reduzida (load_for_derivatives), sem gerar os pixels descartados. As
+versões nunca são geradas na requisição: se faltarem para uma imagem pronta
+(arquivo removido, imagem anterior às versões reduzidas), ela volta para a
+fila (requeue_missing).
+
+A mesma foto enviada mais de uma vez é gravada e processada uma vez só: as
+imagens com o mesmo content_hash compartilham os arquivos, que são removidos
+depois do commit que exclui a última delas (release), inclusive nas exclusões
+em cascata de entregas e empresas. O que sobrar de uma falha nessa etapa sai
+pela limpeza de órfãos (storage_gc).
+
+Cada imagem é reservada com um UPDATE condicional (pendente -> processando),
+então nunca é processada duas vezes, mesmo quando mais de um worker a coloca
+na fila. Imagens pendentes há mais de RESUBMIT_AFTER (worker reiniciado) são
+recolocadas na fila pela consulta de status (resume_stale).
+
+O e-mail de notificação de uma entrega nova é enviado pelo próprio pool quando
+a última imagem dela termina de ser processada.
+
+Uso:
+    python image_jobs.py benchmark [-n 5] [--arquivo foto.jpg]   # decodificação completa x reduzida
+"""
+import argparse
+import io
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from PIL import Image, ImageFilter, ImageOps
+from sqlalchemy import update, select
+
+from app import db, email_sender
+from commit_hooks import on_commit, DELETE
+from models import Entrega, EntregaImagem, Empresa
+from upload_store import upload_store, MIN_AGE
+
+logger = logging.getLogger(__name__)
+
+# Imagens antigas de um arquivo só por entrega (Entrega.imagem_filename)
+UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'static', 'uploads', 'entregas')
+
+PENDENTE = 'pendente'
+PROCESSANDO = 'processando'
+PRONTA = 'pronta'
+ERRO = 'erro'
+
+# Versões reduzidas: maior lado em pixels (da maior para a menor, cada uma
+# é reduzida a partir da anterior)
+MINIATURA = 'miniatura'
+PREVIA = 'previa'
+ORIGINAL = 'original'
+TAMANHOS = {
+    PREVIA: 800,
+    MINIATURA: 160,
+}
+
+# Tamanho mínimo da decodificação reduzida (draft) em relação à maior versão.
+# A redução do decodificador de JPEG (no domínio da DCT) já é filtrada, então
+# basta não decodificar menor que a prévia
+DRAFT_GAP = 1
+
+# Aumente ao mudar a geração das versões reduzidas (tamanhos, qualidade):
+# muda os ETags das versões já em cache nos navegadores
+DERIVATIVES_VERSION = 1
+
+WEBP = 'webp'
+JPEG = 'jpg'
+MIMETYPES = {
+    WEBP: 'image/webp',
+    JPEG: 'image/jpeg',
+}
+
+# Formatos aceitos no envio (conferidos pelo PIL, não pela extensão) e tipos
+# com que os originais podem ser servidos
+UPLOAD_FORMATS = {'JPEG', 'MPO', 'PNG', 'GIF'}
+ORIGINAL_MIMETYPES = {'image/jpeg', 'image/png', 'image/gif'}
+
+
+class InvalidImage(ValueError):
+    """Arquivo enviado que não é uma imagem em um dos UPLOAD_FORMATS"""
+
+
+# Imagem pendente (ou em processamento) há mais tempo que isso volta para a fila
+RESUBMIT_AFTER = timedelta(minutes=5)
+
+def derivative_path(content_hash, tamanho, formato):
+    """Caminho de uma versão reduzida da imagem no repositório"""
+    return upload_store().path(content_hash, f'.{tamanho}.{formato}')
+
+
+def has_derivatives(content_hash):
+    """Se todas as versões reduzidas do conteúdo já existem"""
+    return all(os.path.exists(derivative_path(content_hash, tamanho, formato))
+               for tamanho in TAMANHOS for formato in MIMETYPES)
+
+
+def _write(image, path, formato, icc_profile=None):
+    # Arquivo temporário e troca atômica: a imagem nunca é servida pela metade.
+    # O temporário tem nome único, já que duas imagens com o mesmo conteúdo
+    # podem ser processadas ao mesmo tempo. Só o perfil de cor é gravado;
+    # EXIF, XMP e comentários ficam de fora
+    with upload_store().temp_file() as f:
+        if formato == WEBP:
+            image.save(f, format='WEBP', quality=80, method=4, icc_profile=icc_profile)
+        else:
+            image.save(f, format='JPEG', quality=85, optimize=True, progressive=True,
+                       icc_profile=icc_profile)
+    os.replace(f.name, path)
+
+
+def load_for_derivatives(img, lado=max(TAMANHOS.values())):
+    """
+    Decodifica a imagem só na resolução necessária, já na orientação do EXIF.
+
+    Em JPEG o decodificador reduz por 1/2, 1/4 ou 1/8 direto dos coeficientes
+    (draft), sem gerar os pixels que seriam descartados, e o LANCZOS só faz o
+    ajuste final. Nos demais formatos o thumbnail reduz por fatores inteiros
+    (reduce) antes do LANCZOS.
+
+    Args:
+        img (Image): Imagem aberta e ainda não carregada
+        lado (int): Maior lado da maior versão gerada
+
+    Returns:
+        Image: Imagem RGB (transparência sobre fundo branco), sem metadados
+    """
+    width, height = img.size
+    scale = lado * DRAFT_GAP / max(width, height)
+    if scale < 1:
+        img.draft('RGB', (int(width * scale), int(height * scale)))
+
+    # Fotos de celular vêm deitadas com a rotação só no EXIF
+    image = ImageOps.exif_transpose(img)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        # Transparência sobre fundo branco (WebP/JPEG sem canal alfa)
+        rgba = image.convert('RGBA')
+        image = Image.new('RGB', rgba.size, (255, 255, 255))
+        image.paste(rgba, mask=rgba.getchannel('A'))
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+    image.info = {}
+    return image
+
+
+def make_derivatives(content_hash):
+    """
+    Gera a prévia e a miniatura (WebP e JPEG) de um original do repositório.
+
+    Args:
+        content_hash (str): Hash do original (EntregaImagem.content_hash)
+    """
+    source = upload_store().path(content_hash)
+    with Image.open(source) as img:
+        icc_profile = img.info.get('icc_profile')
+        image = load_for_derivatives(img)
+
+    for tamanho, lado in TAMANHOS.items():
+        image.thumbnail((lado, lado), Image.LANCZOS)
+        for formato in MIMETYPES:
+            _write(image, derivative_path(content_hash, tamanho, formato), formato, icc_profile)
+
+
+def image_etag(content_hash, tamanho, formato):
+    """
+    ETag forte de uma versão da imagem. As versões reduzidas são geradas
+    sempre do mesmo jeito a partir do original, então o hash dele (mais
+    DERIVATIVES_VERSION) identifica o conteúdo sem ler o arquivo.
+    """
+    if tamanho == ORIGINAL:
+        return content_hash
+    return f'{content_hash}-{tamanho}-{formato}-v{DERIVATIVES_VERSION}'
+
+
+def derivative_file(content_hash, tamanho, formato):
+    """
+    Arquivo de uma versão da imagem.
+
+    Returns:
+        str: Caminho do arquivo, ou None se ele não existe
+    """
+    if tamanho == ORIGINAL:
+        path = upload_store().path(content_hash)
+    else:
+        path = derivative_path(content_hash, tamanho, formato)
+    return path if os.path.exists(path) else None
+
+
+def save_upload(entrega_id, file_storage, filename):
+    """
+    Grava a foto como foi enviada e cria o registro (sem commit). Se o mesmo
+    conteúdo já foi enviado e processado, a imagem já nasce pronta.
+
+    Args:
+        entrega_id (int): Entrega da imagem
+        file_storage: Arquivo do formulário (werkzeug FileStorage)
+        filename (str): Nome final da imagem (já seguro)
+
+    Returns:
+        EntregaImagem: Imagem pendente (ou pronta), adicionada à sessão
+
+    Raises:
+        InvalidImage: O arquivo não é uma imagem que o PIL consiga abrir
+    """
+    # Só o cabeçalho e a estrutura são lidos (verify não decodifica os pixels)
+    try:
+        with Image.open(file_storage.stream) as img:
+            formato = img.format
+            img.verify()
+    except Exception as e:
+        raise InvalidImage(f'{filename}: {e}') from e
+    if formato not in UPLOAD_FORMATS:
+        raise InvalidImage(f'{filename}: formato {formato} não aceito')
+    file_storage.stream.seek(0)
+
+    content_hash = upload_store().put_stream(file_storage.stream)
+    imagem = EntregaImagem(entrega_id=entrega_id, filename=filename, content_hash=content_hash,
+                           status=PRONTA if has_derivatives(content_hash) else PENDENTE)
+    db.session.add(imagem)
+    return imagem
+
+
+def release(content_hashes):
+    """
+    Remove do repositório os arquivos que nenhuma imagem usa mais. Chamada
+    depois do commit da exclusão das imagens (em conexão própria, já que no
+    after_commit a sessão não executa SQL).
+
+    Conteúdos gravados há menos de MIN_AGE ficam para a limpeza de órfãos
+    (storage_gc): um envio concorrente do mesmo conteúdo reaproveita o
+    arquivo antes do commit do seu registro, e a consulta não o enxerga.
+
+    Returns:
+        int: Quantos conteúdos foram removidos
+    """
+    content_hashes = {content_hash for content_hash in content_hashes if content_hash}
+    if not content_hashes:
+        return 0
+    with db.engine.connect() as conn:
+        in_use = set(conn.execute(select(EntregaImagem.content_hash).where(
+            EntregaImagem.content_hash.in_(content_hashes)
+        ).distinct()).scalars())
+    store = upload_store()
+    removed = 0
+    for content_hash in content_hashes - in_use:
+        try:
+            if time.time() - os.stat(store.path(content_hash)).st_mtime < MIN_AGE:
+                continue
+        except FileNotFoundError:
+            pass  # Só restaram derivados
+        store.remove(content_hash)
+        removed += 1
+    return removed
+
+
+def _release_deleted(changes):
+    release(change.values['content_hash'] for change in changes if change.op == DELETE)
+
+
+def _remove_legacy_deleted(changes):
+    # Imagem antiga de um arquivo só (Entrega.imagem_filename)
+    for change in changes:
+        filename = change.values.get('imagem_filename')
+        if change.op == DELETE and filename:
+            path = os.path.join(UPLOAD_FOLDER, filename)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+on_commit(EntregaImagem, _release_deleted)
+on_commit(Entrega, _remove_legacy_deleted)
+
+
+def _update_image(image_id, current, **values):
+    """
+    Altera a imagem que está no status `current`, em uma transação própria.
+
+    Returns:
+        bool: Se a imagem estava nesse status (e foi alterada)
+    """
+    with db.engine.begin() as conn:
+        result = conn.execute(update(EntregaImagem.__table__).where(
+            EntregaImagem.id == image_id, EntregaImagem.status == current
+        ).values(**values))
+    return result.rowcount == 1
+
+
+def _process(image_id):
+    """Gera as versões reduzidas de uma imagem reservada; devolve o status final"""
+    if not _update_image(image_id, PENDENTE, status=PROCESSANDO):
+        return None  # Já processada por outra fila (ou excluída)
+
+    imagem = db.session.get(EntregaImagem, image_id)
+    filename, content_hash = imagem.filename, imagem.content_hash
+    db.session.commit()
+    try:
+        # Outra imagem com o mesmo conteúdo pode já ter gerado as versões
+        if not has_derivatives(content_hash):
+            make_derivatives(content_hash)
+    except Exception:
+        logger.exception(f'Erro ao processar a imagem {image_id} ({filename})')
+        _update_image(image_id, PROCESSANDO, status=ERRO)
+        return ERRO
+
+    if not _update_image(image_id, PROCESSANDO, status=PRONTA):
+        # Excluída durante o processamento
+        release([content_hash])
+        return None
+    return PRONTA
+
+
+def _send_email(entrega_id):
+    """E-mail de nova entrega com as imagens prontas anexadas"""
+    entrega = db.session.get(Entrega, entrega_id)
+    if entrega is None:
+        return
+    empresa = db.session.get(Empresa, entrega.cnpj)
+
+    # Prévias em JPEG (aceitas por qualquer cliente de e-mail)
+    email_imagens = []
+    for imagem in entrega.imagens:
+        if imagem.status != PRONTA or imagem.content_hash is None:
+            continue
+        imagem_path = derivative_path(imagem.content_hash, PREVIA, JPEG)
+        if os.path.exists(imagem_path):
+            email_imagens.append({
+                'filepath': imagem_path,
+                'filename': f'{os.path.splitext(imagem.filename)[0]}.jpg',
+                'type': MIMETYPES[JPEG]
+            })
+
+    success, response = email_sender.enviar_email_entrega(
+        entrega=entrega,
+        empresa=empresa,
+        imagens_paths=email_imagens
+    )
+    if success:
+        logger.info(f"Email enviado com sucesso para entrega ID {entrega_id}")
+    else:
+        logger.warning(f"Falha ao enviar email para entrega ID {entrega_id}: {response}")
+
+
+class _Notification:
+    """Imagens de uma entrega nova que faltam processar antes do e-mail"""
+    def __init__(self, entrega_id, image_ids):
+        self.entrega_id = entrega_id
+        self.remaining = set(image_ids)
+        self._lock = threading.Lock()
+
+    def done(self, image_id):
+        """Retorna True para a última imagem da entrega"""
+        with self._lock:
+            self.remaining.discard(image_id)
+            return not self.remaining
+
+
+# Imagens na fila ou em processamento neste worker
+_active = set()
+
+
+def _run(app, image_id, notification):
+    with app.app_context():
+        try:
+            _process(image_id)
+        except Exception:
+            logger.exception(f'Erro ao processar a imagem {image_id}')
+            db.session.rollback()
+        finally:
+            _active.discard(image_id)
+
+        try:
+            if notification is not None and notification.done(image_id):
+                _send_email(notification.entrega_id)
+        except Exception:
+            logger.exception(f'Erro ao enviar o e-mail da entrega {notification.entrega_id}')
+        finally:
+            db.session.remove()
+
+
+class ImageJobPool:
+    """Pool de threads que processa as imagens enviadas"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _start(self, app):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=app.config['IMAGE_JOB_WORKERS'],
+                                                    thread_name_prefix='imagens')
+
+    def submit(self, app, image_ids, notify_entrega_id=None):
+        """
+        Coloca as imagens (já gravadas com commit) na fila.
+
+        Args:
+            app: Aplicação Flask (para o contexto das threads)
+            image_ids (list): Ids das imagens pendentes
+            notify_entrega_id (int): Entrega que recebe o e-mail de notificação
+                quando todas as imagens terminarem
+        """
+        self._start(app)
+        notification = _Notification(notify_entrega_id, image_ids) if notify_entrega_id else None
+        for image_id in image_ids:
+            if image_id in _active:
+                continue
+            _active.add(image_id)
+            self._executor.submit(_run, app, image_id, notification)
+
+
+job_pool = ImageJobPool()
+
+
+def requeue_missing(app, content_hash):
+    """
+    Recoloca na fila as imagens prontas do conteúdo cujas versões reduzidas
+    não existem. Imagens com erro (original que o PIL não abre) ficam como
+    estão.
+
+    Returns:
+        int: Quantas imagens voltaram para a fila
+    """
+    image_ids = [image_id for (image_id,) in db.session.query(EntregaImagem.id).filter_by(
+        content_hash=content_hash, status=PRONTA
+    )]
+    db.session.commit()
+    image_ids = [image_id for image_id in image_ids if _update_image(image_id, PRONTA, status=PENDENTE)]
+    if image_ids:
+        job_pool.submit(app, image_ids)
+    return len(image_ids)
+
+
+def resume_stale(app, imagens):
+    """
+    Recoloca na fila as imagens pendentes há mais de RESUBMIT_AFTER que não
+    estão neste worker (o worker que as recebeu foi reiniciado).
+    """
+    limit = datetime.now() - RESUBMIT_AFTER
+    stale = [imagem for imagem in imagens
+             if imagem.status in (PENDENTE, PROCESSANDO) and imagem.id not in _active
+             and imagem.upload_date < limit]
+    for imagem in stale:
+        if imagem.status == PROCESSANDO:
+            _update_image(imagem.id, PROCESSANDO, status=PENDENTE)
+    if stale:
+        job_pool.submit(app, [imagem.id for imagem in stale])
+
+
+def _full_decode_preview(source):
+    # Caminho anterior (resize_image): decodifica a foto inteira e reduz com LANCZOS
+    with Image.open(source) as img:
+        width, height = img.size
+        target = (800, 600) if width > height else (600, 800)
+        ratio = min(target[0] / width, target[1] / height)
+        resized = img.resize((int(width * ratio), int(height * ratio)), Image.LANCZOS)
+        resized.save(io.BytesIO(), format='JPEG', quality=85, optimize=True)
+    return resized.size
+
+
+def _reduced_decode_preview(source):
+    with Image.open(source) as img:
+        image = load_for_derivatives(img)
+    image.thumbnail((TAMANHOS[PREVIA], TAMANHOS[PREVIA]), Image.LANCZOS)
+    image.save(io.BytesIO(), format='JPEG', quality=85, optimize=True, progressive=True)
+    return image.size
+
+
+_BENCHMARK_METHODS = {
+    'decodificação completa (resize_image anterior)': _full_decode_preview,
+    'decodificação reduzida (draft + EXIF)': _reduced_decode_preview,
+}
+
+
+def _memory_mb(field):
+    """VmRSS (atual) ou VmHWM (pico) deste processo, em MB"""
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _measure(name, source, n):
+    # Executado em um processo novo; o pico de memória é zerado antes (Linux),
+    # para não contar o das importações
+    method = _BENCHMARK_METHODS[name]
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+    baseline = _memory_mb('VmRSS')
+    start = time.perf_counter()
+    for _ in range(n):
+        size = method(source)
+    elapsed = time.perf_counter() - start
+    return elapsed / n, _memory_mb('VmHWM') - baseline, size
+
+
+def _sample_photo(path):
+    """Foto de 12 MP com textura (arquivo de tamanho realista) e rotação de 90° no EXIF"""
+    size = (4032, 3024)
+    image = Image.merge('RGB', (
+        Image.effect_noise(size, 10).filter(ImageFilter.GaussianBlur(2)),
+        Image.linear_gradient('L').resize(size),
+        Image.effect_noise(size, 20),
+    ))
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: girar 90° no sentido horário
+    image.save(path, format='JPEG', quality=92, exif=exif)
+
+
+def benchmark(n=5, source=None):
+    """Compara a geração da prévia com a decodificação completa e a reduzida"""
+    with tempfile.TemporaryDirectory() as folder:
+        if source is None:
+            source = os.path.join(folder, 'amostra.jpg')
+            _sample_photo(source)
+        with Image.open(source) as img:
+            print(f"Imagem: {img.size[0]}x{img.size[1]} {img.format}, "
+                  f"{os.path.getsize(source) / 1024 / 1024:.1f} MB, {n} repetições")
+
+        context = multiprocessing.get_context('spawn')
+        for name in _BENCHMARK_METHODS:
+            with context.Pool(1) as pool:
+                seconds, memory, size = pool.apply(_measure, (name, source, n))
+            print(f"{name}: {seconds * 1000:.0f} ms/foto ({1 / seconds:.1f} fotos/s), "
+                  f"pico de memória +{memory:.0f} MB, resultado {size[0]}x{size[1]}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Processamento das imagens das entregas')
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+    benchmark_parser = subparsers.add_parser('benchmark', help='Mede a geração da prévia de uma foto')
+    benchmark_parser.add_argument('-n', type=int, default=5, help='Repetições por método')
+    benchmark_parser.add_argument('--arquivo', help='Foto a usar (padrão: foto sintética de 12 MP)')
+    args = parser.parse_args(argv)
+
+    if args.comando == 'benchmark':
+        benchmark(args.n, args.arquivo)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
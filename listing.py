@@ -0,0 +1,368 @@
+"""
+Motor de listagem paginada no servidor para as telas de índice.
+
+Implementa o protocolo server-side do DataTables (draw, start, length,
+order, search e columns) sobre uma consulta SQLAlchemy, de modo que cada
+requisição carregue apenas a página exibida em vez da tabela inteira, e a
+paginação por cursor (keyset) usada nos históricos longos.
+"""
+import re
+from datetime import date, datetime, time
+from flask import jsonify, url_for, current_app
+from sqlalchemy import String, and_, cast, false, or_, tuple_
+
+from utils import only_digits, normalize_search
+
+# Tamanho padrão da página e limite máximo aceito do cliente
+DEFAULT_PAGE_LENGTH = 10
+MAX_PAGE_LENGTH = 100
+
+_NUMERIC_RE = re.compile(r'[0-9.\-/ ]+')
+_DATE_BR_RE = re.compile(r'^(\d{2})/(\d{2})(?:/(\d{4}))?$')
+
+
+def _search_term(value):
+    """
+    Converte datas digitadas no formato brasileiro (DD/MM ou DD/MM/AAAA) para o
+    formato ISO em que as colunas Date são comparadas como texto.
+    """
+    match = _DATE_BR_RE.match(value)
+    if not match:
+        return value
+    day, month, year = match.groups()
+    return f'{year}-{month}-{day}' if year else f'{month}-{day}'
+
+
+def _escape_like(value):
+    """Escapa os curingas do LIKE (% e _) para que sejam procurados como texto"""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_digits(value):
+    """
+    Termo de pesquisa das colunas só com dígitos (CPF, CNPJ): os dígitos do
+    termo, ou vazio se ele tiver letras.
+    """
+    return only_digits(value) if _NUMERIC_RE.fullmatch(value) else ''
+
+
+def starts_with(expression, prefix):
+    """
+    Filtro "começa com" que aproveita o índice B-tree da coluna.
+
+    No PostgreSQL gera LIKE 'prefixo%' (índice com varchar_pattern_ops). No
+    SQLite o LIKE é case-insensitive e não usa o índice, então o filtro vira o
+    intervalo prefixo <= coluna < prefixo seguinte, equivalente para as
+    colunas de busca (já normalizadas em minúsculas).
+    """
+    from app import db
+    if db.engine.dialect.name == 'sqlite':
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return and_(expression >= prefix, expression < upper)
+    return expression.startswith(prefix, autoescape=True)
+
+
+class Column:
+    """
+    Coluna de uma listagem.
+
+    Args:
+        cell (str): Macro do template parcial que renderiza a célula
+        expression: Expressão SQLAlchemy usada para ordenar e pesquisar
+                    (None para colunas apenas de exibição, como "Ações")
+        searchable (bool): Se a coluna participa da pesquisa
+        orderable (bool): Se a coluna pode ser ordenada
+        css_class (str): Classe CSS aplicada às células da coluna
+        search: Coluna indexada pesquisada pelo início (ex.: nome_normalizado);
+                sem ela, a pesquisa procura o termo em qualquer parte do texto
+        normalize: Converte o termo para o formato de `search` (padrão:
+                   normalize_search; search_digits para CPF e CNPJ)
+    """
+    def __init__(self, cell, expression=None, searchable=True, orderable=True, css_class=None,
+                 search=None, normalize=normalize_search):
+        self.cell = cell
+        self.expression = expression
+        self.searchable = searchable and expression is not None
+        self.orderable = orderable and expression is not None
+        self.css_class = css_class
+        self.search = search
+        self.normalize = normalize
+
+    def search_condition(self, value):
+        """Condição da pesquisa pelo termo, ou None se o termo não se aplica à coluna"""
+        if self.search is not None:
+            term = self.normalize(value)
+            return starts_with(self.search, term) if term else None
+        term = _escape_like(_search_term(value))
+        return cast(self.expression, String).ilike(f'%{term}%', escape='\\')
+
+
+class Page:
+    """Resultado de uma consulta paginada"""
+    def __init__(self, items, total, filtered, start, length):
+        self.items = items
+        self.total = total
+        self.filtered = filtered
+        self.start = start
+        self.length = length
+
+
+class ServerSideListing:
+    """
+    Listagem paginada no servidor compartilhada pelos blueprints.
+
+    Args:
+        endpoint (str): Endpoint JSON que responde ao DataTables
+        template (str): Template com uma macro por célula (Column.cell), as
+                        mesmas usadas nas linhas (_linhas.html) da tela HTML
+        columns (list): Lista de Column, na mesma ordem das colunas da tabela
+        default_order (list): Lista de (índice da coluna, 'asc'|'desc')
+        tiebreaker: Expressão usada para desempate (normalmente a chave primária)
+    """
+    def __init__(self, endpoint, template, columns, default_order, tiebreaker):
+        self.endpoint = endpoint
+        self.template = template
+        self.columns = columns
+        self.default_order = default_order
+        self.tiebreaker = tiebreaker
+
+    def _parse_int(self, value, default):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return default
+
+    def _apply_search(self, query, args):
+        """
+        Aplica a pesquisa global e as pesquisas por coluna. Um termo que não
+        se aplica a nenhuma coluna (ex.: letras em uma coluna de CPF) não
+        encontra registros.
+        """
+        search_value = (args.get('search[value]') or '').strip()
+        if search_value:
+            conditions = [
+                column.search_condition(search_value)
+                for column in self.columns if column.searchable
+            ]
+            conditions = [condition for condition in conditions if condition is not None]
+            query = query.filter(or_(*conditions) if conditions else false())
+
+        for index, column in enumerate(self.columns):
+            column_value = (args.get(f'columns[{index}][search][value]') or '').strip()
+            if column_value and column.searchable:
+                condition = column.search_condition(column_value)
+                query = query.filter(condition if condition is not None else false())
+
+        return query
+
+    def _order_clauses(self, args):
+        """Monta a cláusula ORDER BY a partir dos parâmetros order[i]"""
+        requested = []
+        i = 0
+        while f'order[{i}][column]' in args:
+            index = self._parse_int(args.get(f'order[{i}][column]'), -1)
+            direction = args.get(f'order[{i}][dir]', 'asc')
+            requested.append((index, direction))
+            i += 1
+
+        clauses = []
+        for index, direction in requested or self.default_order:
+            if 0 <= index < len(self.columns) and self.columns[index].orderable:
+                expression = self.columns[index].expression
+                clauses.append(expression.desc() if direction == 'desc' else expression.asc())
+
+        if not clauses:
+            for index, direction in self.default_order:
+                expression = self.columns[index].expression
+                clauses.append(expression.desc() if direction == 'desc' else expression.asc())
+
+        # Desempate estável para que registros não se repitam entre páginas
+        clauses.append(self.tiebreaker.desc())
+        return clauses
+
+    def paginate(self, query, args=None):
+        """
+        Executa a consulta paginada.
+
+        Args:
+            query: Consulta base (já com os filtros fixos da tela)
+            args (dict): Parâmetros do DataTables (request.args)
+
+        Returns:
+            Page: Registros da página e contagens total/filtrada
+        """
+        args = args or {}
+        start = max(self._parse_int(args.get('start'), 0), 0)
+        length = self._parse_int(args.get('length'), DEFAULT_PAGE_LENGTH)
+        if length <= 0 or length > MAX_PAGE_LENGTH:
+            length = MAX_PAGE_LENGTH
+
+        total = query.order_by(None).count()
+
+        filtered_query = self._apply_search(query, args)
+        if filtered_query is query:
+            filtered = total
+        else:
+            filtered = filtered_query.order_by(None).count()
+
+        items = (
+            filtered_query
+            .order_by(*self._order_clauses(args))
+            .offset(start)
+            .limit(length)
+            .all()
+        )
+        return Page(items, total, filtered, start, length)
+
+    def first_page(self, query, **url_args):
+        """
+        Retorna a primeira página e a configuração do DataTables para a tela HTML.
+
+        Args:
+            query: Consulta base
+            **url_args: Parâmetros extras repassados ao endpoint JSON (ex.: busca)
+
+        Returns:
+            tuple: (Page, dict de configuração para data-dt-config)
+        """
+        page = self.paginate(query)
+        config = {
+            'serverSide': True,
+            'processing': True,
+            'ajax': url_for(self.endpoint, **url_args),
+            'deferLoading': [page.filtered, page.total],
+            'pageLength': page.length,
+            'lengthMenu': [[10, 25, 50, MAX_PAGE_LENGTH], [10, 25, 50, MAX_PAGE_LENGTH]],
+            'order': [[index, direction] for index, direction in self.default_order],
+            'columns': [
+                {
+                    'orderable': column.orderable,
+                    'searchable': column.searchable,
+                    'className': column.css_class or '',
+                }
+                for column in self.columns
+            ],
+        }
+        return page, config
+
+    def render_rows(self, items):
+        """Renderiza cada célula com a macro da coluna"""
+        # Módulo sem contexto, criado uma vez pelo Jinja: as macros só usam
+        # os globais, e nenhuma referência aos registros fica no módulo
+        macros = current_app.jinja_env.get_template(self.template).module
+        cells = [getattr(macros, column.cell) for column in self.columns]
+        return [[str(cell(item)).strip() for cell in cells] for item in items]
+
+    def json_response(self, query, args):
+        """Resposta JSON no formato esperado pelo DataTables server-side"""
+        page = self.paginate(query, args)
+        return jsonify({
+            'draw': self._parse_int(args.get('draw'), 0),
+            'recordsTotal': page.total,
+            'recordsFiltered': page.filtered,
+            'data': self.render_rows(page.items),
+        })
+
+
+class KeysetPage:
+    """Resultado de uma consulta paginada por cursor"""
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_more(self):
+        return self.next_cursor is not None
+
+
+class InvalidCursor(ValueError):
+    """Cursor de continuação inválido ou adulterado"""
+
+
+class KeysetPaginator:
+    """
+    Paginação por cursor (keyset/seek) em ordem decrescente.
+
+    Em vez de OFFSET, cada página continua a partir da última chave da página
+    anterior usando uma comparação de tupla ((a, b, id) < (va, vb, vid)), de
+    modo que a página N custa o mesmo que a página 1 quando há um índice
+    sobre as colunas da chave.
+
+    Args:
+        name (str): Nome da paginação (usado como salt do token)
+        keys (list): Lista de (expressão SQLAlchemy, nome do atributo), a
+                     última chave deve ser única (normalmente a chave primária)
+    """
+    def __init__(self, name, keys):
+        self.name = name
+        self.keys = keys
+
+    def _serializer(self):
+        from itsdangerous import URLSafeSerializer
+        return URLSafeSerializer(current_app.config['SECRET_KEY'], salt=f'keyset-{self.name}')
+
+    def _encode_value(self, value):
+        if isinstance(value, datetime):
+            return {'dt': value.isoformat()}
+        if isinstance(value, date):
+            return {'d': value.isoformat()}
+        if isinstance(value, time):
+            return {'t': value.isoformat()}
+        return value
+
+    def _decode_value(self, value):
+        if isinstance(value, dict):
+            if 'dt' in value:
+                return datetime.fromisoformat(value['dt'])
+            if 'd' in value:
+                return date.fromisoformat(value['d'])
+            if 't' in value:
+                return time.fromisoformat(value['t'])
+        return value
+
+    def encode_cursor(self, item):
+        """Gera o token opaco a partir do último registro da página"""
+        values = [self._encode_value(getattr(item, attr)) for _, attr in self.keys]
+        return self._serializer().dumps(values)
+
+    def decode_cursor(self, cursor):
+        """Decodifica o token, levantando InvalidCursor se for inválido"""
+        from itsdangerous import BadSignature
+        try:
+            values = self._serializer().loads(cursor)
+        except BadSignature:
+            raise InvalidCursor('Cursor inválido.')
+        if not isinstance(values, list) or len(values) != len(self.keys):
+            raise InvalidCursor('Cursor inválido.')
+        try:
+            return [self._decode_value(value) for value in values]
+        except (TypeError, ValueError):
+            raise InvalidCursor('Cursor inválido.')
+
+    def paginate(self, query, cursor=None, limit=DEFAULT_PAGE_LENGTH):
+        """
+        Executa a consulta a partir do cursor.
+
+        Args:
+            query: Consulta base
+            cursor (str): Token devolvido pela página anterior (None para a primeira)
+            limit (int): Quantidade de registros por página
+
+        Returns:
+            KeysetPage: Registros e o cursor da próxima página (None se acabou)
+        """
+        limit = max(1, min(limit, MAX_PAGE_LENGTH))
+        expressions = [expression for expression, _ in self.keys]
+
+        if cursor:
+            values = self.decode_cursor(cursor)
+            query = query.filter(tuple_(*expressions) < tuple_(*values))
+
+        # Busca um registro a mais para saber se existe próxima página
+        items = query.order_by(*[e.desc() for e in expressions]).limit(limit + 1).all()
+
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            next_cursor = self.encode_cursor(items[-1])
+        return KeysetPage(items, next_cursor)
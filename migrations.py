@@ -1,90 +1,1024 @@
 """
-Script para realizar migrações no banco de dados
+Migrações versionadas do banco de dados
+
+Cada migração tem um número de versão, uma descrição e os passos up (aplicar)
+e down (reverter). A versão aplicada fica registrada na tabela schema_version,
+de modo que o script pode ser executado em qualquer ambiente e aplica apenas
+o que falta. Os passos são idempotentes: um banco antigo sem schema_version
+passa por todas as migrações e cada uma pula o que já estiver feito.
+
+Uso:
+    python migrations.py status               # versão atual e migrações pendentes
+    python migrations.py upgrade [versao]     # aplica até a versão (padrão: a mais recente)
+    python migrations.py downgrade <versao>   # reverte até a versão informada
+    python migrations.py verificar-indices    # confere com EXPLAIN se os índices são usados
 """
-from app import app, db
-from sqlalchemy import inspect, text
+import argparse
+import os
+import shutil
+import sys
+from datetime import datetime
+from app import create_app, db
+from utils import only_digits, normalize_search
+from sqlalchemy import (inspect, text, select, update, bindparam, MetaData, Table, Column,
+                        func, String, Integer, DateTime, Date, Time, or_)
+from sqlalchemy.sql import table, column
+
+app = create_app()
+
+# Tabela com o histórico das versões aplicadas (fora do db.metadata, para não
+# ser criada pelo create_all)
+schema_version = Table(
+    'schema_version', MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('description', String(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+# Pastas das imagens das entregas antes do repositório endereçado pelo conteúdo
+# (upload_store): nome do arquivo em originais/, versões reduzidas em
+# derivadas/<tamanho>/<nome>.<formato> e, nas versões mais antigas, só o
+# arquivo de 800x600 direto na pasta
+LEGACY_UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads', 'entregas')
+LEGACY_ORIGINAIS_FOLDER = os.path.join(LEGACY_UPLOAD_FOLDER, 'originais')
+LEGACY_DERIVADAS_FOLDER = os.path.join(LEGACY_UPLOAD_FOLDER, 'derivadas')
+LEGACY_DERIVATIVES = [(tamanho, formato) for tamanho in ('previa', 'miniatura') for formato in ('webp', 'jpg')]
+
+# Colunas de data/hora gravadas como texto (DD/MM/AAAA e HH:MM) que passam a ser tipadas
+DATE_TIME_COLUMNS = [
+    ('ingressos', 'data', Date, True),
+    ('ingressos', 'entrada', Time, True),
+    ('ingressos', 'saida', Time, False),
+    ('entregas', 'data_registro', Date, True),
+    ('entregas', 'hora_registro', Time, True),
+    ('entregas', 'data_envio', Date, False),
+    ('entregas', 'hora_envio', Time, False),
+]
+
+# Índices que dependem das colunas tipadas (ordenação e filtros por período)
+DATE_TIME_INDEXES = ['ix_ingressos_data_entrada', 'ix_entregas_data_hora']
+
+# Índices dos caminhos de consulta mais usados (declarados em models.py)
+HOT_PATH_INDEXES = [
+    'ix_ingressos_cpf',
+    'ix_ingressos_abertos',
+    'ix_entregas_cnpj',
+    'ix_entrega_imagens_entrega_id',
+    'ix_correspondencias_data_hora',
+    'ix_ocorrencias_data_hora',
+    'ix_pessoas_nome',
+]
+
+# Colunas de busca normalizadas:
+# (tabela, chave primária, coluna nova, tipo SQL, coluna de origem, normalização)
+SEARCH_COLUMNS = [
+    ('pessoas', 'cpf', 'cpf_digitos', 'VARCHAR(14)', 'cpf', only_digits),
+    ('pessoas', 'cpf', 'nome_normalizado', 'VARCHAR(100)', 'nome', normalize_search),
+    ('empresas', 'cnpj', 'cnpj_digitos', 'VARCHAR(18)', 'cnpj', only_digits),
+    ('empresas', 'cnpj', 'nome_normalizado', 'VARCHAR(100)', 'nome_empresa', normalize_search),
+]
+
+# Índices de busca por prefixo (declarados em models.py)
+SEARCH_INDEXES = [
+    'ix_pessoas_cpf_digitos',
+    'ix_pessoas_nome_normalizado',
+    'ix_empresas_cnpj_digitos',
+    'ix_empresas_nome_normalizado',
+]
+
+# Índices parciais dos registros pendentes, lidos pelos contadores do painel
+DASHBOARD_INDEXES = [
+    'ix_entregas_pendentes',
+    'ix_correspondencias_pendentes',
+]
+
+# Contagem de referências dos arquivos do repositório de uploads
+UPLOAD_STORE_INDEXES = [
+    'ix_entrega_imagens_content_hash',
+]
+
+# Índices de trigramas (pg_trgm) para busca por trecho do nome, só no
+# PostgreSQL: (nome, tabela, coluna)
+TRIGRAM_INDEXES = [
+    ('ix_pessoas_nome_trgm', 'pessoas', 'nome_normalizado'),
+    ('ix_empresas_nome_trgm', 'empresas', 'nome_normalizado'),
+]
+
+# Consulta representativa de cada índice, usada por verify_indexes(). Quando a
+# consulta depende do banco, é um dicionário por dialeto (os demais são ignorados)
+INDEX_CHECKS = [
+    ('ix_ingressos_data_entrada',
+     'SELECT id FROM ingressos WHERE data BETWEEN :inicio AND :fim ORDER BY data, entrada, id',
+     {'inicio': '2025-01-01', 'fim': '2025-01-31'}),
+    ('ix_ingressos_cpf',
+     'SELECT id, data, entrada, saida FROM ingressos WHERE cpf = :cpf',
+     {'cpf': '000.000.000-00'}),
+    ('ix_ingressos_abertos',
+     'SELECT cpf FROM ingressos WHERE saida IS NULL',
+     {}),
+    ('ix_entregas_data_hora',
+     'SELECT id FROM entregas WHERE data_registro BETWEEN :inicio AND :fim ORDER BY data_registro, hora_registro, id',
+     {'inicio': '2025-01-01', 'fim': '2025-01-31'}),
+    ('ix_entregas_cnpj',
+     'SELECT id FROM entregas WHERE cnpj = :cnpj',
+     {'cnpj': '00.000.000/0000-00'}),
+    ('ix_entrega_imagens_entrega_id',
+     'SELECT id, filename FROM entrega_imagens WHERE entrega_id = :entrega_id',
+     {'entrega_id': 0}),
+    ('ix_entrega_imagens_content_hash',
+     'SELECT DISTINCT content_hash FROM entrega_imagens WHERE content_hash IN (:content_hash)',
+     {'content_hash': '0' * 64}),
+    ('ix_entregas_pendentes',
+     'SELECT count(id) FROM entregas WHERE data_envio IS NULL OR hora_envio IS NULL',
+     {}),
+    ('ix_correspondencias_data_hora',
+     'SELECT id_correspondencia FROM correspondencias WHERE data_recebimento BETWEEN :inicio AND :fim',
+     {'inicio': '2025-01-01', 'fim': '2025-01-31'}),
+    ('ix_correspondencias_pendentes',
+     'SELECT count(id_correspondencia) FROM correspondencias '
+     'WHERE data_destinacao IS NULL OR hora_destinacao IS NULL',
+     {}),
+    ('ix_ocorrencias_data_hora',
+     'SELECT id_ocorrencia FROM ocorrencias WHERE data_registro BETWEEN :inicio AND :fim',
+     {'inicio': '2025-01-01', 'fim': '2025-01-31'}),
+    ('ix_pessoas_nome',
+     'SELECT cpf, nome FROM pessoas ORDER BY nome LIMIT 10',
+     {}),
+    ('ix_pessoas_cpf_digitos',
+     {'sqlite': 'SELECT cpf FROM pessoas WHERE cpf_digitos >= :inicio AND cpf_digitos < :fim',
+      'postgresql': 'SELECT cpf FROM pessoas WHERE cpf_digitos LIKE :prefixo'},
+     {'inicio': '123', 'fim': '124', 'prefixo': '123%'}),
+    ('ix_pessoas_nome_normalizado',
+     {'sqlite': 'SELECT cpf FROM pessoas WHERE nome_normalizado >= :inicio AND nome_normalizado < :fim',
+      'postgresql': 'SELECT cpf FROM pessoas WHERE nome_normalizado LIKE :prefixo'},
+     {'inicio': 'mar', 'fim': 'mas', 'prefixo': 'mar%'}),
+    ('ix_pessoas_nome_trgm',
+     {'postgresql': 'SELECT cpf FROM pessoas WHERE nome_normalizado LIKE :trecho'},
+     {'trecho': '% silva%'}),
+    ('ix_empresas_cnpj_digitos',
+     {'sqlite': 'SELECT cnpj FROM empresas WHERE cnpj_digitos >= :inicio AND cnpj_digitos < :fim',
+      'postgresql': 'SELECT cnpj FROM empresas WHERE cnpj_digitos LIKE :prefixo'},
+     {'inicio': '123', 'fim': '124', 'prefixo': '123%'}),
+    ('ix_empresas_nome_normalizado',
+     {'sqlite': 'SELECT cnpj FROM empresas WHERE nome_normalizado >= :inicio AND nome_normalizado < :fim',
+      'postgresql': 'SELECT cnpj FROM empresas WHERE nome_normalizado LIKE :prefixo'},
+     {'inicio': 'mer', 'fim': 'mes', 'prefixo': 'mer%'}),
+    ('ix_empresas_nome_trgm',
+     {'postgresql': 'SELECT cnpj FROM empresas WHERE nome_normalizado LIKE :trecho'},
+     {'trecho': '% comercio%'}),
+]
 
 def add_columns_to_user_table():
     """Adiciona novas colunas à tabela user."""
     print("Iniciando migração da tabela user...")
     
-    with app.app_context():
-        # Verifica se as colunas já existem
-        inspector = inspect(db.engine)
-        user_columns = [col['name'] for col in inspector.get_columns('user')]
-        
-        # Adiciona a coluna 'active' se não existir
-        if 'active' not in user_columns:
-            print("Adicionando coluna 'active' à tabela user...")
-            db.session.execute(text('ALTER TABLE "user" ADD COLUMN active BOOLEAN DEFAULT true'))
+    # Verifica se as colunas já existem
+    inspector = inspect(db.engine)
+    user_columns = [col['name'] for col in inspector.get_columns('user')]
+    
+    # Adiciona a coluna 'active' se não existir
+    if 'active' not in user_columns:
+        print("Adicionando coluna 'active' à tabela user...")
+        db.session.execute(text('ALTER TABLE "user" ADD COLUMN active BOOLEAN DEFAULT true'))
+        db.session.commit()
+        print("Coluna 'active' adicionada com sucesso!")
+    else:
+        print("Coluna 'active' já existe.")
+    
+    # Adiciona a coluna 'last_login' se não existir
+    if 'last_login' not in user_columns:
+        print("Adicionando coluna 'last_login' à tabela user...")
+        db.session.execute(text('ALTER TABLE "user" ADD COLUMN last_login TIMESTAMP'))
+        db.session.commit()
+        print("Coluna 'last_login' adicionada com sucesso!")
+    else:
+        print("Coluna 'last_login' já existe.")
+    
+    print("Migração concluída com sucesso!")
+
+def drop_user_columns():
+    """Remove as colunas adicionadas à tabela user."""
+    print("Revertendo migração da tabela user...")
+    
+    user_columns = [col['name'] for col in inspect(db.engine).get_columns('user')]
+    for column_name in ('last_login', 'active'):
+        if column_name in user_columns:
+            print(f"Removendo coluna '{column_name}' da tabela user...")
+            db.session.execute(text(f'ALTER TABLE "user" DROP COLUMN {column_name}'))
             db.session.commit()
-            print("Coluna 'active' adicionada com sucesso!")
-        else:
-            print("Coluna 'active' já existe.")
+    
+    print("Reversão concluída com sucesso!")
+
+def _entregas_cnpj_constraint():
+    """Nome da constraint entre entregas.cnpj e empresas (ou None)"""
+    for fk in inspect(db.engine).get_foreign_keys('entregas'):
+        if 'cnpj' in fk['constrained_columns'] and fk['referred_table'] == 'empresas':
+            return fk['name']
+    return None
+
+def revert_enterprise_relationships():
+    """Recria a constraint entre Entrega e Empresa sem CASCADE."""
+    print("Revertendo migração das relações entre Empresa e Entrega...")
+    
+    if db.engine.dialect.name == 'sqlite':
+        print("SQLite não permite alterar constraints, nada a fazer.")
+        return
+    
+    constraint_name = _entregas_cnpj_constraint()
+    if constraint_name:
+        db.session.execute(text(f'ALTER TABLE entregas DROP CONSTRAINT IF EXISTS {constraint_name}'))
+    db.session.execute(
+        text('ALTER TABLE entregas ADD CONSTRAINT fk_entregas_empresas ' +
+             'FOREIGN KEY (cnpj) REFERENCES empresas(cnpj)')
+    )
+    db.session.commit()
+    print("Constraint recriada sem CASCADE.")
+
+def update_enterprise_relationships():
+    """Atualiza as relações entre Empresa e Entrega para suporte a CASCADE."""
+    print("Iniciando migração das relações entre Empresa e Entrega...")
+    
+    if db.engine.dialect.name == 'sqlite':
+        # SQLite não permite alterar constraints; as tabelas criadas pelo
+        # create_all já declaram o ON DELETE CASCADE
+        print("SQLite não permite alterar constraints, nada a fazer.")
+        return
+    
+    try:
+        # Primeiro adicionar um novo constraint para a chave estrangeira com CASCADE
+        # Para isso, precisamos remover o constraint existente e criar um novo
         
-        # Adiciona a coluna 'last_login' se não existir
-        if 'last_login' not in user_columns:
-            print("Adicionando coluna 'last_login' à tabela user...")
-            db.session.execute(text('ALTER TABLE "user" ADD COLUMN last_login TIMESTAMP'))
+        # Verificar se a constraint existe
+        constraint_name = _entregas_cnpj_constraint()
+        
+        if constraint_name:
+            print(f"Removendo constraint: {constraint_name}...")
+            # Remover a constraint existente
+            db.session.execute(
+                text(f'ALTER TABLE entregas DROP CONSTRAINT IF EXISTS {constraint_name}')
+            )
+            db.session.commit()
+            
+            # Criar a nova constraint com CASCADE
+            print("Criando nova constraint com CASCADE...")
+            db.session.execute(
+                text('ALTER TABLE entregas ADD CONSTRAINT fk_entregas_empresas ' +
+                     'FOREIGN KEY (cnpj) REFERENCES empresas(cnpj) ON DELETE CASCADE')
+            )
             db.session.commit()
-            print("Coluna 'last_login' adicionada com sucesso!")
+            print("Constraint atualizada com sucesso!")
         else:
-            print("Coluna 'last_login' já existe.")
+            print("Nenhuma constraint entre entregas e empresas encontrada, criando nova...")
+            # Criar a nova constraint com CASCADE
+            db.session.execute(
+                text('ALTER TABLE entregas ADD CONSTRAINT fk_entregas_empresas ' +
+                     'FOREIGN KEY (cnpj) REFERENCES empresas(cnpj) ON DELETE CASCADE')
+            )
+            db.session.commit()
+            print("Nova constraint criada com sucesso!")
+            
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erro ao atualizar relações: {str(e)}")
+        raise
+    
+    print("Migração das relações concluída com sucesso!")
+
+def _parse_date(value):
+    """Converte uma data em texto (DD/MM/AAAA ou AAAA-MM-DD) para date"""
+    for fmt in ('%d/%m/%Y', '%Y-%m-%d', '%d/%m/%y'):
+        try:
+            return datetime.strptime(value.strip(), fmt).date()
+        except ValueError:
+            continue
+    return None
+
+def _parse_time(value):
+    """Converte um horário em texto (HH:MM ou HH:MM:SS) para time"""
+    for fmt in ('%H:%M', '%H:%M:%S', '%H:%M:%S.%f', '%Hh%M'):
+        try:
+            return datetime.strptime(value.strip(), fmt).time()
+        except ValueError:
+            continue
+    return None
+
+def _swap_column(table_name, column_name, source_type, target_type, sql_type, convert,
+                 required, batch_size):
+    """
+    Troca o tipo de uma coluna copiando os valores convertidos em lotes.
+    
+    Cria <coluna>_novo com o tipo de destino, preenche em lotes (retomável,
+    percorre por id), remove a coluna antiga e renomeia a nova. Se algum valor
+    não puder ser convertido (ou faltar numa coluna obrigatória), a migração
+    para antes de remover a coluna antiga, com os ids dos registros: nada se
+    perde, e depois de corrigidos os registros a migração continua de onde
+    parou.
+    
+    O NOT NULL de uma coluna obrigatória é recolocado aqui só no PostgreSQL;
+    no SQLite a tabela precisa ser recriada (_require_columns_sqlite).
+    """
+    columns = [col['name'] for col in inspect(db.engine).get_columns(table_name)]
+    new_name = f'{column_name}_novo'
+    
+    if new_name not in columns:
+        print(f"Adicionando coluna {table_name}.{new_name} ({sql_type})...")
+        db.session.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {new_name} {sql_type}'))
+        db.session.commit()
+    
+    tbl = table(
+        table_name,
+        column('id', Integer),
+        column(column_name, source_type),
+        column(new_name, target_type)
+    )
+    
+    # Preenche em lotes percorrendo pela chave primária
+    last_id = 0
+    converted = 0
+    failed = []
+    while True:
+        rows = db.session.execute(
+            select(tbl.c.id, tbl.c[column_name])
+            .where(tbl.c.id > last_id)
+            .where(tbl.c[new_name].is_(None))
+            .order_by(tbl.c.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
         
-    print("Migração concluída com sucesso!")
+        values = []
+        for row_id, raw_value in rows:
+            if not raw_value:
+                if required:
+                    print(f"AVISO: valor ausente em {table_name}.{column_name} (id={row_id})")
+                    failed.append(row_id)
+                continue
+            converted_value = convert(raw_value)
+            if converted_value is None:
+                print(f"AVISO: valor inválido em {table_name}.{column_name} (id={row_id}): {raw_value!r}")
+                failed.append(row_id)
+                continue
+            values.append({'_id': row_id, '_valor': converted_value})
+        
+        if values:
+            db.session.execute(
+                update(tbl).where(tbl.c.id == bindparam('_id')).values({new_name: bindparam('_valor')}),
+                values
+            )
+        db.session.commit()
+        
+        converted += len(values)
+        last_id = rows[-1][0]
+    
+    print(f"{converted} registros convertidos em {table_name}.{column_name}.")
+    
+    if failed:
+        ids = ', '.join(str(row_id) for row_id in failed[:50])
+        raise RuntimeError(
+            f"{len(failed)} registros de {table_name}.{column_name} não puderam ser convertidos "
+            f"(ids: {ids}{', ...' if len(failed) > 50 else ''}). A coluna original foi mantida; "
+            "corrija os registros e execute a migração novamente."
+        )
+    
+    # Troca a coluna antiga pela nova
+    db.session.execute(text(f'ALTER TABLE {table_name} DROP COLUMN {column_name}'))
+    db.session.execute(text(f'ALTER TABLE {table_name} RENAME COLUMN {new_name} TO {column_name}'))
+    if required and db.engine.dialect.name == 'postgresql':
+        db.session.execute(text(f'ALTER TABLE {table_name} ALTER COLUMN {column_name} SET NOT NULL'))
+    db.session.commit()
+    print(f"Coluna {table_name}.{column_name} convertida para {sql_type}.")
 
-def update_enterprise_relationships():
-    """Atualiza as relações entre Empresa e Entrega para suporte a CASCADE."""
-    print("Iniciando migração das relações entre Empresa e Entrega...")
+def _rebuild_sqlite_table(table_name, not_null):
+    """
+    Recria uma tabela do SQLite com as colunas `not_null` obrigatórias.
     
-    with app.app_context():
+    O SQLite não altera a nulidade de uma coluna existente. Segue o
+    procedimento da documentação dele: cria a tabela nova com a definição
+    lida do banco, copia os registros, remove a antiga e renomeia a nova, com
+    as chaves estrangeiras desligadas durante a troca. Os índices são
+    recriados com o SQL original (inclusive os parciais).
+    """
+    db.session.commit()
+    old = Table(table_name, MetaData(), autoload_with=db.engine)
+    new_name = f'{table_name}_novo'
+    new = old.to_metadata(old.metadata, name=new_name)
+    new.indexes.clear()
+    for name in not_null:
+        new.c[name].nullable = False
+    
+    with db.engine.connect() as conn:
+        index_sql = conn.execute(text(
+            "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = :name AND sql IS NOT NULL"
+        ), {'name': table_name}).scalars().all()
+        conn.commit()
+        
+        # Fora de transação: o PRAGMA não tem efeito dentro de uma
+        foreign_keys = conn.exec_driver_sql('PRAGMA foreign_keys').scalar()
+        conn.exec_driver_sql('PRAGMA foreign_keys=OFF')
+        conn.commit()
         try:
-            # Primeiro adicionar um novo constraint para a chave estrangeira com CASCADE
-            # Para isso, precisamos remover o constraint existente e criar um novo
-            
-            # Verificar se a constraint existe
-            inspector = inspect(db.engine)
-            foreign_keys = inspector.get_foreign_keys('entregas')
-            constraint_name = None
+            with conn.begin():
+                new.drop(conn, checkfirst=True)  # Sobra de uma execução interrompida
+                new.create(conn)
+                names = [col.name for col in old.columns]
+                conn.execute(new.insert().from_select(names, select(*old.columns)))
+                old.drop(conn)
+                conn.exec_driver_sql(f'ALTER TABLE {new_name} RENAME TO {table_name}')
+                for sql in index_sql:
+                    conn.exec_driver_sql(sql)
+                problems = conn.exec_driver_sql(f'PRAGMA foreign_key_check({table_name})').all()
+                if problems:
+                    raise RuntimeError(f"Chaves estrangeiras inválidas em {table_name}: {problems[:5]}")
+        finally:
+            conn.exec_driver_sql(f'PRAGMA foreign_keys={int(foreign_keys)}')
+            conn.commit()
+
+def _require_columns_sqlite(columns):
+    """
+    Torna obrigatórias no SQLite as colunas (tabela, coluna) que ainda
+    aceitam nulo, recriando cada tabela uma vez.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return
+    
+    pending = {}
+    for table_name, column_name in columns:
+        for col in inspect(db.engine).get_columns(table_name):
+            if col['name'] == column_name and col['nullable']:
+                pending.setdefault(table_name, []).append(column_name)
+    
+    for table_name, column_names in pending.items():
+        # Valores que não puderam ser convertidos ficaram nulos e impedem a cópia
+        tbl = table(table_name, *[column(name) for name in column_names])
+        nulls = db.session.execute(select(func.count()).select_from(tbl).where(
+            or_(*[tbl.c[name].is_(None) for name in column_names])
+        )).scalar()
+        if nulls:
+            raise RuntimeError(
+                f"{nulls} registros de {table_name} sem valor em {', '.join(column_names)}; "
+                "corrija-os e execute a migração novamente."
+            )
+        print(f"Recriando a tabela {table_name} com {', '.join(column_names)} NOT NULL...")
+        _rebuild_sqlite_table(table_name, column_names)
+
+def require_date_time_columns():
+    """Recoloca o NOT NULL das datas/horas obrigatórias em bancos SQLite já convertidos."""
+    if db.engine.dialect.name != 'sqlite':
+        print("Somente o SQLite precisa desta migração, nada a fazer.")
+        return
+    _require_columns_sqlite([(t, c) for t, c, _, required in DATE_TIME_COLUMNS if required])
+    print("Colunas obrigatórias de data/hora conferidas.")
+
+def _is_text_column(table_name, column_name):
+    """Indica se a coluna ainda está gravada como texto"""
+    for col in inspect(db.engine).get_columns(table_name):
+        if col['name'] == column_name:
+            return isinstance(col['type'], String)
+    return False
+
+def convert_date_time_columns(batch_size=500):
+    """
+    Converte as colunas de data/hora de ingressos e entregas de texto para
+    DATE/TIME, preenchendo as novas colunas em lotes.
+    """
+    print("Iniciando conversão das colunas de data/hora...")
+    
+    for table_name, column_name, column_type, required in DATE_TIME_COLUMNS:
+        if not _is_text_column(table_name, column_name):
+            print(f"Coluna {table_name}.{column_name} já está convertida.")
+            continue
+        
+        sql_type = 'DATE' if column_type is Date else 'TIME'
+        parse = _parse_date if column_type is Date else _parse_time
+        _swap_column(table_name, column_name, String, column_type, sql_type, parse,
+                     required, batch_size)
+    
+    _require_columns_sqlite([(t, c) for t, c, _, required in DATE_TIME_COLUMNS if required])
+    create_indexes(DATE_TIME_INDEXES)
+    print("Conversão das colunas de data/hora concluída com sucesso!")
+
+def revert_date_time_columns(batch_size=500):
+    """
+    Volta as colunas de data/hora de ingressos e entregas para texto
+    (DD/MM/AAAA e HH:MM), no formato usado antes da conversão.
+    """
+    print("Revertendo colunas de data/hora para texto...")
+    
+    # Índices sobre as colunas precisam sair antes da troca
+    drop_indexes(DATE_TIME_INDEXES)
+    
+    for table_name, column_name, column_type, required in DATE_TIME_COLUMNS:
+        if _is_text_column(table_name, column_name):
+            print(f"Coluna {table_name}.{column_name} já está como texto.")
+            continue
+        
+        if column_type is Date:
+            sql_type, fmt = 'VARCHAR(10)', '%d/%m/%Y'
+        else:
+            sql_type, fmt = 'VARCHAR(5)', '%H:%M'
+        _swap_column(table_name, column_name, column_type, String, sql_type,
+                     lambda value, fmt=fmt: value.strftime(fmt), required, batch_size)
+    
+    _require_columns_sqlite([(t, c) for t, c, _, required in DATE_TIME_COLUMNS if required])
+    print("Reversão das colunas de data/hora concluída com sucesso!")
+
+def _find_index(name):
+    """Localiza um índice declarado nos modelos pelo nome"""
+    import models  # noqa: F401 - registra as tabelas no db.metadata
+    for tbl in db.metadata.tables.values():
+        for index in tbl.indexes:
+            if index.name == name:
+                return index
+    raise KeyError(f"Índice {name} não declarado em models.py")
+
+def _index_table(name):
+    """Tabela de um índice declarado nos modelos ou de trigramas"""
+    for index_name, table_name, _ in TRIGRAM_INDEXES:
+        if index_name == name:
+            return table_name
+    return _find_index(name).table.name
+
+def create_indexes(names):
+    """Cria os índices informados (os que já existirem são mantidos)"""
+    tables = inspect(db.engine).get_table_names()
+    for name in names:
+        index = _find_index(name)
+        if index.table.name not in tables:
+            # A tabela ainda não existe; o create_all a cria já com o índice
+            print(f"Tabela {index.table.name} não existe, índice {name} ignorado.")
+            continue
+        print(f"Criando índice {name}...")
+        index.create(bind=db.engine, checkfirst=True)
+
+def drop_indexes(names):
+    """Remove os índices informados (os que não existirem são ignorados)"""
+    tables = inspect(db.engine).get_table_names()
+    for name in reversed(names):
+        index = _find_index(name)
+        if index.table.name not in tables:
+            continue
+        print(f"Removendo índice {name}...")
+        index.drop(bind=db.engine, checkfirst=True)
+
+def create_hot_path_indexes():
+    """Cria os índices dos caminhos de consulta mais usados."""
+    print("Criando índices dos caminhos de consulta...")
+    create_indexes(HOT_PATH_INDEXES)
+    print("Índices criados com sucesso!")
+
+def drop_hot_path_indexes():
+    """Remove os índices dos caminhos de consulta."""
+    print("Removendo índices dos caminhos de consulta...")
+    drop_indexes(HOT_PATH_INDEXES)
+    print("Índices removidos com sucesso!")
+
+def add_search_columns(batch_size=500):
+    """
+    Adiciona as colunas de busca normalizadas de pessoas e empresas (CPF/CNPJ
+    só com dígitos e nome sem acentos em minúsculas), preenche em lotes e cria
+    os índices de busca por prefixo. No PostgreSQL também habilita o pg_trgm e
+    cria os índices de trigramas para a busca por trecho do nome.
+    """
+    print("Iniciando criação das colunas de busca...")
+    
+    for table_name, key_name, column_name, sql_type, source_name, normalize in SEARCH_COLUMNS:
+        columns = [col['name'] for col in inspect(db.engine).get_columns(table_name)]
+        if column_name not in columns:
+            print(f"Adicionando coluna {table_name}.{column_name}...")
+            db.session.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {column_name} {sql_type}'))
+            db.session.commit()
+        
+        tbl = table(table_name, column(key_name, String), column(source_name, String), column(column_name, String))
+        
+        # Preenche em lotes percorrendo pela chave primária (retomável)
+        last_key = ''
+        filled = 0
+        while True:
+            rows = db.session.execute(
+                select(tbl.c[key_name], tbl.c[source_name])
+                .where(tbl.c[key_name] > last_key)
+                .where(tbl.c[column_name].is_(None))
+                .order_by(tbl.c[key_name])
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
             
-            for fk in foreign_keys:
-                if 'cnpj' in fk['constrained_columns'] and fk['referred_table'] == 'empresas':
-                    constraint_name = fk['name']
-                    break
+            db.session.execute(
+                update(tbl).where(tbl.c[key_name] == bindparam('_chave')).values({column_name: bindparam('_valor')}),
+                [{'_chave': key, '_valor': normalize(value)} for key, value in rows]
+            )
+            db.session.commit()
             
-            if constraint_name:
-                print(f"Removendo constraint: {constraint_name}...")
-                # Remover a constraint existente
-                db.session.execute(
-                    text(f'ALTER TABLE entregas DROP CONSTRAINT IF EXISTS {constraint_name}')
-                )
-                db.session.commit()
-                
-                # Criar a nova constraint com CASCADE
-                print("Criando nova constraint com CASCADE...")
-                db.session.execute(
-                    text('ALTER TABLE entregas ADD CONSTRAINT fk_entregas_empresas ' +
-                         'FOREIGN KEY (cnpj) REFERENCES empresas(cnpj) ON DELETE CASCADE')
-                )
-                db.session.commit()
-                print("Constraint atualizada com sucesso!")
+            filled += len(rows)
+            last_key = rows[-1][0]
+        
+        print(f"{filled} registros preenchidos em {table_name}.{column_name}.")
+    
+    create_indexes(SEARCH_INDEXES)
+    
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        for index_name, table_name, column_name in TRIGRAM_INDEXES:
+            print(f"Criando índice {index_name}...")
+            db.session.execute(text(
+                f'CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} '
+                f'USING gin ({column_name} gin_trgm_ops)'
+            ))
+        db.session.commit()
+    
+    print("Colunas de busca criadas com sucesso!")
+
+def drop_search_columns():
+    """Remove as colunas de busca normalizadas e seus índices."""
+    print("Removendo colunas de busca...")
+    
+    if db.engine.dialect.name == 'postgresql':
+        for index_name, _, _ in TRIGRAM_INDEXES:
+            db.session.execute(text(f'DROP INDEX IF EXISTS {index_name}'))
+        db.session.commit()
+    drop_indexes(SEARCH_INDEXES)
+    
+    for table_name, _, column_name, _, _, _ in reversed(SEARCH_COLUMNS):
+        columns = [col['name'] for col in inspect(db.engine).get_columns(table_name)]
+        if column_name in columns:
+            print(f"Removendo coluna {table_name}.{column_name}...")
+            db.session.execute(text(f'ALTER TABLE {table_name} DROP COLUMN {column_name}'))
+            db.session.commit()
+    
+    print("Colunas de busca removidas com sucesso!")
+
+def add_checkout_user_column():
+    """Adiciona ingressos.saida_registrada_por (usuário que registrou a saída)."""
+    columns = [col['name'] for col in inspect(db.engine).get_columns('ingressos')]
+    if 'saida_registrada_por' in columns:
+        print("Coluna ingressos.saida_registrada_por já existe.")
+        return
+    
+    # No SQLite a chave estrangeira impediria o DROP COLUMN do downgrade
+    references = ' REFERENCES "user"(id)' if db.engine.dialect.name == 'postgresql' else ''
+    print("Adicionando coluna ingressos.saida_registrada_por...")
+    db.session.execute(text(f'ALTER TABLE ingressos ADD COLUMN saida_registrada_por INTEGER{references}'))
+    db.session.commit()
+    print("Coluna adicionada com sucesso!")
+
+def drop_checkout_user_column():
+    """Remove ingressos.saida_registrada_por."""
+    columns = [col['name'] for col in inspect(db.engine).get_columns('ingressos')]
+    if 'saida_registrada_por' in columns:
+        print("Removendo coluna ingressos.saida_registrada_por...")
+        db.session.execute(text('ALTER TABLE ingressos DROP COLUMN saida_registrada_por'))
+        db.session.commit()
+
+def add_image_status_column():
+    """Adiciona entrega_imagens.status (as imagens existentes já estão prontas)."""
+    if 'entrega_imagens' not in inspect(db.engine).get_table_names():
+        # A tabela ainda não existe; o create_all a cria já com a coluna
+        print("Tabela entrega_imagens não existe, coluna status ignorada.")
+        return
+    columns = [col['name'] for col in inspect(db.engine).get_columns('entrega_imagens')]
+    if 'status' in columns:
+        print("Coluna entrega_imagens.status já existe.")
+        return
+    
+    print("Adicionando coluna entrega_imagens.status...")
+    db.session.execute(text("ALTER TABLE entrega_imagens ADD COLUMN status VARCHAR(20) NOT NULL DEFAULT 'pronta'"))
+    db.session.commit()
+    print("Coluna adicionada com sucesso!")
+
+def drop_image_status_column():
+    """Remove entrega_imagens.status."""
+    if 'entrega_imagens' not in inspect(db.engine).get_table_names():
+        return
+    columns = [col['name'] for col in inspect(db.engine).get_columns('entrega_imagens')]
+    if 'status' in columns:
+        print("Removendo coluna entrega_imagens.status...")
+        db.session.execute(text('ALTER TABLE entrega_imagens DROP COLUMN status'))
+        db.session.commit()
+
+def _legacy_original_path(filename):
+    """Arquivo de uma imagem nas pastas anteriores ao repositório de uploads"""
+    for folder in (LEGACY_ORIGINAIS_FOLDER, LEGACY_UPLOAD_FOLDER):
+        path = os.path.join(folder, filename)
+        if os.path.isfile(path):
+            return path
+    return None
+
+def add_image_hash_column():
+    """Adiciona entrega_imagens.content_hash e o calcula para as imagens existentes."""
+    from upload_store import file_hash
+    
+    if 'entrega_imagens' not in inspect(db.engine).get_table_names():
+        print("Tabela entrega_imagens não existe, coluna content_hash ignorada.")
+        return
+    columns = [col['name'] for col in inspect(db.engine).get_columns('entrega_imagens')]
+    if 'content_hash' not in columns:
+        print("Adicionando coluna entrega_imagens.content_hash...")
+        db.session.execute(text('ALTER TABLE entrega_imagens ADD COLUMN content_hash VARCHAR(64)'))
+        db.session.commit()
+    
+    rows = db.session.execute(text(
+        'SELECT id, filename FROM entrega_imagens WHERE content_hash IS NULL'
+    )).all()
+    missing = 0
+    for image_id, filename in rows:
+        path = _legacy_original_path(filename)
+        if path is None:
+            missing += 1
+            continue
+        db.session.execute(text('UPDATE entrega_imagens SET content_hash = :hash WHERE id = :id'),
+                           {'hash': file_hash(path), 'id': image_id})
+    db.session.commit()
+    print(f"Hash calculado para {len(rows) - missing} imagens ({missing} sem arquivo).")
+
+def drop_image_hash_column():
+    """Remove entrega_imagens.content_hash."""
+    if 'entrega_imagens' not in inspect(db.engine).get_table_names():
+        return
+    columns = [col['name'] for col in inspect(db.engine).get_columns('entrega_imagens')]
+    if 'content_hash' in columns:
+        print("Removendo coluna entrega_imagens.content_hash...")
+        db.session.execute(text('ALTER TABLE entrega_imagens DROP COLUMN content_hash'))
+        db.session.commit()
+
+def rehome_entrega_uploads():
+    """Move as imagens das entregas para o repositório endereçado pelo conteúdo."""
+    from upload_store import upload_store
+    
+    create_indexes(UPLOAD_STORE_INDEXES)
+    if 'entrega_imagens' not in inspect(db.engine).get_table_names():
+        return
+    
+    store = upload_store()
+    # Arquivos que também são a imagem antiga de uma entrega ficam na pasta (cópia)
+    shared = set()
+    if 'imagem_filename' in [col['name'] for col in inspect(db.engine).get_columns('entregas')]:
+        shared = {row[0] for row in db.session.execute(text(
+            'SELECT imagem_filename FROM entregas WHERE imagem_filename IS NOT NULL'
+        ))}
+    rows = db.session.execute(text('SELECT id, filename, content_hash FROM entrega_imagens')).all()
+    print(f"Movendo {len(rows)} imagens para {store.directory}...")
+    
+    moved = missing = 0
+    for image_id, filename, content_hash in rows:
+        source = _legacy_original_path(filename)
+        if source is None:
+            if not (content_hash and store.exists(content_hash)):
+                missing += 1
+            continue
+        
+        new_hash = store.put_file(source, move=filename not in shared)
+        # Versões reduzidas já geradas são aproveitadas (ou descartadas, se o
+        # mesmo conteúdo já tem as suas)
+        for tamanho, formato in LEGACY_DERIVATIVES:
+            path = os.path.join(LEGACY_DERIVADAS_FOLDER, tamanho, f'{filename}.{formato}')
+            if not os.path.exists(path):
+                continue
+            suffix = f'.{tamanho}.{formato}'
+            if store.exists(new_hash, suffix):
+                os.remove(path)
             else:
-                print("Nenhuma constraint entre entregas e empresas encontrada, criando nova...")
-                # Criar a nova constraint com CASCADE
-                db.session.execute(
-                    text('ALTER TABLE entregas ADD CONSTRAINT fk_entregas_empresas ' +
-                         'FOREIGN KEY (cnpj) REFERENCES empresas(cnpj) ON DELETE CASCADE')
-                )
-                db.session.commit()
-                print("Nova constraint criada com sucesso!")
-                
-        except Exception as e:
-            db.session.rollback()
-            print(f"Erro ao atualizar relações: {str(e)}")
-            raise
+                shutil.move(path, store.path(new_hash, suffix))
+        if new_hash != content_hash:
+            db.session.execute(text('UPDATE entrega_imagens SET content_hash = :hash WHERE id = :id'),
+                               {'hash': new_hash, 'id': image_id})
+        moved += 1
+    db.session.commit()
     
-    print("Migração das relações concluída com sucesso!")
+    # Pastas antigas vazias
+    for folder in [os.path.join(LEGACY_DERIVADAS_FOLDER, tamanho) for tamanho, _ in LEGACY_DERIVATIVES] + \
+            [LEGACY_DERIVADAS_FOLDER, LEGACY_ORIGINAIS_FOLDER]:
+        try:
+            os.rmdir(folder)
+        except OSError:
+            pass
+    print(f"{moved} imagens movidas ({missing} sem arquivo).")
+
+def restore_entrega_uploads():
+    """Copia as imagens das entregas de volta para static/uploads/entregas/originais."""
+    from upload_store import upload_store, is_hash
+    
+    if 'entrega_imagens' in inspect(db.engine).get_table_names():
+        store = upload_store()
+        rows = db.session.execute(text(
+            'SELECT filename, content_hash FROM entrega_imagens WHERE content_hash IS NOT NULL'
+        )).all()
+        print(f"Copiando {len(rows)} imagens para {LEGACY_ORIGINAIS_FOLDER}...")
+        os.makedirs(LEGACY_ORIGINAIS_FOLDER, exist_ok=True)
+        content_hashes = set()
+        for filename, content_hash in rows:
+            if is_hash(content_hash) and store.exists(content_hash):
+                shutil.copyfile(store.path(content_hash), os.path.join(LEGACY_ORIGINAIS_FOLDER, filename))
+                content_hashes.add(content_hash)
+        # As versões reduzidas são geradas de novo no primeiro acesso
+        for content_hash in content_hashes:
+            store.remove(content_hash)
+    drop_indexes(UPLOAD_STORE_INDEXES)
+
+def _find_table(name):
+    """Localiza uma tabela declarada nos modelos pelo nome"""
+    import models  # noqa: F401 - registra as tabelas no db.metadata
+    if name not in db.metadata.tables:
+        raise KeyError(f"Tabela {name} não declarada em models.py")
+    return db.metadata.tables[name]
+
+def create_tables(names):
+    """Cria as tabelas informadas a partir dos modelos (as que já existirem são mantidas)"""
+    for name in names:
+        print(f"Criando tabela {name}...")
+        _find_table(name).create(bind=db.engine, checkfirst=True)
+
+def drop_tables(names):
+    """Remove as tabelas informadas (as que não existirem são ignoradas)"""
+    for name in reversed(names):
+        print(f"Removendo tabela {name}...")
+        _find_table(name).drop(bind=db.engine, checkfirst=True)
+
+def create_traffic_rollups():
+    """Cria a tabela de contagens de movimento e a preenche a partir dos registros."""
+    import rollups
+    create_tables(['traffic_rollups'])
+    print("Calculando contagens de movimento...")
+    rollups.rebuild()
+
+def verify_indexes():
+    """
+    Confere com EXPLAIN se cada índice é usado pela consulta correspondente.
+    
+    No SQLite usa EXPLAIN QUERY PLAN. No PostgreSQL desliga a varredura
+    sequencial na transação (SET LOCAL enable_seqscan = off), já que em tabelas
+    pequenas o planejador prefere ler a tabela inteira.
+    
+    Returns:
+        bool: True se todos os índices aparecem no plano
+    """
+    dialect = db.engine.dialect.name
+    tables = inspect(db.engine).get_table_names()
+    all_used = True
+    
+    with db.engine.connect() as conn:
+        for index_name, sql, params in INDEX_CHECKS:
+            if isinstance(sql, dict):
+                if dialect not in sql:
+                    print(f"[IGNORADO] {index_name}: não se aplica a {dialect}")
+                    continue
+                sql = sql[dialect]
+            if _index_table(index_name) not in tables:
+                print(f"[IGNORADO] {index_name}: tabela inexistente")
+                continue
+            
+            trans = conn.begin()
+            try:
+                if dialect == 'postgresql':
+                    conn.execute(text('SET LOCAL enable_seqscan = off'))
+                    plan = [row[0] for row in conn.execute(text(f'EXPLAIN {sql}'), params)]
+                else:
+                    plan = [row[-1] for row in conn.execute(text(f'EXPLAIN QUERY PLAN {sql}'), params)]
+            finally:
+                trans.rollback()
+            
+            used = any(index_name in line for line in plan)
+            all_used = all_used and used
+            print(f"[{'OK' if used else 'FALHA'}] {index_name}")
+            for line in plan:
+                print(f"    {line.strip()}")
+    
+    return all_used
+
+class Migration:
+    """
+    Migração versionada.
+    
+    Args:
+        version (int): Número da versão (sequencial)
+        description (str): Descrição registrada em schema_version
+        up: Função que aplica a migração
+        down: Função que reverte a migração
+    """
+    def __init__(self, version, description, up, down):
+        self.version = version
+        self.description = description
+        self.up = up
+        self.down = down
+
+MIGRATIONS = [
+    Migration(1, 'Colunas active e last_login em user',
+              add_columns_to_user_table, drop_user_columns),
+    Migration(2, 'ON DELETE CASCADE entre entregas e empresas',
+              update_enterprise_relationships, revert_enterprise_relationships),
+    Migration(3, 'Datas e horários de ingressos e entregas como DATE/TIME',
+              convert_date_time_columns, revert_date_time_columns),
+    Migration(4, 'Índices dos caminhos de consulta mais usados',
+              create_hot_path_indexes, drop_hot_path_indexes),
+    Migration(5, 'Colunas de busca normalizadas de pessoas e empresas',
+              add_search_columns, drop_search_columns),
+    Migration(6, 'Versão dos dados por tabela (invalidação de caches)',
+              lambda: create_tables(['data_versions']), lambda: drop_tables(['data_versions'])),
+    Migration(7, 'Tarefas de geração de relatórios em segundo plano',
+              lambda: create_tables(['report_jobs']), lambda: drop_tables(['report_jobs'])),
+    Migration(8, 'Contagens de movimento por dia e hora (rollups)',
+              create_traffic_rollups, lambda: drop_tables(['traffic_rollups'])),
+    Migration(9, 'Índices parciais de entregas e correspondências pendentes',
+              lambda: create_indexes(DASHBOARD_INDEXES), lambda: drop_indexes(DASHBOARD_INDEXES)),
+    Migration(10, 'Usuário que registrou a saída do ingresso',
+              add_checkout_user_column, drop_checkout_user_column),
+    Migration(11, 'Chaves de idempotência dos eventos dos leitores da portaria',
+              lambda: create_tables(['scan_events']), lambda: drop_tables(['scan_events'])),
+    Migration(12, 'Status do processamento das imagens das entregas',
+              add_image_status_column, drop_image_status_column),
+    Migration(13, 'Hash do conteúdo das imagens das entregas (URLs imutáveis)',
+              add_image_hash_column, drop_image_hash_column),
+    Migration(14, 'Imagens das entregas no repositório endereçado pelo conteúdo',
+              rehome_entrega_uploads, restore_entrega_uploads),
+    Migration(15, 'Datas e horários obrigatórios como NOT NULL no SQLite',
+              require_date_time_columns,
+              lambda: print("As colunas continuam NOT NULL, compatível com as versões anteriores.")),
+]
+
+def current_version():
+    """Versão atual do esquema (0 se nenhuma migração foi registrada)"""
+    schema_version.create(bind=db.engine, checkfirst=True)
+    version = db.session.execute(select(func.max(schema_version.c.version))).scalar()
+    return version or 0
+
+def upgrade(target=None):
+    """Aplica as migrações pendentes até a versão informada (padrão: a mais recente)"""
+    target = MIGRATIONS[-1].version if target is None else int(target)
+    version = current_version()
+    pending = [m for m in MIGRATIONS if version < m.version <= target]
+    
+    if not pending:
+        print(f"Banco já está na versão {version}.")
+        return
+    
+    for migration in pending:
+        print(f"==> Aplicando {migration.version}: {migration.description}")
+        migration.up()
+        db.session.execute(schema_version.insert().values(
+            version=migration.version,
+            description=migration.description,
+            applied_at=datetime.now()
+        ))
+        db.session.commit()
+    
+    print(f"Banco atualizado para a versão {pending[-1].version}.")
+
+def downgrade(target):
+    """Reverte as migrações aplicadas acima da versão informada"""
+    target = int(target)
+    version = current_version()
+    applied = [m for m in reversed(MIGRATIONS) if target < m.version <= version]
+    
+    if not applied:
+        print(f"Banco já está na versão {version}.")
+        return
+    
+    for migration in applied:
+        print(f"<== Revertendo {migration.version}: {migration.description}")
+        migration.down()
+        db.session.execute(schema_version.delete().where(schema_version.c.version == migration.version))
+        db.session.commit()
+    
+    print(f"Banco revertido para a versão {target}.")
+
+def status():
+    """Mostra a versão atual e as migrações pendentes"""
+    version = current_version()
+    applied = dict(db.session.execute(select(schema_version.c.version, schema_version.c.applied_at)).all())
+    print(f"Versão atual: {version}")
+    for migration in MIGRATIONS:
+        if migration.version in applied:
+            state = f"aplicada em {applied[migration.version].strftime('%d/%m/%Y %H:%M')}"
+        else:
+            state = 'pendente'
+        print(f"  {migration.version}. {migration.description} ({state})")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Migrações do banco de dados do VigiAPP')
+    subparsers = parser.add_subparsers(dest='comando')
+    
+    upgrade_parser = subparsers.add_parser('upgrade', help='Aplica as migrações pendentes')
+    upgrade_parser.add_argument('versao', nargs='?', type=int, help='Versão de destino (padrão: a mais recente)')
+    downgrade_parser = subparsers.add_parser('downgrade', help='Reverte migrações')
+    downgrade_parser.add_argument('versao', type=int, help='Versão de destino')
+    subparsers.add_parser('status', help='Mostra a versão atual do esquema')
+    subparsers.add_parser('verificar-indices', help='Confere com EXPLAIN se os índices são usados')
+    
+    args = parser.parse_args(argv)
+    
+    with app.app_context():
+        if args.comando == 'downgrade':
+            downgrade(args.versao)
+        elif args.comando == 'status':
+            status()
+        elif args.comando == 'verificar-indices':
+            if not verify_indexes():
+                return 1
+        else:
+            # Sem comando aplica todas as migrações, como o script fazia antes
+            upgrade(getattr(args, 'versao', None))
+    return 0
 
 if __name__ == "__main__":
-    add_columns_to_user_table()
-    update_enterprise_relationships()
\ No newline at end of file
+    sys.exit(main())
@@ -1,5 +1,6 @@
 from datetime import datetime
 from app import db
+from utils import only_digits, normalize_search
 from flask_login import UserMixin
 
 class User(UserMixin, db.Model):
@@ -21,20 +22,45 @@ class Pessoa(db.Model):
     nome = db.Column(db.String(100), nullable=False)
     telefone = db.Column(db.String(20))
     empresa = db.Column(db.String(100))
-    qr_code_url = db.Column(db.String(255))  # URL para o código QR desta pessoa
+    qr_code_url = db.Column(db.String(255))  # Legado: o QR é gerado sob demanda (qr_code.py)
+    # Colunas de busca, mantidas por _normalizar_pessoa (não editar diretamente)
+    cpf_digitos = db.Column(db.String(14))  # CPF só com dígitos
+    nome_normalizado = db.Column(db.String(100))  # Nome sem acentos e em minúsculas
     ingressos = db.relationship('Ingresso', backref='pessoa', lazy=True)
+    
+    __table_args__ = (
+        # Listagem de pessoas ordenada por nome
+        db.Index('ix_pessoas_nome', 'nome'),
+        # Busca por prefixo (varchar_pattern_ops permite LIKE 'x%' no PostgreSQL)
+        db.Index('ix_pessoas_cpf_digitos', 'cpf_digitos',
+                 postgresql_ops={'cpf_digitos': 'varchar_pattern_ops'}),
+        db.Index('ix_pessoas_nome_normalizado', 'nome_normalizado',
+                 postgresql_ops={'nome_normalizado': 'varchar_pattern_ops'}),
+    )
 
 class Ingresso(db.Model):
     __tablename__ = 'ingressos'
     id = db.Column(db.Integer, primary_key=True)
     cpf = db.Column(db.String(14), db.ForeignKey('pessoas.cpf'), nullable=False)
-    data = db.Column(db.String(10), nullable=False)
-    entrada = db.Column(db.String(10), nullable=False)
-    saida = db.Column(db.String(10))
+    data = db.Column(db.Date, nullable=False)
+    entrada = db.Column(db.Time, nullable=False)
+    saida = db.Column(db.Time)
     motivo = db.Column(db.String(200), nullable=False)
     pessoa_setor = db.Column(db.String(100), nullable=False)
     observacoes = db.Column(db.Text)
-    qr_code_url = db.Column(db.String(255))  # URL para o código QR deste ingresso
+    qr_code_url = db.Column(db.String(255))  # Legado: o QR é gerado sob demanda (qr_code.py)
+    saida_registrada_por = db.Column(db.Integer, db.ForeignKey('user.id'))  # Usuário que registrou a saída
+    
+    __table_args__ = (
+        # Ordenação e filtros por período (listagens, histórico e relatórios)
+        db.Index('ix_ingressos_data_entrada', 'data', 'entrada', 'id'),
+        # Histórico de visitas de uma pessoa
+        db.Index('ix_ingressos_cpf', 'cpf'),
+        # Visitas em aberto (sem saída): índice parcial, só contém quem está no campus
+        db.Index('ix_ingressos_abertos', 'cpf',
+                 sqlite_where=db.text('saida IS NULL'),
+                 postgresql_where=db.text('saida IS NULL')),
+    )
 
 class Empresa(db.Model):
     __tablename__ = 'empresas'
@@ -44,7 +70,18 @@ class Empresa(db.Model):
     coringa = db.Column(db.String(100))
     nome_func = db.Column(db.String(100))
     telefone_func = db.Column(db.String(20))
+    # Colunas de busca, mantidas por _normalizar_empresa (não editar diretamente)
+    cnpj_digitos = db.Column(db.String(18))  # CNPJ só com dígitos
+    nome_normalizado = db.Column(db.String(100))  # Nome da empresa sem acentos e em minúsculas
     entregas = db.relationship('Entrega', backref='empresa', lazy=True, cascade='all, delete-orphan')
+    
+    __table_args__ = (
+        # Busca por prefixo (varchar_pattern_ops permite LIKE 'x%' no PostgreSQL)
+        db.Index('ix_empresas_cnpj_digitos', 'cnpj_digitos',
+                 postgresql_ops={'cnpj_digitos': 'varchar_pattern_ops'}),
+        db.Index('ix_empresas_nome_normalizado', 'nome_normalizado',
+                 postgresql_ops={'nome_normalizado': 'varchar_pattern_ops'}),
+    )
 
 class EntregaImagem(db.Model):
     __tablename__ = 'entrega_imagens'
@@ -52,24 +89,47 @@ class EntregaImagem(db.Model):
     entrega_id = db.Column(db.Integer, db.ForeignKey('entregas.id', ondelete='CASCADE'), nullable=False)
     filename = db.Column(db.String(255), nullable=False)
     upload_date = db.Column(db.DateTime, default=datetime.now)
+    # pendente, processando, pronta, erro (processada em segundo plano: image_jobs)
+    status = db.Column(db.String(20), nullable=False, default='pronta', server_default='pronta')
+    # SHA-256 do arquivo enviado: nome no repositório de uploads (upload_store),
+    # versão nas URLs (cache imutável) e ETag
+    content_hash = db.Column(db.String(64))
     
     # Relacionamento com Entrega
     entrega = db.relationship('Entrega', back_populates='imagens')
+    
+    __table_args__ = (
+        # Carregamento das imagens de uma entrega
+        db.Index('ix_entrega_imagens_entrega_id', 'entrega_id'),
+        # Contagem de referências dos arquivos do repositório de uploads
+        db.Index('ix_entrega_imagens_content_hash', 'content_hash'),
+    )
 
 class Entrega(db.Model):
     __tablename__ = 'entregas'
     id = db.Column(db.Integer, primary_key=True)
     cnpj = db.Column(db.String(18), db.ForeignKey('empresas.cnpj', ondelete='CASCADE'), nullable=False)
-    data_registro = db.Column(db.String(10), nullable=False)
-    hora_registro = db.Column(db.String(10), nullable=False)
-    data_envio = db.Column(db.String(10))
-    hora_envio = db.Column(db.String(10))
+    data_registro = db.Column(db.Date, nullable=False)
+    hora_registro = db.Column(db.Time, nullable=False)
+    data_envio = db.Column(db.Date)
+    hora_envio = db.Column(db.Time)
     nota_fiscal = db.Column(db.String(50))
     imagem_filename = db.Column(db.String(255))  # Campo mantido para compatibilidade
     observacoes = db.Column(db.Text)
     
     # Relacionamento com EntregaImagem
     imagens = db.relationship('EntregaImagem', back_populates='entrega', cascade='all, delete-orphan')
+    
+    __table_args__ = (
+        # Ordenação e filtros por período (listagens, histórico e relatórios)
+        db.Index('ix_entregas_data_hora', 'data_registro', 'hora_registro', 'id'),
+        # Entregas de uma empresa
+        db.Index('ix_entregas_cnpj', 'cnpj'),
+        # Entregas pendentes (sem envio): índice parcial, usado pelos contadores do painel
+        db.Index('ix_entregas_pendentes', 'id',
+                 sqlite_where=db.text('data_envio IS NULL OR hora_envio IS NULL'),
+                 postgresql_where=db.text('data_envio IS NULL OR hora_envio IS NULL')),
+    )
 
 class Sugestao(db.Model):
     __tablename__ = 'sugestoes'
@@ -89,6 +149,15 @@ class Correspondencia(db.Model):
     tipo = db.Column(db.String(50), nullable=False)
     setor_encomenda = db.Column(db.String(100), nullable=False)
     observacoes = db.Column(db.Text)
+    
+    __table_args__ = (
+        # Ordenação e filtros por período
+        db.Index('ix_correspondencias_data_hora', 'data_recebimento', 'hora_recebimento', 'id_correspondencia'),
+        # Correspondências pendentes (sem destinação): índice parcial, usado pelos contadores do painel
+        db.Index('ix_correspondencias_pendentes', 'id_correspondencia',
+                 sqlite_where=db.text('data_destinacao IS NULL OR hora_destinacao IS NULL'),
+                 postgresql_where=db.text('data_destinacao IS NULL OR hora_destinacao IS NULL')),
+    )
 
 class Ocorrencia(db.Model):
     __tablename__ = 'ocorrencias'
@@ -99,3 +168,80 @@ class Ocorrencia(db.Model):
     hora_registro = db.Column(db.Time, nullable=False)
     gravidade = db.Column(db.String(50))
     ocorrencia = db.Column(db.Text, nullable=False)
+    
+    __table_args__ = (
+        # Ordenação e filtros por período
+        db.Index('ix_ocorrencias_data_hora', 'data_registro', 'hora_registro', 'id_ocorrencia'),
+    )
+
+class DataVersion(db.Model):
+    """Contador de alterações por tabela, usado para invalidar caches entre workers"""
+    __tablename__ = 'data_versions'
+    tabela = db.Column(db.String(50), primary_key=True)
+    versao = db.Column(db.Integer, nullable=False, default=0)
+
+class TrafficRollup(db.Model):
+    """
+    Contagem de registros por hora, mantida a cada commit (rollups.py).
+    dimensao 'total' conta todos os registros; as demais contam por valor
+    (setor, motivo, tipo).
+    """
+    __tablename__ = 'traffic_rollups'
+    fonte = db.Column(db.String(20), primary_key=True)  # ingressos, entregas, correspondencias
+    dimensao = db.Column(db.String(20), primary_key=True)
+    dia = db.Column(db.Date, primary_key=True)
+    hora = db.Column(db.SmallInteger, primary_key=True)
+    valor = db.Column(db.String(200), primary_key=True, default='')
+    quantidade = db.Column(db.Integer, nullable=False, default=0)
+
+class ReportJob(db.Model):
+    """Geração de relatório em segundo plano"""
+    __tablename__ = 'report_jobs'
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    tipo = db.Column(db.String(30), nullable=False)
+    data_inicio = db.Column(db.Date, nullable=False)
+    data_fim = db.Column(db.Date, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pendente')  # pendente, processando, concluido, erro
+    linhas = db.Column(db.Integer, nullable=False, default=0)
+    paginas = db.Column(db.Integer, nullable=False, default=0)
+    chave = db.Column(db.String(64))  # Arquivo no cache de relatórios
+    erro = db.Column(db.Text)
+    criado_em = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    atualizado_em = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    concluido_em = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        # Tarefas de cada usuário e limpeza das antigas
+        db.Index('ix_report_jobs_user_criado', 'user_id', 'criado_em'),
+    )
+
+class ScanEvent(db.Model):
+    """Evento de entrada/saída já aplicado, pela chave de idempotência do leitor"""
+    __tablename__ = 'scan_events'
+    chave = db.Column(db.String(64), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    tipo = db.Column(db.String(10), nullable=False)  # entrada, saida
+    ingresso_id = db.Column(db.Integer)
+    resultado = db.Column(db.Text, nullable=False)  # Resposta devolvida ao leitor (JSON)
+    criado_em = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    
+    __table_args__ = (
+        # Limpeza das chaves antigas
+        db.Index('ix_scan_events_criado_em', 'criado_em'),
+    )
+
+@db.event.listens_for(Pessoa, 'before_insert')
+@db.event.listens_for(Pessoa, 'before_update')
+def _normalizar_pessoa(mapper, connection, target):
+    """Mantém as colunas de busca de Pessoa a cada inserção/alteração"""
+    target.cpf_digitos = only_digits(target.cpf)
+    target.nome_normalizado = normalize_search(target.nome)
+
+@db.event.listens_for(Empresa, 'before_insert')
+@db.event.listens_for(Empresa, 'before_update')
+def _normalizar_empresa(mapper, connection, target):
+    """Mantém as colunas de busca de Empresa a cada inserção/alteração"""
+    target.cnpj_digitos = only_digits(target.cnpj)
+    target.nome_normalizado = normalize_search(target.nome_empresa)
+
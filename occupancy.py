@@ -0,0 +1,236 @@
+"""
+Quem está no campus agora: visitas em aberto (ingressos sem saída).
+
+Cada worker mantém em memória as visitas em aberto, por id do ingresso e por
+CPF. O conjunto é carregado pelo índice parcial ix_ingressos_abertos (que só
+contém os ingressos sem saída, nunca a tabela inteira), atualizado pelos
+commits deste worker (commit_hooks) e reconciliado com o banco a cada
+RECONCILE_SECONDS, para incorporar as entradas e saídas registradas pelos
+outros workers.
+
+As atualizações são idempotentes (incluir/remover por id); as que chegam
+durante uma reconciliação são reaplicadas sobre o resultado dela, então
+nenhum commit deste worker se perde.
+"""
+import logging
+import threading
+import time
+
+from sqlalchemy import and_, or_, update
+
+from app import db
+from commit_hooks import on_commit, record_change, UPDATE, DELETE
+from models import Ingresso, Pessoa
+
+logger = logging.getLogger(__name__)
+
+# Intervalo para reconciliar com o banco (alterações dos outros workers)
+RECONCILE_SECONDS = 60
+
+# CPFs por consulta ao buscar os nomes (limite de parâmetros do SQLite)
+NAMES_BATCH = 500
+
+# Máximo de ingressos selecionados em uma saída em lote
+MAX_CLOSE_IDS = 1000
+
+
+class OpenVisit:
+    """Visita em aberto (ingresso sem saída)"""
+    __slots__ = ('id', 'cpf', 'data', 'entrada', 'setor', 'motivo')
+
+    def __init__(self, id, cpf, data, entrada, setor, motivo):
+        self.id = id
+        self.cpf = cpf
+        self.data = data
+        self.entrada = entrada
+        self.setor = setor
+        self.motivo = motivo
+
+
+class OccupancyIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._visits = {}
+        self._by_cpf = {}
+        self._reconciled_at = None
+        # Alterações recebidas durante uma reconciliação (None fora dela)
+        self._replay = None
+        self.reconciliations = 0
+        self.divergences = 0
+
+    def _add(self, visit):
+        self._discard(visit.id)
+        self._visits[visit.id] = visit
+        self._by_cpf.setdefault(visit.cpf, set()).add(visit.id)
+
+    def _discard(self, ingresso_id):
+        visit = self._visits.pop(ingresso_id, None)
+        if visit is not None:
+            ids = self._by_cpf.get(visit.cpf)
+            ids.discard(ingresso_id)
+            if not ids:
+                del self._by_cpf[visit.cpf]
+
+    def reconcile(self):
+        """
+        Recarrega as visitas em aberto a partir do índice parcial.
+
+        Returns:
+            int: Quantidade de visitas que divergiam da memória
+        """
+        with self._lock:
+            self._replay = []
+        try:
+            rows = db.session.query(
+                Ingresso.id, Ingresso.cpf, Ingresso.data, Ingresso.entrada,
+                Ingresso.pessoa_setor, Ingresso.motivo
+            ).filter(Ingresso.saida.is_(None)).all()
+        except Exception:
+            with self._lock:
+                self._replay = None
+            raise
+
+        with self._lock:
+            previous = set(self._visits)
+            self._visits, self._by_cpf = {}, {}
+            for row in rows:
+                self._add(OpenVisit(*row))
+            diverged = len(previous ^ set(self._visits)) if self._reconciled_at is not None else 0
+            for change in self._replay:
+                self._apply(change)
+            self._replay = None
+            self._reconciled_at = time.monotonic()
+            self.reconciliations += 1
+            self.divergences += diverged
+
+        if diverged:
+            logger.info(f'Ocupação reconciliada: {diverged} visitas alteradas por outros workers')
+        return diverged
+
+    def _ensure_fresh(self):
+        if self._reconciled_at is None or time.monotonic() - self._reconciled_at > RECONCILE_SECONDS:
+            self.reconcile()
+
+    def _apply(self, change):
+        values = change.values
+        if change.op != DELETE and values.get('saida') is None:
+            self._add(OpenVisit(values['id'], values['cpf'], values['data'], values['entrada'],
+                                values['pessoa_setor'], values['motivo']))
+        else:
+            self._discard(values['id'])
+
+    def apply_changes(self, changes):
+        """Aplica as alterações de ingressos confirmadas neste worker"""
+        with self._lock:
+            if self._reconciled_at is None and self._replay is None:
+                return
+            for change in changes:
+                self._apply(change)
+                if self._replay is not None:
+                    self._replay.append(change)
+
+    def open_ingresso(self, cpf):
+        """
+        Ingresso em aberto do CPF, ou None.
+
+        A memória pode não ter a entrada registrada por outro worker há menos
+        de RECONCILE_SECONDS, então a ausência é conferida no índice parcial.
+        """
+        self._ensure_fresh()
+        with self._lock:
+            ids = sorted(self._by_cpf.get(cpf, ()))
+        for ingresso_id in ids:
+            ingresso = db.session.get(Ingresso, ingresso_id)
+            if ingresso is not None and ingresso.saida is None:
+                return ingresso
+        return Ingresso.query.filter_by(cpf=cpf, saida=None).first()
+
+    def snapshot(self, reconcile=False):
+        """
+        Visitas em aberto, da entrada mais antiga para a mais recente.
+
+        Args:
+            reconcile (bool): Confere com o banco antes (contagem para evacuação)
+
+        Returns:
+            tuple: (lista de OpenVisit, segundos desde a última reconciliação)
+        """
+        if reconcile:
+            self.reconcile()
+        else:
+            self._ensure_fresh()
+        with self._lock:
+            visits = sorted(self._visits.values(), key=lambda v: (v.data, v.entrada, v.id))
+            age = time.monotonic() - self._reconciled_at
+        return visits, age
+
+    def stats(self):
+        with self._lock:
+            return {
+                'visitas': len(self._visits),
+                'pessoas': len(self._by_cpf),
+                'reconciliacoes': self.reconciliations,
+                'divergencias': self.divergences,
+                'reconciliado_ha': (round(time.monotonic() - self._reconciled_at, 1)
+                                    if self._reconciled_at is not None else None),
+            }
+
+
+occupancy = OccupancyIndex()
+
+on_commit(Ingresso, occupancy.apply_changes)
+
+
+def people_names(cpfs):
+    """Nomes das pessoas por CPF, buscados pela chave primária em lotes"""
+    cpfs = list(set(cpfs))
+    names = {}
+    for start in range(0, len(cpfs), NAMES_BATCH):
+        names.update(db.session.query(Pessoa.cpf, Pessoa.nome).filter(
+            Pessoa.cpf.in_(cpfs[start:start + NAMES_BATCH])
+        ))
+    return names
+
+
+def close_visits(saida, user_id, ids=None, ate=None):
+    """
+    Registra a saída de várias visitas em aberto com um único UPDATE.
+
+    Fecha os ingressos em aberto cujo id está em `ids` e/ou cuja entrada foi
+    até `ate`. As linhas alteradas voltam do próprio UPDATE (RETURNING) e são
+    repassadas aos commit_hooks, que não veem UPDATE em lote. O COMMIT fica
+    com quem chama.
+
+    Args:
+        saida (time): Horário de saída registrado
+        user_id (int): Usuário que registrou a saída
+        ids (list): Ids dos ingressos selecionados
+        ate (datetime): Fecha também as entradas até este momento
+
+    Returns:
+        list: Linhas fechadas (id, cpf, data, entrada, motivo, pessoa_setor)
+    """
+    criteria = []
+    if ids:
+        criteria.append(Ingresso.id.in_(ids))
+    if ate is not None:
+        criteria.append(or_(
+            Ingresso.data < ate.date(),
+            and_(Ingresso.data == ate.date(), Ingresso.entrada <= ate.time())
+        ))
+    if not criteria:
+        return []
+
+    stmt = update(Ingresso).where(
+        Ingresso.saida.is_(None), or_(*criteria)
+    ).values(saida=saida, saida_registrada_por=user_id).returning(
+        Ingresso.id, Ingresso.cpf, Ingresso.data, Ingresso.entrada,
+        Ingresso.motivo, Ingresso.pessoa_setor
+    ).execution_options(synchronize_session='fetch')
+    rows = db.session.execute(stmt).all()
+
+    for row in rows:
+        values = dict(row._mapping, saida=saida, saida_registrada_por=user_id)
+        record_change(db.session, Ingresso, UPDATE, values,
+                      {'saida': None, 'saida_registrada_por': None})
+    return rows
@@ -1,90 +1,178 @@
+"""
+Códigos QR de check-in (pessoa) e check-out (ingresso), gerados sob demanda.
+
+A imagem depende apenas do conteúdo codificado (a URL de check-in ou
+check-out), então não é gravada em disco nem no banco: é gerada na primeira
+requisição e guardada em um cache LRU limitado deste worker, com ETag forte
+(hash do conteúdo), para que o navegador revalide sem baixar de novo.
+
+Uso:
+    python qr_code.py benchmark [-n 200]   # tempo de geração (sem cache) e do cache
+"""
+import argparse
+import io
 import os
+import sys
+import time
+
 import qrcode
+from PIL import Image
 
-# Pasta para armazenar os códigos QR gerados
+from cache import TTLCache
+from utils import only_digits
+
+# Pasta onde versões anteriores gravavam os PNGs (não é mais usada para gravar)
 QR_FOLDER = os.path.join('static', 'qrcodes')
-if not os.path.exists(QR_FOLDER):
-    os.makedirs(QR_FOLDER)
 
-def generate_qr_code(data, filename, size=10):
-    """
-    Gera um código QR para os dados fornecidos e salva como imagem.
-    
-    Args:
-        data (str): Texto/URL a ser codificado no QR
-        filename (str): Nome do arquivo para salvar o código QR (sem a extensão)
-        size (int): Tamanho do QR (valor maior = imagem maior)
-        
-    Returns:
-        str: Caminho do arquivo gerado
-    """
-    # Gera o código QR com a biblioteca
+PNG = 'png'
+SVG = 'svg'
+
+MIMETYPES = {
+    PNG: 'image/png',
+    SVG: 'image/svg+xml',
+}
+
+# Tamanho de cada módulo do QR em pixels (PNG) e margem em módulos
+BOX_SIZE = 10
+BORDER = 4
+
+# Imagens em cache por worker: cada PNG e cada SVG tem 1 a 3 KB. As imagens
+# não mudam; o TTL só limita quanto tempo uma imagem pouco usada fica em memória
+qr_images = TTLCache('qr_code.imagens', maxsize=2048, ttl=24 * 3600)
+
+
+def person_payload(cpf):
+    """Conteúdo do QR de check-in de uma pessoa"""
+    return f"/quick-checkin/{only_digits(cpf)}"
+
+
+def entrance_payload(ingresso_id):
+    """Conteúdo do QR de check-out de um ingresso"""
+    return f"/quick-checkout/{ingresso_id}"
+
+
+def _matrix(data):
+    """Módulos do QR (True = escuro), já com a margem"""
     qr = qrcode.QRCode(
-        version=1,
+        version=None,
         error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=size,
-        border=4,
+        border=BORDER,
     )
     qr.add_data(data)
     qr.make(fit=True)
-    
-    # Cria a imagem do QR Code (preto e branco)
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Define o caminho completo com extensão .png
-    filepath = os.path.join(QR_FOLDER, f"{filename}.png")
-    
-    # Salva a imagem
-    img.save(filepath)
-    
-    return filepath
-
-def generate_person_qr_code(pessoa):
+    return qr.get_matrix()
+
+
+def packed_matrix(data):
     """
-    Gera um código QR para uma pessoa específica, usando seu CPF como identificador.
-    
-    Args:
-        pessoa: Objeto Pessoa do modelo
-        
+    Módulos do QR em formato compacto (folhas de crachás).
+
     Returns:
-        str: URL para o código QR gerado
+        tuple: (n, bytes com n*n valores 0/1, linha a linha)
     """
-    # Normaliza o CPF para usar como parte do nome do arquivo
-    cpf_normalizado = pessoa.cpf.replace('.', '').replace('-', '')
-    
-    # Cria um QR code com uma URL para a rota de check-in/check-out rápido
-    qr_data = f"/quick-checkin/{cpf_normalizado}"
-    
-    # Gera o nome do arquivo baseado no CPF e nome
-    filename = f"pessoa_{cpf_normalizado}"
-    
-    # Gera o código QR
-    filepath = generate_qr_code(qr_data, filename)
-    
-    # Retorna a URL estática para o código gerado
-    return os.path.join('qrcodes', f"{filename}.png")
-
-def generate_entrance_qr_code(ingresso):
+    matrix = _matrix(data)
+    return len(matrix), bytes(dark for row in matrix for dark in row)
+
+
+def _png(matrix):
+    # Imagem de 1 pixel por módulo ampliada sem interpolação: bem mais rápido
+    # que desenhar cada módulo como um retângulo
+    n = len(matrix)
+    pixels = bytes(0 if dark else 255 for row in matrix for dark in row)
+    image = Image.frombytes('L', (n, n), pixels).convert('1')
+    image = image.resize((n * BOX_SIZE, n * BOX_SIZE), Image.NEAREST)
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', compress_level=6)
+    return buffer.getvalue()
+
+
+def _svg(matrix):
+    # Um único <path> com um retângulo por trecho contínuo de módulos escuros
+    # em cada linha; a escala fica por conta do viewBox
+    n = len(matrix)
+    path = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < n:
+            if row[x]:
+                start = x
+                while x < n and row[x]:
+                    x += 1
+                path.append(f'M{start} {y}h{x - start}v1h-{x - start}z')
+            else:
+                x += 1
+    size = n * BOX_SIZE
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size}" '
+        f'viewBox="0 0 {n} {n}" shape-rendering="crispEdges">'
+        f'<rect width="{n}" height="{n}" fill="#fff"/><path d="{"".join(path)}" fill="#000"/></svg>'
+    ).encode('utf-8')
+
+
+def render_qr_code(data, formato=PNG):
     """
-    Gera um código QR para um ingresso específico.
-    
+    Gera a imagem do código QR (sem cache).
+
     Args:
-        ingresso: Objeto Ingresso do modelo
-        
+        data (str): Texto/URL a ser codificado no QR
+        formato (str): PNG ou SVG
+
     Returns:
-        str: URL para o código QR gerado
+        bytes: Conteúdo da imagem
+    """
+    matrix = _matrix(data)
+    return _svg(matrix) if formato == SVG else _png(matrix)
+
+
+def qr_code_image(data, formato=PNG):
     """
-    # Normaliza o CPF para usar como parte do nome do arquivo
-    cpf_normalizado = ingresso.cpf.replace('.', '').replace('-', '')
-    
-    # Cria um QR code com uma URL para a rota de registro de saída
-    qr_data = f"/quick-checkout/{ingresso.id}"
-    
-    # Gera o nome do arquivo baseado no ID do ingresso
-    filename = f"ingresso_{ingresso.id}_{cpf_normalizado}"
-    
-    # Gera o código QR
-    filepath = generate_qr_code(qr_data, filename)
-    
-    # Retorna a URL estática para o código gerado
-    return os.path.join('qrcodes', f"{filename}.png")
\ No newline at end of file
+    Imagem do código QR a partir do cache (gerada na primeira vez).
+
+    Returns:
+        CacheEntry: value com os bytes da imagem e etag com o hash do conteúdo
+    """
+    if formato not in MIMETYPES:
+        raise ValueError(f'Formato de QR inválido: {formato}')
+    return qr_images.get_or_load((formato, data), lambda: render_qr_code(data, formato))
+
+
+def benchmark(n=200):
+    """Mede a geração sem cache (conteúdos distintos) e a leitura do cache"""
+    payloads = [entrance_payload(100000 + i) for i in range(n)]
+    start = time.perf_counter()
+    matrices = [_matrix(payload) for payload in payloads]
+    encode = (time.perf_counter() - start) / n * 1000
+    print(f"Codificação (dados e escolha da máscara): {encode:.2f} ms/código")
+
+    for formato, draw in ((PNG, _png), (SVG, _svg)):
+        start = time.perf_counter()
+        sizes = [len(draw(matrix)) for matrix in matrices]
+        image = (time.perf_counter() - start) / n * 1000
+
+        qr_images.clear()
+        for payload in payloads:
+            qr_code_image(payload, formato)
+        start = time.perf_counter()
+        for payload in payloads:
+            qr_code_image(payload, formato)
+        warm = (time.perf_counter() - start) / n * 1000
+
+        print(f"{formato.upper()}: geração {encode + image:.2f} ms/imagem (imagem {image:.2f} ms), "
+              f"cache {warm * 1000:.1f} µs/imagem, {sum(sizes) / n / 1024:.1f} KB/imagem")
+    qr_images.clear()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Códigos QR de check-in e check-out')
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+    benchmark_parser = subparsers.add_parser('benchmark', help='Mede o tempo de geração das imagens')
+    benchmark_parser.add_argument('-n', type=int, default=200, help='Imagens por formato')
+    args = parser.parse_args(argv)
+
+    if args.comando == 'benchmark':
+        benchmark(args.n)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
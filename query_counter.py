@@ -0,0 +1,189 @@
+"""
+Contagem de consultas SQL por requisição.
+
+Garante que as telas de listagem, visualização e os relatórios executam um
+número limitado de consultas, independente da quantidade de registros: uma
+regressão de N+1 (relacionamento carregado linha a linha) aparece como estouro
+do limite.
+
+Uso:
+    python query_counter.py   # confere os limites de QUERY_BUDGETS no banco configurado
+
+Ou em um trecho de código:
+    with assert_max_queries(db.engine, 3, 'ingressos'):
+        client.get('/ingressos/')
+"""
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import date
+from sqlalchemy import event
+
+
+class QueryCounter:
+    """Consultas registradas dentro de um bloco count_queries()"""
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Um trecho executou mais consultas que o limite definido"""
+
+
+@contextmanager
+def count_queries(engine):
+    """
+    Conta as consultas executadas no engine dentro do bloco.
+
+    Args:
+        engine: Engine SQLAlchemy (normalmente db.engine)
+
+    Yields:
+        QueryCounter: Consultas executadas até o momento
+    """
+    counter = QueryCounter()
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter.statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+@contextmanager
+def assert_max_queries(engine, limit, label='bloco'):
+    """
+    Falha com QueryBudgetExceeded se o bloco executar mais de `limit` consultas.
+    A mensagem inclui as consultas executadas para facilitar a investigação.
+    """
+    with count_queries(engine) as counter:
+        yield counter
+    if counter.count > limit:
+        statements = '\n'.join(f'  {i}. {s}' for i, s in enumerate(counter.statements, 1))
+        raise QueryBudgetExceeded(
+            f'{label}: {counter.count} consultas executadas (limite {limit})\n{statements}'
+        )
+
+
+# Limite de consultas por endpoint (GET). O usuário logado já está na sessão
+# do script, então a carga dele não entra na conta. Parâmetros entre <> são
+# preenchidos com um registro existente do banco.
+QUERY_BUDGETS = [
+    ('/ingressos/', 2),
+    ('/ingressos/dados?draw=1&start=0&length=100', 2),
+    ('/ingressos/historico', 1),
+    ('/ingressos/api/historico?limite=100', 1),
+    ('/ingressos/visualizar/<ingresso>', 1),
+    ('/entregas/', 3),
+    ('/entregas/dados?draw=1&start=0&length=100', 3),
+    ('/entregas/historico', 2),
+    ('/entregas/api/historico?limite=100', 2),
+    ('/pessoas/', 2),
+    ('/pessoas/dados?draw=1&start=0&length=100', 2),
+    ('/pessoas/visualizar/<pessoa>', 2),
+    ('/empresas/', 2),
+    ('/empresas/dados?draw=1&start=0&length=100', 2),
+    ('/correspondencias/', 2),
+    ('/correspondencias/dados?draw=1&start=0&length=100', 2),
+    ('/ocorrencias/', 2),
+    ('/ocorrencias/dados?draw=1&start=0&length=100', 2),
+]
+
+# Cada relatório deve ser uma única consulta, qualquer que seja o período,
+# mais a leitura das versões dos dados para a chave do cache. A contagem é a
+# de uma geração sem cache (o PDF em disco esconderia a consulta do relatório)
+REPORT_BUDGETS = [
+    ('ingressos', 2),
+    ('pessoas', 2),
+    ('empresas', 2),
+    ('entregas', 2),
+    ('correspondencias', 2),
+    ('ocorrencias', 2),
+]
+
+
+def _sample_urls():
+    """Valores usados nos parâmetros <> de QUERY_BUDGETS"""
+    from models import Ingresso, Pessoa
+    ingresso = Ingresso.query.order_by(Ingresso.id.desc()).first()
+    pessoa = Pessoa.query.first()
+    return {
+        '<ingresso>': str(ingresso.id) if ingresso else None,
+        '<pessoa>': pessoa.cpf if pessoa else None,
+    }
+
+
+def check_query_budgets(app, user):
+    """
+    Executa os endpoints de QUERY_BUDGETS e os relatórios autenticado como
+    `user` e confere o número de consultas de cada um.
+
+    Returns:
+        bool: True se todos ficaram dentro do limite
+    """
+    from app import db
+    from data_versions import versions
+    from reports import REPORTS
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+
+    samples = _sample_urls()
+    all_ok = True
+
+    for url, limit in QUERY_BUDGETS:
+        for placeholder, value in samples.items():
+            if placeholder in url:
+                url = url.replace(placeholder, value) if value else None
+                break
+        if url is None:
+            print("[IGNORADO] sem registros para montar a URL")
+            continue
+
+        with count_queries(db.engine) as counter:
+            response = client.get(url)
+        ok = response.status_code == 200 and counter.count <= limit
+        all_ok = all_ok and ok
+        print(f"[{'OK' if ok else 'FALHA'}] {url}: {counter.count} consultas (limite {limit}), HTTP {response.status_code}")
+
+    for tipo, limit in REPORT_BUDGETS:
+        report = REPORTS[tipo]
+        fd, path = tempfile.mkstemp(suffix='.pdf')
+        os.close(fd)
+        try:
+            with app.test_request_context():
+                # A verificação da tabela data_versions é feita uma vez por
+                # processo e não entra na conta
+                versions(report.tables)
+                with count_queries(db.engine) as counter:
+                    versions(report.tables)
+                    report.render_pdf(date(2000, 1, 1), date.today(), path)
+        finally:
+            os.remove(path)
+        ok = counter.count <= limit
+        all_ok = all_ok and ok
+        print(f"[{'OK' if ok else 'FALHA'}] relatório {tipo}: {counter.count} consultas (limite {limit})")
+
+    return all_ok
+
+
+if __name__ == '__main__':
+    from main import app
+    from models import User
+
+    with app.app_context():
+        user = User.query.filter_by(role='admin').first()
+        if not user:
+            print("Nenhum usuário administrador encontrado.")
+            sys.exit(1)
+        sys.exit(0 if check_query_budgets(app, user) else 1)
@@ -0,0 +1,173 @@
+"""
+Cache em disco dos relatórios em PDF.
+
+A chave de cada arquivo combina o tipo do relatório, o período e a versão
+dos dados das tabelas de origem (data_versions). Qualquer alteração nessas
+tabelas muda a chave, então um arquivo desatualizado nunca é servido; ele
+apenas deixa de ser usado e sai pela limpeza por tamanho (os menos usados
+recentemente primeiro).
+
+Os arquivos são gerados com nome temporário no próprio diretório e renomeados
+ao final, então um worker nunca lê um PDF pela metade. Temporários de
+gerações interrompidas são removidos pela limpeza.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+from flask import current_app
+
+from data_versions import track, versions
+from reports import REPORTS
+
+# Alterar quando o layout do PDF mudar, para descartar os arquivos antigos
+LAYOUT_VERSION = 3
+
+ARTIFACT_SUFFIX = '.pdf'
+TEMP_SUFFIX = '.tmp'
+
+# Temporários mais antigos que isso são de gerações interrompidas
+STALE_TEMP_SECONDS = 3600
+
+for _report in REPORTS.values():
+    track(*_report.tables)
+
+
+class ReportCache:
+    """
+    Diretório de relatórios gerados, limitado a `max_bytes`.
+
+    Args:
+        directory (str): Diretório dos arquivos
+        max_bytes (int): Tamanho máximo somado dos arquivos
+    """
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, report, data_inicio, data_fim):
+        """
+        Chave do relatório no estado atual dos dados, ou None se as versões
+        não estiverem disponíveis (banco sem a tabela data_versions).
+        """
+        current = versions(report.tables)
+        if current is None:
+            return None
+        parts = [str(LAYOUT_VERSION), report.tipo, data_inicio.isoformat(), data_fim.isoformat()]
+        parts += [f'{table}={current[table]}' for table in sorted(current)]
+        return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ARTIFACT_SUFFIX)
+
+    def open(self, key):
+        """
+        Arquivo da chave aberto para leitura, ou None se não estiver no cache.
+        Aberto, ele continua legível mesmo que a limpeza o remova em seguida.
+        """
+        path = self._path(key)
+        try:
+            artifact = open(path, 'rb')
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        # Atualiza o horário de uso para a limpeza por tamanho
+        os.utime(path)
+        self.hits += 1
+        return artifact
+
+    def temp_path(self):
+        """Arquivo temporário no diretório do cache (removido pela limpeza se abandonado)"""
+        fd, path = tempfile.mkstemp(suffix=TEMP_SUFFIX, dir=self.directory)
+        os.close(fd)
+        return path
+
+    def store(self, key, render):
+        """
+        Gera o arquivo da chave com render(caminho) e o guarda no cache.
+
+        Returns:
+            file: Arquivo gerado, aberto para leitura
+        """
+        temp_path = self.temp_path()
+        try:
+            render(temp_path)
+            path = self._path(key)
+            os.replace(temp_path, path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+        artifact = open(path, 'rb')
+        self.evict(keep=path)
+        return artifact
+
+    def evict(self, keep=None):
+        """
+        Remove temporários abandonados e os arquivos menos usados acima do
+        limite, exceto `keep` (o arquivo que acabou de ser gerado).
+        """
+        with self._lock:
+            now = time.time()
+            artifacts = []
+            for entry in os.scandir(self.directory):
+                if not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.endswith(TEMP_SUFFIX):
+                    if now - stat.st_mtime > STALE_TEMP_SECONDS:
+                        self._remove(entry.path)
+                elif entry.name.endswith(ARTIFACT_SUFFIX) and entry.path != keep:
+                    artifacts.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in artifacts)
+            if keep:
+                total += os.path.getsize(keep)
+            for _, size, path in sorted(artifacts):
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                self.evictions += 1
+                total -= size
+
+    def _remove(self, path):
+        # Outro worker pode ter removido o mesmo arquivo
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        files = [entry for entry in os.scandir(self.directory)
+                 if entry.name.endswith(ARTIFACT_SUFFIX)]
+        total = self.hits + self.misses
+        return {
+            'arquivos': len(files),
+            'bytes': sum(entry.stat().st_size for entry in files),
+            'limite_bytes': self.max_bytes,
+            'acertos': self.hits,
+            'faltas': self.misses,
+            'descartes': self.evictions,
+            'taxa_acerto': round(self.hits / total, 3) if total else None,
+        }
+
+
+_caches = {}
+
+
+def report_cache():
+    """Cache de relatórios do diretório configurado na aplicação atual"""
+    directory = current_app.config['REPORT_CACHE_DIR']
+    if directory not in _caches:
+        max_bytes = current_app.config['REPORT_CACHE_MAX_MB'] * 1024 * 1024
+        _caches[directory] = ReportCache(directory, max_bytes)
+    return _caches[directory]
@@ -0,0 +1,201 @@
+"""
+Geração de relatórios em PDF em segundo plano.
+
+Cada worker do gunicorn mantém um pool pequeno de threads; a requisição só
+registra a tarefa em report_jobs e devolve o id, e o PDF é gerado fora do
+ciclo da requisição. O progresso (linhas lidas e páginas geradas) é gravado
+na tarefa, em uma conexão própria, para que qualquer worker responda à
+consulta de status. O arquivo pronto fica no cache de relatórios.
+
+No SQLite um escritor precisa esperar todos os leitores, e a própria tarefa
+mantém a leitura do relatório aberta enquanto gera o PDF; por isso, nele, o
+progresso é gravado pela mesma conexão da leitura (_update_job_in_session).
+Em todos os bancos a gravação do progresso também renova atualizado_em, que
+check_stale usa para reconhecer uma tarefa interrompida.
+
+O número de tarefas por worker (em execução mais na fila) é limitado; acima
+disso a submissão é recusada com QueueFull.
+"""
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from app import db
+from models import ReportJob
+from report_cache import report_cache
+from reports import REPORTS
+
+logger = logging.getLogger(__name__)
+
+PENDENTE = 'pendente'
+PROCESSANDO = 'processando'
+CONCLUIDO = 'concluido'
+ERRO = 'erro'
+
+# Intervalo mínimo entre gravações de progresso
+PROGRESS_INTERVAL = 1.0
+
+# Tarefa sem atualização há mais tempo que isso foi interrompida (reinício do worker)
+STALE_AFTER = timedelta(minutes=30)
+
+# Tarefas mais antigas são apagadas a cada nova submissão
+RETENTION = timedelta(days=7)
+
+
+# Progresso das tarefas em execução neste worker: {id: (linhas, páginas)}
+_live_progress = {}
+
+# Tarefas submetidas neste worker que ainda não terminaram
+_active = set()
+
+
+class QueueFull(Exception):
+    """Limite de tarefas de relatório deste worker atingido"""
+
+
+def _update_job(job_id, **values):
+    """Atualiza a tarefa em uma transação própria (fora da sessão da requisição)"""
+    values['atualizado_em'] = datetime.now()
+    with db.engine.begin() as conn:
+        conn.execute(update(ReportJob.__table__).where(ReportJob.id == job_id).values(**values))
+
+
+def _update_job_in_session(job_id, **values):
+    """
+    Atualiza a tarefa pela conexão da sessão e confirma só no driver (SQLite).
+
+    Outra conexão não consegue gravar enquanto a leitura do relatório está
+    aberta nesta, mas a própria conexão consegue; a confirmação direta no
+    driver não encerra a sessão nem a leitura em andamento.
+    """
+    values['atualizado_em'] = datetime.now()
+    connection = db.session.connection()
+    connection.execute(update(ReportJob.__table__).where(ReportJob.id == job_id).values(**values))
+    connection.connection.dbapi_connection.commit()
+
+
+class _Progress:
+    """Callback de progresso do PDF que grava na tarefa no máximo a cada PROGRESS_INTERVAL"""
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.rows = 0
+        self.pages = 0
+        self._written_at = 0
+        self._save = _update_job_in_session if db.engine.dialect.name == 'sqlite' else _update_job
+
+    def __call__(self, rows, pages):
+        self.rows, self.pages = rows, pages
+        _live_progress[self.job_id] = (rows, pages)
+        now = time.monotonic()
+        if now - self._written_at >= PROGRESS_INTERVAL:
+            self._written_at = now
+            try:
+                self._save(self.job_id, linhas=rows, paginas=pages)
+            except Exception as e:
+                # O progresso não vale interromper o relatório; tenta de novo no próximo
+                logger.warning(f'Erro ao gravar o progresso da tarefa {self.job_id}: {e}')
+
+
+def _run(app, job_id):
+    with app.app_context():
+        try:
+            job = db.session.get(ReportJob, job_id)
+            data_inicio, data_fim = job.data_inicio, job.data_fim
+            report = REPORTS[job.tipo]
+            cache = report_cache()
+            # Encerra a leitura antes de gravar por outra conexão
+            db.session.commit()
+            _update_job(job_id, status=PROCESSANDO)
+
+            progress = _Progress(job_id)
+            key = cache.key(report, data_inicio, data_fim)
+            artifact = cache.open(key) if key else None
+            if artifact is None:
+                # Sem versões dos dados o arquivo fica só para esta tarefa
+                key = key or f'job-{job_id}'
+                artifact = cache.store(key, lambda path: report.render_pdf(
+                    data_inicio, data_fim, path, on_progress=progress
+                ))
+            artifact.close()
+            db.session.commit()
+
+            _update_job(job_id, status=CONCLUIDO, chave=key, linhas=progress.rows,
+                        paginas=progress.pages, concluido_em=datetime.now())
+        except Exception as e:
+            logger.exception(f'Erro ao gerar o relatório da tarefa {job_id}')
+            db.session.rollback()
+            _update_job(job_id, status=ERRO, erro=str(e))
+        finally:
+            _live_progress.pop(job_id, None)
+            _active.discard(job_id)
+            db.session.remove()
+
+
+class ReportJobPool:
+    """Pool de threads com limite de tarefas em execução e na fila"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+
+    def _start(self, app):
+        with self._lock:
+            if self._executor is None:
+                workers = app.config['REPORT_JOB_WORKERS']
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='relatorios')
+                self._slots = threading.BoundedSemaphore(workers + app.config['REPORT_JOB_QUEUE'])
+
+    def submit(self, app, user_id, tipo, data_inicio, data_fim):
+        """
+        Registra a tarefa e a coloca na fila.
+
+        Returns:
+            ReportJob: Tarefa criada (status pendente)
+
+        Raises:
+            QueueFull: Se o limite de tarefas deste worker foi atingido
+        """
+        self._start(app)
+        if not self._slots.acquire(blocking=False):
+            raise QueueFull()
+
+        try:
+            ReportJob.query.filter(ReportJob.criado_em < datetime.now() - RETENTION).delete()
+            job = ReportJob(id=uuid.uuid4().hex, user_id=user_id, tipo=tipo,
+                            data_inicio=data_inicio, data_fim=data_fim, status=PENDENTE)
+            db.session.add(job)
+            db.session.commit()
+            _active.add(job.id)
+            future = self._executor.submit(_run, app, job.id)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return job
+
+
+job_pool = ReportJobPool()
+
+
+def live_progress(job):
+    """Linhas e páginas da tarefa, incluindo o progresso ainda não gravado no banco"""
+    return _live_progress.get(job.id, (job.linhas, job.paginas))
+
+
+def check_stale(job):
+    """
+    Marca como erro a tarefa que parou de ser atualizada (worker reiniciado).
+    Se ela ainda terminar, o resultado sobrescreve o erro.
+    """
+    if (job.status in (PENDENTE, PROCESSANDO) and job.id not in _active
+            and datetime.now() - job.atualizado_em > STALE_AFTER):
+        job.status = ERRO
+        job.erro = 'Tarefa interrompida. Gere o relatório novamente.'
+        job.atualizado_em = datetime.now()
+        db.session.commit()
+    return job
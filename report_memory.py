@@ -0,0 +1,85 @@
+"""
+Memória usada na geração dos relatórios em PDF.
+
+As linhas são lidas do banco aos poucos e só as da página atual ficam em
+memória, mas o canvas do reportlab guarda cada página pronta até gravar o
+arquivo: o pico cresce com o número de páginas, não com o de linhas lidas.
+Esta verificação gera o mesmo relatório com duas quantidades de linhas e
+confere que o pico fica dentro de BASE_BUDGET + PAGE_BUDGET por página nas
+duas; linhas retidas além da página atual (ou páginas mais pesadas) aparecem
+como estouro do limite na maior.
+
+Uso:
+    python report_memory.py                 # 1.000 e 10.000 linhas
+    python report_memory.py 5000 50000
+"""
+import os
+import sys
+import tempfile
+import tracemalloc
+
+from utils import generate_pdf_report
+
+# Pico medido com tracemalloc: estruturas fixas da geração e custo de cada
+# página guardada pelo canvas (cerca de 16 KB nas medições)
+BASE_BUDGET = 2 * 1024 * 1024
+PAGE_BUDGET = 20 * 1024
+
+DEFAULT_ROWS = (1000, 10000)
+
+HEADERS = ['Data', 'Hora', 'Local', 'Descrição', 'Gravidade', 'Registrado por']
+COL_WEIGHTS = [1, 0.7, 1.5, 4, 1, 1.5]
+
+
+def _rows(count):
+    """Linhas como as das ocorrências; uma em cada dez com descrição longa"""
+    for i in range(count):
+        descricao = f'Ocorrência {i} registrada na portaria principal'
+        if i % 10 == 0:
+            descricao = ' '.join([descricao] * 8)
+        yield ['05/02/2025', '08:30', 'Portaria principal', descricao, 'MEDIA', 'Vigilante']
+
+
+def measure(count):
+    """
+    Gera um relatório de `count` linhas e mede o pico de memória.
+
+    Returns:
+        tuple: (pico em bytes, páginas)
+    """
+    pages = []
+    fd, path = tempfile.mkstemp(suffix='.pdf')
+    os.close(fd)
+    tracemalloc.start()
+    try:
+        generate_pdf_report(_rows(count), 'Relatório de Ocorrências', HEADERS, path,
+                            ('01/01/2025', '31/12/2025'), COL_WEIGHTS,
+                            on_progress=lambda rows, page: pages.append(page))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        os.remove(path)
+    return peak, pages[-1]
+
+
+def check_report_memory(counts=DEFAULT_ROWS):
+    """
+    Confere o pico de memória dos relatórios com cada quantidade de linhas.
+
+    Returns:
+        bool: True se todos ficaram dentro do limite
+    """
+    all_ok = True
+    for count in counts:
+        peak, pages = measure(count)
+        limit = BASE_BUDGET + PAGE_BUDGET * pages
+        ok = peak <= limit
+        all_ok = all_ok and ok
+        print(f"[{'OK' if ok else 'FALHA'}] {count} linhas, {pages} páginas: pico de "
+              f"{peak / 1024 / 1024:.1f} MB (limite {limit / 1024 / 1024:.1f} MB)")
+    return all_ok
+
+
+if __name__ == '__main__':
+    counts = [int(arg) for arg in sys.argv[1:]] or DEFAULT_ROWS
+    sys.exit(0 if check_report_memory(counts) else 1)
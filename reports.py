@@ -0,0 +1,453 @@
+"""
+Definições dos relatórios: consulta, colunas e formatação de cada linha.
+
+As linhas são lidas do banco em lotes (yield_per) e formatadas uma a uma,
+sem montar a lista completa em memória; o gerador do PDF consome uma página
+de cada vez. As exportações CSV, XLSX e JSON-lines são geradores de bytes,
+enviados ao navegador à medida que as linhas são lidas.
+"""
+import csv
+import io
+import json
+import re
+import zipfile
+from datetime import date, time
+from xml.sax.saxutils import escape
+
+from app import db
+from utils import generate_pdf_report
+from models import Pessoa, Ingresso, Empresa, Entrega, Correspondencia, Ocorrencia
+
+# Quantidade de linhas trazidas do banco por vez
+FETCH_SIZE = 1000
+
+# Linhas acumuladas antes de enviar um pedaço da resposta
+STREAM_BATCH = 500
+
+# Caracteres de controle que o XML 1.0 não aceita (o Excel recusa a planilha)
+_XML_INVALID_CHARS = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+class ReportColumn:
+    """
+    Coluna de um relatório.
+
+    Args:
+        key (str): Nome do campo nas exportações JSON-lines
+        header (str): Título da coluna
+        width (int): Largura relativa da coluna no PDF
+    """
+    def __init__(self, key, header, width=1):
+        self.key = key
+        self.header = header
+        self.width = width
+
+
+class ReportDefinition:
+    """
+    Relatório disponível em /relatorios.
+
+    Args:
+        tipo (str): Identificador usado no formulário (ex.: 'ingressos')
+        title (str): Título impresso no relatório
+        columns (list): Lista de ReportColumn
+        query: Função (data_inicio, data_fim) que retorna a consulta das colunas
+        row: Função que converte um registro da consulta em lista de valores
+            (datas e horas como objetos, None para vazio)
+        tables (tuple): Tabelas lidas pela consulta (invalidação do cache)
+    """
+    def __init__(self, tipo, title, columns, query, row, tables):
+        self.tipo = tipo
+        self.title = title
+        self.columns = columns
+        self.query = query
+        self.row = row
+        self.tables = tables
+
+    @property
+    def headers(self):
+        return [column.header for column in self.columns]
+
+    @property
+    def keys(self):
+        return [column.key for column in self.columns]
+
+    @property
+    def col_weights(self):
+        return [column.width for column in self.columns]
+
+    def values(self, data_inicio, data_fim):
+        """Gera os valores de cada linha do período, lendo o banco em lotes"""
+        for record in self.query(data_inicio, data_fim).yield_per(FETCH_SIZE):
+            yield self.row(record)
+
+    def rows(self, data_inicio, data_fim):
+        """Gera as linhas do período formatadas para leitura"""
+        for values in self.values(data_inicio, data_fim):
+            yield display_row(values)
+
+    def render_pdf(self, data_inicio, data_fim, path, on_progress=None):
+        """Gera o PDF do período em `path` (on_progress recebe linhas e páginas)"""
+        generate_pdf_report(
+            data=self.rows(data_inicio, data_fim),
+            title=self.title,
+            headers=self.headers,
+            filename=path,
+            date_range=(data_inicio.strftime("%d/%m/%Y"), data_fim.strftime("%d/%m/%Y")),
+            col_weights=self.col_weights,
+            on_progress=on_progress
+        )
+
+
+def _display(value):
+    if value is None or value == '':
+        return "-"
+    if isinstance(value, date):
+        return value.strftime("%d/%m/%Y")
+    if isinstance(value, time):
+        return value.strftime("%H:%M")
+    return value
+
+
+def display_row(values):
+    """Valores formatados como no PDF: datas dd/mm/aaaa, horas HH:MM e "-" para vazio"""
+    return [_display(value) for value in values]
+
+
+def _json_value(value):
+    # Datas e horas em ISO 8601; vazio continua null
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    return value
+
+
+def _ingressos_query(data_inicio, data_fim):
+    # Só as colunas do relatório, com o nome da pessoa vindo do mesmo join
+    return db.session.query(
+        Ingresso.data, Ingresso.entrada, Ingresso.saida, Pessoa.nome, Pessoa.cpf,
+        Ingresso.motivo, Ingresso.pessoa_setor
+    ).join(Pessoa).filter(
+        Ingresso.data.between(data_inicio, data_fim)
+    ).order_by(Ingresso.data.desc(), Ingresso.entrada.desc())
+
+
+def _ingressos_row(ingresso):
+    return [
+        ingresso.data,
+        ingresso.entrada,
+        ingresso.saida,
+        ingresso.nome,
+        ingresso.cpf,
+        ingresso.motivo,
+        ingresso.pessoa_setor
+    ]
+
+
+def _pessoas_query(data_inicio, data_fim):
+    # Cadastro completo, independente do período
+    return db.session.query(
+        Pessoa.cpf, Pessoa.nome, Pessoa.telefone, Pessoa.empresa
+    ).order_by(Pessoa.nome)
+
+
+def _pessoas_row(pessoa):
+    return [
+        pessoa.cpf,
+        pessoa.nome,
+        pessoa.telefone,
+        pessoa.empresa
+    ]
+
+
+def _empresas_query(data_inicio, data_fim):
+    # Cadastro completo, independente do período
+    return db.session.query(
+        Empresa.cnpj, Empresa.nome_empresa, Empresa.telefone_empresa,
+        Empresa.nome_func, Empresa.telefone_func
+    ).order_by(Empresa.nome_empresa)
+
+
+def _empresas_row(empresa):
+    return [
+        empresa.cnpj,
+        empresa.nome_empresa,
+        empresa.telefone_empresa,
+        empresa.nome_func,
+        empresa.telefone_func
+    ]
+
+
+def _entregas_query(data_inicio, data_fim):
+    # Nome da empresa vindo do mesmo join
+    return db.session.query(
+        Entrega.data_registro, Entrega.hora_registro, Empresa.nome_empresa,
+        Entrega.nota_fiscal, Entrega.data_envio, Entrega.hora_envio
+    ).join(Empresa).filter(
+        Entrega.data_registro.between(data_inicio, data_fim)
+    ).order_by(Entrega.data_registro.desc(), Entrega.hora_registro.desc())
+
+
+def _entregas_row(entrega):
+    return [
+        entrega.data_registro,
+        entrega.hora_registro,
+        entrega.nome_empresa,
+        entrega.nota_fiscal,
+        "Pendente" if not entrega.data_envio else "Enviado",
+        entrega.data_envio,
+        entrega.hora_envio
+    ]
+
+
+def _correspondencias_query(data_inicio, data_fim):
+    return db.session.query(
+        Correspondencia.data_recebimento, Correspondencia.hora_recebimento,
+        Correspondencia.remetente, Correspondencia.destinatario, Correspondencia.tipo,
+        Correspondencia.setor_encomenda, Correspondencia.data_destinacao
+    ).filter(
+        Correspondencia.data_recebimento.between(data_inicio, data_fim)
+    ).order_by(Correspondencia.data_recebimento.desc())
+
+
+def _correspondencias_row(correspondencia):
+    return [
+        correspondencia.data_recebimento,
+        correspondencia.hora_recebimento,
+        correspondencia.remetente,
+        correspondencia.destinatario,
+        correspondencia.tipo,
+        correspondencia.setor_encomenda,
+        "Pendente" if not correspondencia.data_destinacao else "Entregue"
+    ]
+
+
+def _ocorrencias_query(data_inicio, data_fim):
+    return db.session.query(
+        Ocorrencia.data_registro, Ocorrencia.hora_registro, Ocorrencia.vigilante,
+        Ocorrencia.envolvidos, Ocorrencia.gravidade, Ocorrencia.ocorrencia
+    ).filter(
+        Ocorrencia.data_registro.between(data_inicio, data_fim)
+    ).order_by(Ocorrencia.data_registro.desc())
+
+
+def _ocorrencias_row(ocorrencia):
+    return [
+        ocorrencia.data_registro,
+        ocorrencia.hora_registro,
+        ocorrencia.vigilante,
+        ocorrencia.envolvidos,
+        ocorrencia.gravidade.upper() if ocorrencia.gravidade else None,
+        ocorrencia.ocorrencia
+    ]
+
+
+REPORTS = {
+    report.tipo: report for report in (
+        ReportDefinition(
+            'ingressos', "Relatório de Ingressos",
+            [ReportColumn('data', "Data", 2), ReportColumn('entrada', "Entrada", 1.5), ReportColumn('saida', "Saída", 1.5),
+             ReportColumn('nome', "Nome", 5), ReportColumn('cpf', "CPF", 3), ReportColumn('motivo', "Motivo", 4),
+             ReportColumn('pessoa_setor', "Pessoa/Setor", 4)],
+            _ingressos_query, _ingressos_row, ('ingressos', 'pessoas')
+        ),
+        ReportDefinition(
+            'pessoas', "Relatório de Pessoas Cadastradas",
+            [ReportColumn('cpf', "CPF", 2), ReportColumn('nome', "Nome", 4), ReportColumn('telefone', "Telefone", 2),
+             ReportColumn('empresa', "Empresa", 4)],
+            _pessoas_query, _pessoas_row, ('pessoas',)
+        ),
+        ReportDefinition(
+            'empresas', "Relatório de Empresas",
+            [ReportColumn('cnpj', "CNPJ", 3), ReportColumn('empresa', "Empresa", 5), ReportColumn('telefone', "Telefone", 3),
+             ReportColumn('funcionario', "Funcionário", 4), ReportColumn('telefone_funcionario', "Telefone Func.", 3)],
+            _empresas_query, _empresas_row, ('empresas',)
+        ),
+        ReportDefinition(
+            'entregas', "Relatório de Entregas",
+            [ReportColumn('data', "Data", 2), ReportColumn('hora', "Hora", 1.5), ReportColumn('empresa', "Empresa", 5),
+             ReportColumn('nota_fiscal', "Nota Fiscal", 3), ReportColumn('status', "Status", 2),
+             ReportColumn('data_envio', "Data Envio", 2), ReportColumn('hora_envio', "Hora Envio", 2)],
+            _entregas_query, _entregas_row, ('entregas', 'empresas')
+        ),
+        ReportDefinition(
+            'correspondencias', "Relatório de Correspondências",
+            [ReportColumn('data', "Data", 2), ReportColumn('hora', "Hora", 1.5), ReportColumn('remetente', "Remetente", 4),
+             ReportColumn('destinatario', "Destinatário", 4), ReportColumn('tipo', "Tipo", 2), ReportColumn('setor', "Setor", 3),
+             ReportColumn('status', "Status", 2)],
+            _correspondencias_query, _correspondencias_row, ('correspondencias',)
+        ),
+        ReportDefinition(
+            'ocorrencias', "Relatório de Ocorrências",
+            [ReportColumn('data', "Data", 2), ReportColumn('hora', "Hora", 1.5), ReportColumn('vigilante', "Vigilante", 3),
+             ReportColumn('envolvidos', "Envolvidos", 4), ReportColumn('gravidade', "Gravidade", 2),
+             ReportColumn('descricao', "Descrição", 9)],
+            _ocorrencias_query, _ocorrencias_row, ('ocorrencias',)
+        ),
+    )
+}
+
+
+def _batches(rows, size=STREAM_BATCH):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def export_csv(report, rows):
+    """
+    CSV separado por ponto e vírgula e com BOM UTF-8, como o Excel em
+    português espera. Os valores saem formatados como no PDF.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';')
+    writer.writerow(report.headers)
+    yield ('\ufeff' + buffer.getvalue()).encode('utf-8')
+
+    for batch in _batches(rows):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(display_row(row) for row in batch)
+        yield buffer.getvalue().encode('utf-8')
+
+
+def export_jsonl(report, rows):
+    """
+    Um objeto JSON por linha, com as chaves das colunas do relatório; datas
+    e horas em ISO 8601 e null nos campos vazios.
+    """
+    keys = report.keys
+    for batch in _batches(rows):
+        yield ''.join(
+            json.dumps(dict(zip(keys, map(_json_value, row))), ensure_ascii=False) + '\n' for row in batch
+        ).encode('utf-8')
+
+
+class _ZipStream(io.RawIOBase):
+    """
+    Destino do zipfile que apenas acumula os bytes escritos; o gerador
+    esvazia o buffer a cada lote. Sem seek, o zipfile grava os tamanhos
+    depois de cada arquivo (data descriptor), o que permite enviar o XLSX
+    sem conhecer o conteúdo completo.
+    """
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+_XLSX_STATIC_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+        'Target="styles.xml"/>'
+        '</Relationships>'
+    ),
+    # Estilo 1: cabeçalho em negrito
+    'xl/styles.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+        '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border/></borders>'
+        '<cellStyleXfs count="1"><xf/></cellStyleXfs>'
+        '<cellXfs count="2"><xf/><xf fontId="1" applyFont="1"/></cellXfs>'
+        '</styleSheet>'
+    ),
+}
+
+_XLSX_SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<sheetData>'
+)
+_XLSX_SHEET_END = '</sheetData></worksheet>'
+
+
+def _xlsx_row(values, style=None):
+    # Strings inline (sem sharedStrings, que exigiria conhecer todos os valores)
+    attr = f' s="{style}"' if style else ''
+    cells = ''.join(
+        f'<c t="inlineStr"{attr}><is><t xml:space="preserve">'
+        f'{escape(_XML_INVALID_CHARS.sub("", str(value)))}</t></is></c>'
+        if value is not None else '<c/>'
+        for value in values
+    )
+    return f'<row>{cells}</row>'
+
+
+def export_xlsx(report, rows):
+    """
+    Planilha XLSX montada com zipfile, sem dependências externas. Os valores
+    saem formatados como no PDF.
+    """
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _XLSX_STATIC_PARTS.items():
+            archive.writestr(name, content)
+        archive.writestr('xl/workbook.xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets><sheet name="{escape(report.tipo.capitalize())}" sheetId="1" r:id="rId1"/></sheets>'
+            '</workbook>'
+        ))
+
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write((_XLSX_SHEET_START + _xlsx_row(report.headers, style=1)).encode('utf-8'))
+            yield stream.drain()
+            for batch in _batches(rows):
+                sheet.write(''.join(_xlsx_row(display_row(row)) for row in batch).encode('utf-8'))
+                yield stream.drain()
+            sheet.write(_XLSX_SHEET_END.encode('utf-8'))
+    yield stream.drain()
+
+
+# Formatos de exportação: (extensão, mimetype, gerador)
+EXPORT_FORMATS = {
+    'csv': ('csv', 'text/csv; charset=utf-8', export_csv),
+    'xlsx': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', export_xlsx),
+    'jsonl': ('jsonl', 'application/x-ndjson', export_jsonl),
+}
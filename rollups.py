@@ -0,0 +1,284 @@
+"""
+Contagens de movimento da portaria (ingressos, entregas e correspondências)
+por dia e hora, no total e por setor, motivo e tipo.
+
+A tabela traffic_rollups é mantida de forma incremental: antes de cada flush
+as inserções, alterações e exclusões dos modelos acompanhados viram
+incrementos (+1/-1) por chave, aplicados com upsert na mesma transação logo
+após o flush. As consultas de estatística leem só a tabela agregada (no
+máximo 24 linhas por dia e dimensão), nunca os registros.
+
+UPDATE/DELETE em lote (query.update()) não passa pelo flush; se alterar as
+colunas contadas, é preciso reconstruir as contagens.
+
+Uso:
+    python rollups.py rebuild [--desde AAAA-MM-DD]   # recalcula a partir dos registros
+"""
+import argparse
+import logging
+import sys
+from collections import Counter
+from datetime import date, timedelta
+
+from sqlalchemy import event, inspect, select, delete, func, extract, text
+from sqlalchemy.orm import Session
+
+from app import db
+from data_versions import dialect_insert
+from models import Ingresso, Entrega, Correspondencia, TrafficRollup
+from utils import get_brasil_datetime
+
+logger = logging.getLogger(__name__)
+
+TOTAL = 'total'
+
+# Linhas por comando de upsert (limite de parâmetros do SQLite)
+BATCH_SIZE = 1000
+
+
+class RollupSource:
+    """
+    Modelo contado nas estatísticas.
+
+    Args:
+        fonte (str): Nome da fonte nas consultas (ex.: 'ingressos')
+        model: Classe do modelo
+        day (str): Atributo com a data
+        time (str): Atributo com a hora
+        dimensions (dict): {dimensão: atributo} contados por valor
+    """
+    def __init__(self, fonte, model, day, time, dimensions):
+        self.fonte = fonte
+        self.model = model
+        self.day = day
+        self.time = time
+        self.dimensions = dimensions
+
+    @property
+    def attributes(self):
+        return [self.day, self.time] + list(self.dimensions.values())
+
+    def keys(self, values):
+        """Chaves (dimensao, dia, hora, valor) contadas para um registro"""
+        day, time = values.get(self.day), values.get(self.time)
+        if day is None or time is None:
+            return []
+        keys = [(TOTAL, day, time.hour, '')]
+        for dimension, attribute in self.dimensions.items():
+            keys.append((dimension, day, time.hour, (values.get(attribute) or '')[:200]))
+        return keys
+
+
+ROLLUP_SOURCES = {
+    source.model: source for source in (
+        RollupSource('ingressos', Ingresso, 'data', 'entrada',
+                     {'setor': 'pessoa_setor', 'motivo': 'motivo'}),
+        RollupSource('entregas', Entrega, 'data_registro', 'hora_registro', {}),
+        RollupSource('correspondencias', Correspondencia, 'data_recebimento', 'hora_recebimento',
+                     {'setor': 'setor_encomenda', 'tipo': 'tipo'}),
+    )
+}
+
+# Dimensões disponíveis por fonte nas consultas (além de 'hora' e 'dia')
+DIMENSIONS = {source.fonte: list(source.dimensions) for source in ROLLUP_SOURCES.values()}
+
+_PENDING_KEY = 'rollups_pending'
+
+# Engines em que a tabela traffic_rollups existe (conferido uma vez por engine)
+_available = {}
+
+
+def _is_available(connection):
+    # Antes da migração 8 os flushes dos modelos contados não podem falhar;
+    # a migração recalcula as contagens a partir dos registros ao criar a tabela
+    engine = connection.engine
+    if engine not in _available:
+        _available[engine] = inspect(connection).has_table(TrafficRollup.__tablename__)
+        if not _available[engine]:
+            logger.warning('Tabela traffic_rollups não encontrada; execute python migrations.py upgrade')
+    return _available[engine]
+
+
+def _current_values(obj, source):
+    return {attribute: getattr(obj, attribute) for attribute in source.attributes}
+
+
+def _previous_values(obj, source):
+    """Valores das colunas contadas antes das alterações ainda não gravadas"""
+    state = inspect(obj)
+    values = {}
+    for attribute in source.attributes:
+        history = state.attrs[attribute].history
+        if history.deleted:
+            values[attribute] = history.deleted[0]
+        elif history.unchanged:
+            values[attribute] = history.unchanged[0]
+        else:
+            values[attribute] = getattr(obj, attribute)
+    return values
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_deltas(session, flush_context, instances):
+    # Antes do flush os valores anteriores ainda estão no histórico dos
+    # atributos, e os registros excluídos ainda podem ser carregados do banco
+    deltas = Counter()
+    for obj in session.new:
+        source = ROLLUP_SOURCES.get(type(obj))
+        if source:
+            for key in source.keys(_current_values(obj, source)):
+                deltas[(source.fonte,) + key] += 1
+
+    for obj in session.deleted:
+        source = ROLLUP_SOURCES.get(type(obj))
+        if source:
+            for key in source.keys(_previous_values(obj, source)):
+                deltas[(source.fonte,) + key] -= 1
+
+    for obj in session.dirty:
+        source = ROLLUP_SOURCES.get(type(obj))
+        if source and session.is_modified(obj, include_collections=False):
+            for key in source.keys(_previous_values(obj, source)):
+                deltas[(source.fonte,) + key] -= 1
+            for key in source.keys(_current_values(obj, source)):
+                deltas[(source.fonte,) + key] += 1
+
+    # Descarta as chaves que se anularam (ex.: alteração que não mudou a contagem)
+    deltas = {key: n for key, n in deltas.items() if n}
+    if deltas:
+        pending = session.info.setdefault(_PENDING_KEY, Counter())
+        pending.update(deltas)
+
+
+@event.listens_for(Session, 'after_flush')
+def _apply_deltas(session, flush_context):
+    deltas = session.info.pop(_PENDING_KEY, None)
+    if deltas:
+        connection = session.connection()
+        if _is_available(connection):
+            apply_deltas(connection, deltas)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_deltas(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+def apply_deltas(connection, deltas):
+    """Soma os incrementos {(fonte, dimensao, dia, hora, valor): n} às contagens"""
+    table = TrafficRollup.__table__
+    insert = dialect_insert(connection.dialect.name)
+    rows = [
+        {'fonte': fonte, 'dimensao': dimensao, 'dia': dia, 'hora': hora, 'valor': valor, 'quantidade': n}
+        for (fonte, dimensao, dia, hora, valor), n in sorted(deltas.items()) if n
+    ]
+    for start in range(0, len(rows), BATCH_SIZE):
+        stmt = insert(table).values(rows[start:start + BATCH_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.fonte, table.c.dimensao, table.c.dia, table.c.hora, table.c.valor],
+            set_={'quantidade': table.c.quantidade + stmt.excluded.quantidade}
+        )
+        connection.execute(stmt)
+
+
+def rebuild(desde=None):
+    """
+    Recalcula as contagens a partir dos registros (todas, ou a partir de `desde`).
+
+    No PostgreSQL as tabelas de origem ficam bloqueadas para escrita durante
+    a reconstrução, para que nenhum commit concorrente se perca.
+    """
+    connection = db.session.connection()
+    table = TrafficRollup.__table__
+
+    if connection.dialect.name == 'postgresql':
+        names = ', '.join(source.model.__tablename__ for source in ROLLUP_SOURCES.values())
+        connection.execute(text(f'LOCK TABLE {names} IN SHARE MODE'))
+
+    clear = delete(table)
+    if desde:
+        clear = clear.where(table.c.dia >= desde)
+    connection.execute(clear)
+
+    for source in ROLLUP_SOURCES.values():
+        day = getattr(source.model, source.day)
+        time = getattr(source.model, source.time)
+        hour = extract('hour', time)
+        groups = [(TOTAL, None)] + [(dimension, getattr(source.model, attribute))
+                                    for dimension, attribute in source.dimensions.items()]
+        for dimension, column in groups:
+            columns = [day, hour] + ([column] if column is not None else [])
+            # Registros sem data ou hora não são contados (como em RollupSource.keys)
+            query = select(*columns, func.count()).where(
+                day.isnot(None), time.isnot(None)
+            ).group_by(*columns)
+            if desde:
+                query = query.where(day >= desde)
+
+            deltas = Counter()
+            for row in db.session.execute(query):
+                valor = (row[2] or '')[:200] if column is not None else ''
+                deltas[(source.fonte, dimension, row[0], int(row[1]), valor)] += row[-1]
+            apply_deltas(connection, deltas)
+            print(f"{source.fonte}/{dimension}: {len(deltas)} contagens")
+
+    db.session.commit()
+
+
+def _period(dias):
+    ate = get_brasil_datetime().date()
+    return ate - timedelta(days=dias - 1), ate
+
+
+def counts_by_hour(fonte, dias=90):
+    """Quantidade por hora do dia (0 a 23) nos últimos `dias` dias"""
+    desde, ate = _period(dias)
+    rows = db.session.query(TrafficRollup.hora, func.sum(TrafficRollup.quantidade)).filter(
+        TrafficRollup.fonte == fonte,
+        TrafficRollup.dimensao == TOTAL,
+        TrafficRollup.dia.between(desde, ate)
+    ).group_by(TrafficRollup.hora).all()
+    totals = dict(rows)
+    return desde, ate, [(hora, int(totals.get(hora) or 0)) for hora in range(24)]
+
+
+def counts_by_day(fonte, dias=90):
+    """Quantidade por dia nos últimos `dias` dias (dias sem registros ficam de fora)"""
+    desde, ate = _period(dias)
+    rows = db.session.query(TrafficRollup.dia, func.sum(TrafficRollup.quantidade)).filter(
+        TrafficRollup.fonte == fonte,
+        TrafficRollup.dimensao == TOTAL,
+        TrafficRollup.dia.between(desde, ate)
+    ).group_by(TrafficRollup.dia).order_by(TrafficRollup.dia).all()
+    return desde, ate, [(dia, int(n)) for dia, n in rows if n]
+
+
+def counts_by_value(fonte, dimensao, dias=90, limite=50):
+    """Quantidade por valor da dimensão (ex.: setor), da maior para a menor"""
+    desde, ate = _period(dias)
+    total = func.sum(TrafficRollup.quantidade)
+    rows = db.session.query(TrafficRollup.valor, total).filter(
+        TrafficRollup.fonte == fonte,
+        TrafficRollup.dimensao == dimensao,
+        TrafficRollup.dia.between(desde, ate)
+    ).group_by(TrafficRollup.valor).having(total > 0).order_by(total.desc()).limit(limite).all()
+    return desde, ate, [(valor, int(n)) for valor, n in rows]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Contagens de movimento da portaria')
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+    rebuild_parser = subparsers.add_parser('rebuild', help='Recalcula as contagens a partir dos registros')
+    rebuild_parser.add_argument('--desde', type=date.fromisoformat, help='Data inicial (AAAA-MM-DD)')
+    args = parser.parse_args(argv)
+
+    from main import app
+    with app.app_context():
+        if args.comando == 'rebuild':
+            rebuild(args.desde)
+            print("Contagens reconstruídas com sucesso!")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
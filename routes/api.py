@@ -0,0 +1,120 @@
+from flask import Blueprint, jsonify, request
+from flask_login import login_required, current_user
+from app import csrf
+from cache import cache_stats
+from report_cache import report_cache
+from autocomplete import autocomplete_index, PESSOA, EMPRESA, DEFAULT_LIMIT, MAX_LIMIT
+from dashboard import dashboard_counters
+from occupancy import occupancy
+from scanner_events import apply_events, InvalidBatch
+from rollups import DIMENSIONS, counts_by_hour, counts_by_day, counts_by_value
+from utils import format_cpf, format_cnpj
+
+api_bp = Blueprint('api', __name__, url_prefix='/api')
+
+@api_bp.route('/autocomplete')
+@login_required
+def autocomplete():
+    """
+    Sugestões para os campos de CPF, CNPJ e nome enquanto o usuário digita.
+    
+    Parâmetros:
+        q: Texto digitado (CPF/CNPJ com ou sem máscara, ou parte do nome)
+        tipo: 'pessoa', 'empresa' ou vazio para ambos
+        limite: Quantidade máxima de sugestões
+    """
+    termo = request.args.get('q', '').strip()
+    tipo = request.args.get('tipo') or None
+    if tipo not in (None, PESSOA, EMPRESA):
+        return jsonify({'erro': 'Tipo inválido.'}), 400
+    
+    limite = request.args.get('limite', DEFAULT_LIMIT, type=int)
+    limite = max(1, min(limite, MAX_LIMIT))
+    
+    resultados = []
+    for kind, documento, nome in autocomplete_index.search(termo, tipo, limite):
+        if kind == PESSOA:
+            resultados.append({'tipo': kind, 'cpf': format_cpf(documento), 'nome': nome})
+        else:
+            resultados.append({'tipo': kind, 'cnpj': format_cnpj(documento), 'nome': nome})
+    
+    return jsonify({'resultados': resultados})
+
+@api_bp.route('/estatisticas/<fonte>')
+@login_required
+def estatisticas(fonte):
+    """
+    Contagens de ingressos, entregas ou correspondências, lidas das tabelas
+    agregadas (rollups.py).
+    
+    Parâmetros:
+        por: 'hora' (hora do dia), 'dia', ou uma dimensão da fonte
+             ('setor', 'motivo' ou 'tipo')
+        dias: Quantidade de dias até hoje (padrão 90, máximo 730)
+    """
+    if fonte not in DIMENSIONS:
+        return jsonify({'erro': 'Fonte inválida.'}), 400
+    
+    por = request.args.get('por', 'hora')
+    dias = max(1, min(request.args.get('dias', 90, type=int), 730))
+    
+    if por == 'hora':
+        desde, ate, dados = counts_by_hour(fonte, dias)
+        dados = [{'hora': hora, 'quantidade': n} for hora, n in dados]
+    elif por == 'dia':
+        desde, ate, dados = counts_by_day(fonte, dias)
+        dados = [{'dia': dia.isoformat(), 'quantidade': n} for dia, n in dados]
+    elif por in DIMENSIONS[fonte]:
+        desde, ate, dados = counts_by_value(fonte, por, dias)
+        dados = [{por: valor, 'quantidade': n} for valor, n in dados]
+    else:
+        return jsonify({'erro': 'Agrupamento inválido.'}), 400
+    
+    return jsonify({
+        'fonte': fonte,
+        'por': por,
+        'desde': desde.isoformat(),
+        'ate': ate.isoformat(),
+        'dados': dados
+    })
+
+@api_bp.route('/painel')
+@login_required
+def painel():
+    """Contadores do painel (pessoas no campus, pendências e ocorrências do dia)"""
+    return jsonify(dashboard_counters.snapshot())
+
+@api_bp.route('/portaria/eventos', methods=['POST'])
+@csrf.exempt
+@login_required
+def portaria_eventos():
+    """
+    Lote de entradas e saídas dos leitores das catracas ({"eventos": [...]}),
+    aplicado em uma única transação, com o resultado de cada evento.
+    
+    Isento de CSRF por aceitar apenas JSON: um formulário de outro site não
+    consegue enviar application/json sem a verificação prévia (CORS) do navegador.
+    """
+    if not request.is_json:
+        return jsonify({'erro': 'Envie os eventos em JSON.'}), 415
+    
+    dados = request.get_json(silent=True)
+    try:
+        resultados = apply_events((dados or {}).get('eventos') if isinstance(dados, dict) else None,
+                                  current_user.id)
+    except InvalidBatch as e:
+        return jsonify({'erro': str(e)}), 400
+    
+    return jsonify({'resultados': resultados})
+
+@api_bp.route('/cache')
+@login_required
+def cache():
+    """Estatísticas (acertos, faltas, descartes) dos caches deste worker"""
+    if current_user.role != 'admin':
+        return jsonify({'erro': 'Acesso negado.'}), 403
+    
+    stats = cache_stats()
+    stats['relatorios'] = report_cache().stats()
+    stats['ocupacao'] = occupancy.stats()
+    return jsonify(stats)
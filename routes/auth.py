@@ -10,6 +10,7 @@ from werkzeug.urls import url_parse
 from datetime import datetime
 from rate_limiter import rate_limiter
 from security_monitor import security_monitor
+from dashboard import dashboard_counters
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -132,4 +133,5 @@ def register():
 @auth_bp.route('/dashboard')
 @login_required
 def dashboard():
-    return render_template('index.html')
+    # Contadores em memória do worker; atualizados depois via /api/painel
+    return render_template('index.html', contadores=dashboard_counters.snapshot())
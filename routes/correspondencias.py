@@ -6,14 +6,40 @@ from app import db, email_sender
 from models import Correspondencia
 from forms import CorrespondenciaForm
 from utils import get_brasil_datetime
+from listing import ServerSideListing, Column
 
 correspondencias_bp = Blueprint('correspondencias', __name__, url_prefix='/correspondencias')
 
+# Listagem paginada no servidor (colunas na mesma ordem da tabela em index.html)
+correspondencias_listing = ServerSideListing(
+    endpoint='correspondencias.dados',
+    template='correspondencias/_celulas.html',
+    columns=[
+        Column('data', Correspondencia.data_recebimento),
+        Column('hora', Correspondencia.hora_recebimento, css_class='text-center'),
+        Column('remetente', Correspondencia.remetente),
+        Column('destinatario', Correspondencia.destinatario),
+        Column('tipo', Correspondencia.tipo),
+        Column('setor', Correspondencia.setor_encomenda),
+        Column('status', Correspondencia.data_destinacao, searchable=False),
+        Column('acoes', css_class='text-center'),
+    ],
+    default_order=[(0, 'desc'), (1, 'desc')],
+    tiebreaker=Correspondencia.id_correspondencia
+)
+
 @correspondencias_bp.route('/')
 @login_required
 def index():
-    correspondencias = Correspondencia.query.order_by(Correspondencia.data_recebimento.desc()).all()
-    return render_template('correspondencias/index.html', correspondencias=correspondencias)
+    # Renderiza apenas a primeira página; as demais são carregadas via /dados
+    page, dt_config = correspondencias_listing.first_page(Correspondencia.query)
+    return render_template('correspondencias/index.html', correspondencias=page.items, dt_config=dt_config)
+
+@correspondencias_bp.route('/dados')
+@login_required
+def dados():
+    """Endpoint JSON do DataTables (paginação, ordenação e pesquisa no servidor)"""
+    return correspondencias_listing.json_response(Correspondencia.query, request.args)
 
 @correspondencias_bp.route('/novo', methods=['GET', 'POST'])
 @login_required
@@ -5,35 +5,64 @@ from flask_login import login_required, current_user
 from app import db
 from models import Empresa, Entrega
 from forms import EmpresaForm
-from utils import format_cnpj, format_telefone
+from utils import format_cnpj, format_telefone, only_digits, normalize_search
+from listing import ServerSideListing, Column, starts_with, search_digits
+from cache import TTLCache, cached_json_response
+from commit_hooks import on_commit
 import re
 
 # Criar um novo blueprint para empresas com configuração limpa
 empresas_bp = Blueprint('empresas', __name__, url_prefix='/empresas')
 
+# Listagem paginada no servidor (colunas na mesma ordem da tabela em index.html)
+empresas_listing = ServerSideListing(
+    endpoint='empresas.dados',
+    template='empresas/_celulas.html',
+    columns=[
+        Column('cnpj', Empresa.cnpj, search=Empresa.cnpj_digitos, normalize=search_digits),
+        Column('nome', Empresa.nome_empresa, search=Empresa.nome_normalizado),
+        Column('acoes', css_class='text-center'),
+    ],
+    default_order=[(1, 'asc')],
+    tiebreaker=Empresa.cnpj
+)
+
+# Cache das consultas por CNPJ feitas pelos formulários de entrega
+empresas_por_cnpj = TTLCache('empresas.buscar_por_cnpj', maxsize=1024, ttl=120)
+
+def _invalidar_empresas_por_cnpj(changes):
+    for change in changes:
+        empresas_por_cnpj.invalidate(change.values['cnpj'], change.previous['cnpj'])
+
+on_commit(Empresa, _invalidar_empresas_por_cnpj)
+
+def _consulta_empresas(busca):
+    """Consulta base de empresas, opcionalmente filtrada pelo termo de busca"""
+    termo = normalize_search(busca)
+    if not termo:
+        return Empresa.query
+    
+    # Termo só com dígitos (e pontuação de CNPJ): busca pelo início do CNPJ
+    if re.fullmatch(r'[0-9.\-/ ]+', termo) and only_digits(termo):
+        return Empresa.query.filter(starts_with(Empresa.cnpj_digitos, only_digits(termo)))
+    
+    # Busca pelo início do nome ou de qualquer palavra do nome, sobre a coluna
+    # normalizada (sem acentos e em minúsculas)
+    return Empresa.query.filter(
+        db.or_(
+            starts_with(Empresa.nome_normalizado, termo),
+            Empresa.nome_normalizado.contains(f' {termo}', autoescape=True)
+        )
+    )
+
 # Listar todas as empresas
 @empresas_bp.route('/')
 @login_required
 def index():
     busca = request.args.get('busca', '').strip()
     
-    if busca:
-        # Remove caracteres especiais do termo de busca para comparação de CNPJ
-        busca_cnpj = re.sub(r'[^0-9]', '', busca)
-        
-        # Buscar por CNPJ ou nome da empresa
-        empresas = Empresa.query.filter(
-            db.or_(
-                # Busca por CNPJ (com formatação)
-                Empresa.cnpj.like(f'%{busca}%'),
-                # Busca por CNPJ sem formatação
-                db.func.replace(db.func.replace(db.func.replace(Empresa.cnpj, '.', ''), '-', ''), '/', '').like(f'%{busca_cnpj}%'),
-                # Busca por nome da empresa (case insensitive)
-                Empresa.nome_empresa.ilike(f'%{busca}%')
-            )
-        ).order_by(Empresa.nome_empresa).all()
-    else:
-        empresas = Empresa.query.order_by(Empresa.nome_empresa).all()
+    # Renderiza apenas a primeira página; as demais são carregadas via /dados
+    page, dt_config = empresas_listing.first_page(_consulta_empresas(busca), busca=busca or None)
     
     # Limpar a sessão após mostrar o modal
     if session.get('mostrar_oferta_entrega'):
@@ -41,7 +70,15 @@ def index():
         session.pop('empresa_cnpj', None)
         session.pop('empresa_nome', None)
     
-    return render_template('empresas/index.html', empresas=empresas)
+    return render_template('empresas/index.html', empresas=page.items, total=page.total, dt_config=dt_config)
+
+# Dados paginados para o DataTables
+@empresas_bp.route('/dados')
+@login_required
+def dados():
+    """Endpoint JSON do DataTables (paginação, ordenação e pesquisa no servidor)"""
+    busca = request.args.get('busca', '').strip()
+    return empresas_listing.json_response(_consulta_empresas(busca), request.args)
 
 # Adicionar nova empresa
 @empresas_bp.route('/novo', methods=['GET', 'POST'])
@@ -227,18 +264,20 @@ def executar_exclusao(cnpj):
 @login_required
 def buscar_por_cnpj(cnpj):
     formatted_cnpj = format_cnpj(cnpj)
-    empresa = Empresa.query.filter_by(cnpj=formatted_cnpj).first()
     
-    if empresa:
-        return jsonify({
+    def carregar():
+        empresa = Empresa.query.filter_by(cnpj=formatted_cnpj).first()
+        if not empresa:
+            return None
+        return {
             'nome_empresa': empresa.nome_empresa,
             'telefone_empresa': empresa.telefone_empresa,
             'coringa': empresa.coringa,
             'nome_func': empresa.nome_func,
             'telefone_func': empresa.telefone_func
-        })
+        }
     
-    return jsonify({}), 404
+    return cached_json_response(empresas_por_cnpj.get_or_load(formatted_cnpj, carregar))
 
 # Limpar variáveis de sessão
 @empresas_bp.route('/limpar-session', methods=['POST'])
@@ -1,92 +1,138 @@
 from flask import (
     Blueprint, render_template, redirect, url_for, flash, request, current_app,
-    send_from_directory
+    send_file, jsonify, abort, get_template_attribute
 )
 from flask_login import login_required, current_user
-from app import db, email_sender
+from app import db
 from models import Entrega, Empresa, EntregaImagem
 from forms import EntregaForm
 from utils import get_brasil_datetime
 from utils import format_cnpj
+from sqlalchemy.orm import contains_eager, selectinload
+from listing import ServerSideListing, Column, search_digits, KeysetPaginator, InvalidCursor, DEFAULT_PAGE_LENGTH
+from image_jobs import (
+    UPLOAD_FOLDER, job_pool, save_upload, resume_stale, requeue_missing, derivative_file, image_etag, InvalidImage,
+    PENDENTE, PRONTA, ORIGINAL, MIMETYPES, ORIGINAL_MIMETYPES
+)
+from upload_store import upload_store, is_hash
 import re
 import os
-import io
+import mimetypes
+from urllib.parse import quote
 from werkzeug.utils import secure_filename
-from PIL import Image
+from werkzeug.security import safe_join
 
 entregas_bp = Blueprint('entregas', __name__, url_prefix='/entregas', static_folder='static')
 
-# Configuração para upload de imagens
-UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static/uploads/entregas')
+# Configuração para upload de imagens (pastas criadas por image_jobs)
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
-# Criar diretório de uploads se não existir
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def resize_image(img_file, target_size=(800, 600)):
-    """
-    Redimensiona a imagem para o tamanho alvo, mantendo a proporção.
-    
-    Args:
-        img_file: O arquivo de imagem como um objeto file-like
-        target_size: Tupla com (largura, altura) desejadas
-        
-    Returns:
-        BytesIO com a imagem redimensionada
-    """
-    img = Image.open(img_file)
-    
-    # Determinar orientação da imagem
-    width, height = img.size
-    if width > height:
-        # Imagem horizontal
-        target_size = (800, 600)
-    else:
-        # Imagem vertical
-        target_size = (600, 800)
-        
-    # Calcular nova proporção mantendo a relação de aspecto
-    img_ratio = width / height
-    target_ratio = target_size[0] / target_size[1]
-    
-    if img_ratio > target_ratio:
-        # Imagem mais larga que o alvo
-        new_width = target_size[0]
-        new_height = int(new_width / img_ratio)
-    else:
-        # Imagem mais alta que o alvo
-        new_height = target_size[1]
-        new_width = int(new_height * img_ratio)
-    
-    # Redimensionar a imagem
-    resized_img = img.resize((new_width, new_height), Image.LANCZOS)
-    
-    # Salvar em um buffer de memória
-    img_io = io.BytesIO()
-    
-    # Determinar formato de saída baseado no formato original
-    if img.format:
-        format = img.format
-    else:
-        format = 'JPEG'  # Padrão para formato desconhecido
-    
-    # Otimizar e salvar
-    if format == 'JPEG':
-        resized_img.save(img_io, format=format, quality=85, optimize=True)
-    else:
-        resized_img.save(img_io, format=format, optimize=True)
-    
-    img_io.seek(0)
-    return img_io
+def _salvar_imagens(entrega_id, arquivos):
+    """Grava as fotos enviadas como chegaram; o redimensionamento fica com image_jobs"""
+    imagens = []
+    for i, imagem in enumerate(arquivos or []):
+        if imagem and allowed_file(imagem.filename):
+            # Usar ID da entrega, índice e timestamp para criar um nome único
+            timestamp = get_brasil_datetime().strftime('%Y%m%d%H%M%S')
+            filename = secure_filename(f"{entrega_id}_{timestamp}_{i}_{imagem.filename}")
+            try:
+                imagens.append(save_upload(entrega_id, imagem, filename))
+            except InvalidImage as e:
+                current_app.logger.warning(f"Imagem recusada: {e}")
+                flash(f'O arquivo {imagem.filename} não é uma imagem válida e foi ignorado.', 'warning')
+    return imagens
+
+# Listagem paginada no servidor (colunas na mesma ordem da tabela em index.html)
+entregas_listing = ServerSideListing(
+    endpoint='entregas.dados',
+    template='entregas/_celulas.html',
+    columns=[
+        Column('data', Entrega.data_registro),
+        Column('hora', Entrega.hora_registro, css_class='text-center'),
+        Column('empresa', Empresa.nome_empresa, search=Empresa.nome_normalizado),
+        Column('cnpj', Entrega.cnpj, search=Empresa.cnpj_digitos, normalize=search_digits),
+        Column('nota_fiscal', Entrega.nota_fiscal),
+        Column('status', Entrega.data_envio, searchable=False),
+        Column('envio', Entrega.data_envio),
+        Column('imagens', css_class='text-center'),
+        Column('acoes', css_class='text-center'),
+    ],
+    default_order=[(0, 'desc'), (1, 'desc')],
+    tiebreaker=Entrega.id
+)
+
+# Paginação por cursor do histórico, sobre (data_registro, hora_registro, id)
+entregas_historico = KeysetPaginator('entregas', [
+    (Entrega.data_registro, 'data_registro'),
+    (Entrega.hora_registro, 'hora_registro'),
+    (Entrega.id, 'id'),
+])
+
+def _consulta_entregas():
+    # Empresa no mesmo JOIN da ordenação/pesquisa e imagens da página inteira
+    # em uma única consulta IN, em vez de duas consultas por linha
+    return Entrega.query.join(Empresa).options(
+        contains_eager(Entrega.empresa).load_only(Empresa.cnpj, Empresa.nome_empresa),
+        selectinload(Entrega.imagens).load_only(
+            EntregaImagem.filename, EntregaImagem.status, EntregaImagem.content_hash
+        )
+    )
+
+def _entrega_json(entrega):
+    return {
+        'id': entrega.id,
+        'cnpj': entrega.cnpj,
+        'nome_empresa': entrega.empresa.nome_empresa,
+        'data_registro': entrega.data_registro.isoformat(),
+        'hora_registro': entrega.hora_registro.strftime('%H:%M'),
+        'data_envio': entrega.data_envio.isoformat() if entrega.data_envio else None,
+        'hora_envio': entrega.hora_envio.strftime('%H:%M') if entrega.hora_envio else None,
+        'nota_fiscal': entrega.nota_fiscal
+    }
 
 @entregas_bp.route('/')
 @login_required
 def index():
-    entregas = Entrega.query.order_by(Entrega.data_registro.desc(), Entrega.hora_registro.desc()).all()
-    return render_template('entregas/index.html', entregas=entregas)
+    # Renderiza apenas a primeira página; as demais são carregadas via /dados
+    page, dt_config = entregas_listing.first_page(_consulta_entregas())
+    return render_template('entregas/index.html', entregas=page.items, dt_config=dt_config)
+
+@entregas_bp.route('/dados')
+@login_required
+def dados():
+    """Endpoint JSON do DataTables (paginação, ordenação e pesquisa no servidor)"""
+    return entregas_listing.json_response(_consulta_entregas(), request.args)
+
+@entregas_bp.route('/historico')
+@login_required
+def historico():
+    """Histórico completo navegável por cursor (custo constante em qualquer página)"""
+    cursor = request.args.get('cursor')
+    try:
+        page = entregas_historico.paginate(_consulta_entregas(), cursor, limit=50)
+    except InvalidCursor:
+        flash('Página do histórico inválida. Exibindo os registros mais recentes.', 'warning')
+        return redirect(url_for('entregas.historico'))
+    
+    return render_template('entregas/historico.html', entregas=page.items, page=page, cursor=cursor)
+
+@entregas_bp.route('/api/historico')
+@login_required
+def api_historico():
+    """API JSON do histórico para os tablets da portaria (paginação por cursor)"""
+    limite = request.args.get('limite', DEFAULT_PAGE_LENGTH, type=int)
+    try:
+        page = entregas_historico.paginate(_consulta_entregas(), request.args.get('cursor'), limit=limite)
+    except InvalidCursor as e:
+        return jsonify({'erro': str(e)}), 400
+    
+    return jsonify({
+        'entregas': [_entrega_json(entrega) for entrega in page.items],
+        'proximo_cursor': page.next_cursor
+    })
 
 @entregas_bp.route('/novo', methods=['GET', 'POST'])
 @login_required
@@ -96,10 +142,10 @@ def novo():
     # Pre-fill date and time if not submitted
     if request.method == 'GET':
         current_time = get_brasil_datetime()
-        form.data_registro.data = current_time.strftime('%d/%m/%Y')
-        form.hora_registro.data = current_time.strftime('%H:%M')
-        form.data_envio.data = current_time.strftime('%d/%m/%Y')
-        form.hora_envio.data = current_time.strftime('%H:%M')
+        form.data_registro.data = current_time.date()
+        form.hora_registro.data = current_time.time()
+        form.data_envio.data = current_time.date()
+        form.hora_envio.data = current_time.time()
         
         # Pre-fill CNPJ if provided in URL params
         cnpj_param = request.args.get('cnpj')
@@ -119,9 +165,9 @@ def novo():
         # Get current time in Brazil timezone using our helper function
         current_time = get_brasil_datetime()
         
-        # Format current date and time
-        data_atual = current_time.strftime('%d/%m/%Y')
-        hora_atual = current_time.strftime('%H:%M')
+        # Current date and time
+        data_atual = current_time.date()
+        hora_atual = current_time.time()
         
         # Mensagem padrão
         flash_message = "Entrega registrada com sucesso!"
@@ -141,71 +187,15 @@ def novo():
         db.session.add(nova_entrega)
         db.session.commit()
         
-        # Processar upload de múltiplas imagens
-        if form.imagens.data and form.imagens.data[0]:
-            for i, imagem in enumerate(form.imagens.data):
-                if imagem and allowed_file(imagem.filename):
-                    # Usar ID da entrega, índice e timestamp para criar um nome único
-                    timestamp = get_brasil_datetime().strftime('%Y%m%d%H%M%S')
-                    filename = secure_filename(f"{nova_entrega.id}_{timestamp}_{i}_{imagem.filename}")
-                    filepath = os.path.join(UPLOAD_FOLDER, filename)
-                    
-                    # Redimensionar e salvar a imagem
-                    imagem.seek(0)  # Garantir que estamos no início do arquivo
-                    img_io = resize_image(imagem)
-                    
-                    with open(filepath, 'wb') as f:
-                        f.write(img_io.getbuffer())
-                    
-                    # Criar registro de imagem para esta entrega
-                    nova_imagem = EntregaImagem(
-                        entrega_id=nova_entrega.id,
-                        filename=filename
-                    )
-                    db.session.add(nova_imagem)
-            
-            # Commit todas as imagens de uma vez
+        # Fotos gravadas como chegaram; o pool redimensiona e envia o e-mail
+        # de notificação quando a última ficar pronta
+        imagens = _salvar_imagens(nova_entrega.id, form.imagens.data)
+        if imagens:
             db.session.commit()
-            
-            # Enviar email com anexos
-            try:
-                # Buscar empresa relacionada a esta entrega
-                empresa = Empresa.query.filter_by(cnpj=nova_entrega.cnpj).first()
-                
-                # Preparar informações de anexos para o email
-                email_imagens = []
-                for imagem in nova_entrega.imagens:
-                    imagem_path = os.path.join(UPLOAD_FOLDER, imagem.filename)
-                    if os.path.exists(imagem_path):
-                        mime_type = "image/jpeg"  # Default MIME type
-                        if imagem.filename.lower().endswith('.png'):
-                            mime_type = "image/png"
-                        
-                        email_imagens.append({
-                            'filepath': imagem_path,
-                            'filename': imagem.filename,
-                            'type': mime_type
-                        })
-                
-                # Enviar email usando a instância global do email_sender
-                success, response = email_sender.enviar_email_entrega(
-                    entrega=nova_entrega, 
-                    empresa=empresa, 
-                    imagens_paths=email_imagens
-                )
-                
-                if success:
-                    current_app.logger.info(f"Email enviado com sucesso para entrega ID {nova_entrega.id}")
-                    flash_message = "Entrega registrada com sucesso! Um e-mail de notificação foi enviado."
-                else:
-                    current_app.logger.warning(f"Falha ao enviar email para entrega ID {nova_entrega.id}: {response}")
-                    flash_message = "Entrega registrada com sucesso! Nota: Não foi possível enviar o e-mail de notificação."
-            except Exception as e:
-                current_app.logger.error(f"Erro ao enviar email: {str(e)}")
-                flash_message = "Entrega registrada com sucesso! Nota: Houve um erro ao tentar enviar o e-mail de notificação."
-        else:
-            # Se não há imagens, não tenta enviar e-mail
-            flash_message = "Entrega registrada com sucesso!"
+            job_pool.submit(current_app._get_current_object(), [imagem.id for imagem in imagens],
+                            notify_entrega_id=nova_entrega.id)
+            flash_message = ("Entrega registrada com sucesso! As imagens estão sendo processadas "
+                             "e o e-mail de notificação será enviado em seguida.")
         
         flash(flash_message, 'success')
         return redirect(url_for('entregas.index'))
@@ -244,31 +234,11 @@ def editar(id):
         
         db.session.commit()
         
-        # Processar upload de múltiplas imagens
-        if form.imagens.data and form.imagens.data[0]:
-            for i, imagem in enumerate(form.imagens.data):
-                if imagem and allowed_file(imagem.filename):
-                    # Usar ID da entrega, índice e timestamp para criar um nome único
-                    timestamp = get_brasil_datetime().strftime('%Y%m%d%H%M%S')
-                    filename = secure_filename(f"{entrega.id}_{timestamp}_{i}_{imagem.filename}")
-                    filepath = os.path.join(UPLOAD_FOLDER, filename)
-                    
-                    # Redimensionar e salvar a imagem
-                    imagem.seek(0)  # Garantir que estamos no início do arquivo
-                    img_io = resize_image(imagem)
-                    
-                    with open(filepath, 'wb') as f:
-                        f.write(img_io.getbuffer())
-                    
-                    # Criar registro de imagem para esta entrega
-                    nova_imagem = EntregaImagem(
-                        entrega_id=entrega.id,
-                        filename=filename
-                    )
-                    db.session.add(nova_imagem)
-            
-            # Commit todas as imagens de uma vez
+        imagens = _salvar_imagens(entrega.id, form.imagens.data)
+        if imagens:
             db.session.commit()
+            job_pool.submit(current_app._get_current_object(),
+                            [imagem.id for imagem in imagens if imagem.status == PENDENTE])
         
         flash('Entrega atualizada com sucesso!', 'success')
         return redirect(url_for('entregas.index'))
@@ -284,8 +254,8 @@ def registrar_envio(id):
         flash('Envio já registrado para esta entrega.', 'warning')
     else:
         now = get_brasil_datetime()
-        entrega.data_envio = now.strftime('%d/%m/%Y')
-        entrega.hora_envio = now.strftime('%H:%M')
+        entrega.data_envio = now.date()
+        entrega.hora_envio = now.time()
         db.session.commit()
         flash('Envio registrado com sucesso!', 'success')
     
@@ -322,24 +292,8 @@ def excluir(id):
     entrega = Entrega.query.get_or_404(id)
     
     try:
-        # Excluir todas as imagens associadas
-        for imagem in entrega.imagens:
-            try:
-                if os.path.exists(os.path.join(UPLOAD_FOLDER, imagem.filename)):
-                    os.remove(os.path.join(UPLOAD_FOLDER, imagem.filename))
-            except Exception as e:
-                current_app.logger.error(f"Erro ao excluir arquivo de imagem: {str(e)}")
-                flash(f'Erro ao excluir imagem: {str(e)}', 'warning')
-        
-        # Excluir imagem antiga se existir (para compatibilidade)
-        if entrega.imagem_filename:
-            try:
-                if os.path.exists(os.path.join(UPLOAD_FOLDER, entrega.imagem_filename)):
-                    os.remove(os.path.join(UPLOAD_FOLDER, entrega.imagem_filename))
-            except Exception as e:
-                current_app.logger.error(f"Erro ao excluir imagem antiga: {str(e)}")
-                pass
-        
+        # Os arquivos das imagens (e da imagem antiga) são removidos depois do
+        # commit por image_jobs, se nenhuma outra imagem tiver o mesmo conteúdo
         db.session.delete(entrega)
         db.session.commit()
         flash('Entrega excluída com sucesso!', 'success')
@@ -350,10 +304,112 @@ def excluir(id):
     
     return redirect(url_for('entregas.index'))
 
+def _enviar_imagem(path, mimetype=None, etag=None, imutavel=False):
+    """
+    Resposta de uma imagem com ETag e cache privado (depois do login).
+    
+    Com IMAGE_SENDFILE o corpo fica vazio e o proxy envia o arquivo
+    (X-Accel-Redirect ou X-Sendfile); o Python só confere o login e
+    responde 304 quando o navegador já tem a imagem.
+    
+    Args:
+        path (str): Arquivo (pelo proxy só os do repositório de uploads)
+        mimetype (str): Tipo do conteúdo (padrão: pela extensão)
+        etag (str): ETag forte; sem ele, o da data e do tamanho do arquivo
+        imutavel (bool): URL com o hash do conteúdo (cache de um ano, sem revalidar)
+    """
+    modo = current_app.config['IMAGE_SENDFILE']
+    raiz = upload_store().directory
+    if modo in ('x-accel', 'x-sendfile') and os.path.commonpath([raiz, path]) == raiz:
+        response = current_app.response_class(mimetype=mimetype or mimetypes.guess_type(path)[0])
+        if modo == 'x-accel':
+            caminho = os.path.relpath(path, raiz).replace(os.sep, '/')
+            response.headers['X-Accel-Redirect'] = current_app.config['IMAGE_ACCEL_PREFIX'] + quote(caminho)
+        else:
+            response.headers['X-Sendfile'] = os.path.abspath(path)
+        stat = os.stat(path)
+        response.set_etag(etag or f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+        response = response.make_conditional(request)
+    else:
+        response = send_file(path, mimetype=mimetype, etag=etag or True, conditional=True)
+    # O navegador nunca trata o conteúdo como outro tipo (HTML, script)
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.headers['Cache-Control'] = ('private, max-age=31536000, immutable' if imutavel
+                                         else 'private, no-cache')
+    return response
+
 @entregas_bp.route('/imagem/<filename>')
 @login_required
 def imagem(filename):
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    """Imagem antiga (Entrega.imagem_filename)"""
+    path = safe_join(UPLOAD_FOLDER, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    return _enviar_imagem(path)
+
+@entregas_bp.route('/imagem/original/<filename>',
+                   defaults={'versao': None, 'tamanho': ORIGINAL, 'formato': None})
+@entregas_bp.route('/imagem/<any(miniatura, previa):tamanho>/<filename>.<any(webp, jpg):formato>',
+                   defaults={'versao': None})
+@entregas_bp.route('/imagem/<string(length=64):versao>/original/<filename>',
+                   defaults={'tamanho': ORIGINAL, 'formato': None})
+@entregas_bp.route('/imagem/<string(length=64):versao>/<any(miniatura, previa):tamanho>/<filename>.<any(webp, jpg):formato>')
+@login_required
+def imagem_versao(versao, tamanho, filename, formato):
+    """
+    Miniatura ou prévia (WebP ou JPEG) ou o original de uma imagem de entrega.
+    Com `versao` (EntregaImagem.content_hash) a URL é imutável, e as versões
+    reduzidas são lidas direto do repositório, sem consulta ao banco.
+    """
+    imutavel = versao is not None
+    if versao is None or tamanho == ORIGINAL:
+        # O tipo do original vem do nome gravado da imagem, nunca do nome na URL
+        consulta = db.session.query(EntregaImagem.content_hash, EntregaImagem.filename)
+        if versao is None:
+            consulta = consulta.filter_by(filename=secure_filename(filename))
+        else:
+            consulta = consulta.filter_by(content_hash=versao)
+        registro = consulta.first()
+        if registro is None:
+            abort(404)
+        versao, nome = registro
+    if not is_hash(versao):
+        abort(404)
+    
+    if tamanho == ORIGINAL:
+        # O original fica no repositório sem extensão; só tipos de imagem
+        mimetype = mimetypes.guess_type(nome)[0]
+        if mimetype not in ORIGINAL_MIMETYPES:
+            abort(404)
+    else:
+        mimetype = MIMETYPES[formato]
+    path = derivative_file(versao, tamanho, formato)
+    if path is None:
+        if tamanho != ORIGINAL:
+            # Gerada em segundo plano; a tela mostra o marcador até ficar pronta
+            requeue_missing(current_app._get_current_object(), versao)
+        abort(404)
+    if not imutavel:
+        return _enviar_imagem(path, mimetype)
+    return _enviar_imagem(path, mimetype, image_etag(versao, tamanho, formato), imutavel=True)
+
+@entregas_bp.route('/imagens/status')
+@login_required
+def imagens_status():
+    """
+    Status das imagens em processamento (ids separados por vírgula) e, das
+    prontas, o HTML que substitui o marcador (no tamanho informado)
+    """
+    ids = [int(valor) for valor in request.args.get('ids', '').split(',') if valor.isdigit()][:100]
+    tamanho = request.args.get('tamanho', 150, type=int)
+    imagens = EntregaImagem.query.filter(EntregaImagem.id.in_(ids)).all() if ids else []
+    resume_stale(current_app._get_current_object(), imagens)
+    imagem_entrega = get_template_attribute('entregas/_imagem.html', 'imagem_entrega')
+    return jsonify({'imagens': [{
+        'id': imagem.id,
+        'status': imagem.status,
+        'html': str(imagem_entrega(imagem, tamanho)) if imagem.status == PRONTA else None,
+    } for imagem in imagens]})
 
 @entregas_bp.route('/excluir-imagem/<int:id>', methods=['POST'])
 @login_required
@@ -366,14 +422,8 @@ def excluir_imagem(id):
     imagem = EntregaImagem.query.get_or_404(id)
     entrega_id = imagem.entrega_id
     
-    # Excluir o arquivo de imagem
-    if os.path.exists(os.path.join(UPLOAD_FOLDER, imagem.filename)):
-        try:
-            os.remove(os.path.join(UPLOAD_FOLDER, imagem.filename))
-        except Exception as e:
-            flash(f'Erro ao excluir arquivo de imagem: {str(e)}', 'warning')
-    
-    # Excluir o registro da imagem
+    # Excluir o registro da imagem (os arquivos são removidos depois do commit
+    # por image_jobs, se nenhuma outra imagem tiver o mesmo conteúdo)
     db.session.delete(imagem)
     db.session.commit()
     
@@ -1,5 +1,5 @@
 from flask import (
-    Blueprint, render_template, redirect, url_for, flash, request, current_app
+    Blueprint, render_template, redirect, url_for, flash, request, current_app, jsonify
 )
 from flask_login import login_required, current_user
 from app import db, email_sender
@@ -7,16 +7,201 @@ from models import Ingresso, Pessoa
 from forms import IngressoForm
 from utils import get_brasil_datetime
 from utils import format_cpf
+from sqlalchemy.orm import contains_eager, joinedload
+from listing import ServerSideListing, Column, search_digits, KeysetPaginator, InvalidCursor, DEFAULT_PAGE_LENGTH
+from occupancy import occupancy, people_names, close_visits, MAX_CLOSE_IDS
+from datetime import datetime
 import re
 from flask_wtf.csrf import validate_csrf
 
 ingressos_bp = Blueprint('ingressos', __name__, url_prefix='/ingressos')
 
+# Listagem paginada no servidor (colunas na mesma ordem da tabela em index.html)
+ingressos_listing = ServerSideListing(
+    endpoint='ingressos.dados',
+    template='ingressos/_celulas.html',
+    columns=[
+        Column('data', Ingresso.data),
+        Column('entrada', Ingresso.entrada, css_class='text-center'),
+        Column('saida', Ingresso.saida, css_class='text-center'),
+        Column('cpf', Ingresso.cpf, search=Pessoa.cpf_digitos, normalize=search_digits),
+        Column('nome', Pessoa.nome, search=Pessoa.nome_normalizado),
+        Column('motivo', Ingresso.motivo),
+        Column('setor', Ingresso.pessoa_setor),
+        Column('acoes', css_class='text-center'),
+    ],
+    default_order=[(0, 'desc'), (1, 'desc')],
+    tiebreaker=Ingresso.id
+)
+
+# Paginação por cursor do histórico, sobre (data, entrada, id)
+ingressos_historico = KeysetPaginator('ingressos', [
+    (Ingresso.data, 'data'),
+    (Ingresso.entrada, 'entrada'),
+    (Ingresso.id, 'id'),
+])
+
+def _consulta_ingressos():
+    # A pessoa vem no mesmo JOIN usado para ordenar/pesquisar por nome (sem
+    # uma consulta extra por linha), carregando apenas as colunas exibidas
+    return Ingresso.query.join(Pessoa).options(
+        contains_eager(Ingresso.pessoa).load_only(Pessoa.cpf, Pessoa.nome)
+    )
+
+def _ingresso_json(ingresso):
+    return {
+        'id': ingresso.id,
+        'cpf': ingresso.cpf,
+        'nome': ingresso.pessoa.nome,
+        'data': ingresso.data.isoformat(),
+        'entrada': ingresso.entrada.strftime('%H:%M'),
+        'saida': ingresso.saida.strftime('%H:%M') if ingresso.saida else None,
+        'motivo': ingresso.motivo,
+        'pessoa_setor': ingresso.pessoa_setor
+    }
+
 @ingressos_bp.route('/')
 @login_required
 def index():
-    ingressos = Ingresso.query.order_by(Ingresso.data.desc(), Ingresso.entrada.desc()).all()
-    return render_template('ingressos/index.html', ingressos=ingressos)
+    # Renderiza apenas a primeira página; as demais são carregadas via /dados
+    page, dt_config = ingressos_listing.first_page(_consulta_ingressos())
+    return render_template('ingressos/index.html', ingressos=page.items, dt_config=dt_config)
+
+@ingressos_bp.route('/dados')
+@login_required
+def dados():
+    """Endpoint JSON do DataTables (paginação, ordenação e pesquisa no servidor)"""
+    return ingressos_listing.json_response(_consulta_ingressos(), request.args)
+
+@ingressos_bp.route('/historico')
+@login_required
+def historico():
+    """Histórico completo navegável por cursor (custo constante em qualquer página)"""
+    cursor = request.args.get('cursor')
+    try:
+        page = ingressos_historico.paginate(_consulta_ingressos(), cursor, limit=50)
+    except InvalidCursor:
+        flash('Página do histórico inválida. Exibindo os registros mais recentes.', 'warning')
+        return redirect(url_for('ingressos.historico'))
+    
+    return render_template('ingressos/historico.html', ingressos=page.items, page=page, cursor=cursor)
+
+@ingressos_bp.route('/api/historico')
+@login_required
+def api_historico():
+    """API JSON do histórico para os tablets da portaria (paginação por cursor)"""
+    limite = request.args.get('limite', DEFAULT_PAGE_LENGTH, type=int)
+    try:
+        page = ingressos_historico.paginate(_consulta_ingressos(), request.args.get('cursor'), limit=limite)
+    except InvalidCursor as e:
+        return jsonify({'erro': str(e)}), 400
+    
+    return jsonify({
+        'ingressos': [_ingresso_json(ingresso) for ingresso in page.items],
+        'proximo_cursor': page.next_cursor
+    })
+
+def _ocupacao():
+    """Visitas em aberto com o nome de cada pessoa, agrupadas por setor"""
+    visitas, reconciliado_ha = occupancy.snapshot(reconcile=request.args.get('conferir') == '1')
+    nomes = people_names(visita.cpf for visita in visitas)
+    por_setor = {}
+    for visita in visitas:
+        por_setor.setdefault(visita.setor, []).append(visita)
+    return visitas, nomes, dict(sorted(por_setor.items())), reconciliado_ha
+
+@ingressos_bp.route('/no-campus')
+@login_required
+def ocupacao():
+    """Quem está no campus agora (contagem para evacuação)"""
+    visitas, nomes, por_setor, reconciliado_ha = _ocupacao()
+    return render_template('ingressos/ocupacao.html', visitas=visitas, nomes=nomes,
+                           por_setor=por_setor, reconciliado_ha=reconciliado_ha,
+                           agora=get_brasil_datetime())
+
+@ingressos_bp.route('/api/no-campus')
+@login_required
+def api_ocupacao():
+    """API JSON de quem está no campus agora (use conferir=1 para conferir com o banco)"""
+    visitas, nomes, por_setor, reconciliado_ha = _ocupacao()
+    return jsonify({
+        'total': len(visitas),
+        'pessoas': len({visita.cpf for visita in visitas}),
+        'por_setor': {setor: len(lista) for setor, lista in por_setor.items()},
+        'visitas': [{
+            'id': visita.id,
+            'cpf': visita.cpf,
+            'nome': nomes.get(visita.cpf),
+            'data': visita.data.isoformat(),
+            'entrada': visita.entrada.strftime('%H:%M'),
+            'motivo': visita.motivo,
+            'pessoa_setor': visita.setor
+        } for visita in visitas],
+        'conferido_ha': round(reconciliado_ha, 1)
+    })
+
+def _parametros_saida_em_lote():
+    """Ids selecionados e horário de corte, do formulário ou do JSON"""
+    if request.is_json:
+        dados = request.get_json(silent=True) or {}
+        ids, ate = dados.get('ids') or [], dados.get('ate')
+    else:
+        ids, ate = request.form.getlist('ids'), request.form.get('ate') or None
+    
+    try:
+        ids = sorted({int(ingresso_id) for ingresso_id in ids})
+        ate = datetime.fromisoformat(ate) if ate else None
+    except (TypeError, ValueError):
+        raise ValueError('Ingressos ou horário de corte inválidos.')
+    if len(ids) > MAX_CLOSE_IDS:
+        raise ValueError(f'Selecione no máximo {MAX_CLOSE_IDS} ingressos por vez.')
+    if not ids and ate is None:
+        raise ValueError('Selecione os ingressos ou informe o horário de corte.')
+    return ids, ate
+
+@ingressos_bp.route('/saida-em-lote', methods=['GET', 'POST'])
+@login_required
+def saida_em_lote():
+    """
+    Registra a saída de várias visitas em aberto de uma vez (fim de turno):
+    as selecionadas e/ou todas com entrada até o horário de corte.
+    Aceita formulário ou JSON ({"ids": [...], "ate": "AAAA-MM-DDTHH:MM"}).
+    """
+    if request.method == 'GET':
+        visitas, _ = occupancy.snapshot()
+        return render_template('ingressos/saida_em_lote.html', visitas=visitas,
+                               nomes=people_names(visita.cpf for visita in visitas))
+    
+    try:
+        ids, ate = _parametros_saida_em_lote()
+    except ValueError as e:
+        if request.is_json:
+            return jsonify({'erro': str(e)}), 400
+        flash(str(e), 'danger')
+        return redirect(url_for('ingressos.saida_em_lote'))
+    
+    saida = get_brasil_datetime().time()
+    fechados = close_visits(saida, current_user.id, ids=ids, ate=ate)
+    db.session.commit()
+    
+    por_setor = {}
+    for linha in fechados:
+        por_setor[linha.pessoa_setor] = por_setor.get(linha.pessoa_setor, 0) + 1
+    resumo = {
+        'fechados': len(fechados),
+        'ids': [linha.id for linha in fechados],
+        # Selecionados que já tinham saída (ou não existem)
+        'ignorados': sorted(set(ids) - {linha.id for linha in fechados}),
+        'por_setor': dict(sorted(por_setor.items())),
+        'saida': saida.strftime('%H:%M'),
+        'registrado_por': current_user.username
+    }
+    current_app.logger.info(f"Saída em lote de {len(fechados)} ingressos registrada por {current_user.username}")
+    
+    if request.is_json:
+        return jsonify(resumo)
+    return render_template('ingressos/saida_em_lote.html', resumo=resumo,
+                           nomes=people_names(linha.cpf for linha in fechados), fechados=fechados)
 
 @ingressos_bp.route('/novo', methods=['GET', 'POST'])
 @login_required
@@ -26,8 +211,8 @@ def novo():
     # Pre-fill date and time if not submitted with Brazil timezone
     if request.method == 'GET':
         today = get_brasil_datetime()
-        form.data.data = today.strftime('%d/%m/%Y')
-        form.entrada.data = today.strftime('%H:%M')
+        form.data.data = today.date()
+        form.entrada.data = today.time()
         
         # Pre-fill CPF if provided in URL params
         cpf_param = request.args.get('cpf')
@@ -119,8 +304,8 @@ def editar(id):
 @login_required
 def visualizar(id):
     """Visualiza os detalhes de um ingresso específico"""
-    ingresso = Ingresso.query.get_or_404(id)
-    pessoa = Pessoa.query.get(ingresso.cpf)
+    ingresso = Ingresso.query.options(joinedload(Ingresso.pessoa)).get_or_404(id)
+    pessoa = ingresso.pessoa
     return render_template('ingressos/visualizar.html', ingresso=ingresso, pessoa=pessoa, title=f'Ingresso #{id}')
 
 @ingressos_bp.route('/registrar-saida/<int:id>', methods=['GET', 'POST'])
@@ -141,7 +326,8 @@ def registrar_saida(id):
         flash('Saída já registrada para este ingresso.', 'warning')
     else:
         now = get_brasil_datetime()
-        ingresso.saida = now.strftime('%H:%M')
+        ingresso.saida = now.time()
+        ingresso.saida_registrada_por = current_user.id
         db.session.commit()
         flash('Saída registrada com sucesso!', 'success')
     
@@ -155,8 +341,8 @@ def confirmar_exclusao(id):
         flash('Apenas administradores podem excluir registros.', 'danger')
         return redirect(url_for('ingressos.index'))
     
-    ingresso = Ingresso.query.get_or_404(id)
-    pessoa = Pessoa.query.get(ingresso.cpf)
+    ingresso = Ingresso.query.options(joinedload(Ingresso.pessoa)).get_or_404(id)
+    pessoa = ingresso.pessoa
     
     # Renderiza a página de confirmação de exclusão
     return render_template(
@@ -6,14 +6,39 @@ from app import db, email_sender
 from models import Ocorrencia
 from forms import OcorrenciaForm
 from utils import get_brasil_datetime
+from listing import ServerSideListing, Column
 
 ocorrencias_bp = Blueprint('ocorrencias', __name__, url_prefix='/ocorrencias')
 
+# Listagem paginada no servidor (colunas na mesma ordem da tabela em index.html)
+ocorrencias_listing = ServerSideListing(
+    endpoint='ocorrencias.dados',
+    template='ocorrencias/_celulas.html',
+    columns=[
+        Column('data', Ocorrencia.data_registro),
+        Column('hora', Ocorrencia.hora_registro),
+        Column('vigilante', Ocorrencia.vigilante),
+        Column('envolvidos', Ocorrencia.envolvidos),
+        Column('gravidade', Ocorrencia.gravidade),
+        Column('descricao', Ocorrencia.ocorrencia),
+        Column('acoes', css_class='text-center'),
+    ],
+    default_order=[(0, 'desc'), (1, 'desc')],
+    tiebreaker=Ocorrencia.id_ocorrencia
+)
+
 @ocorrencias_bp.route('/')
 @login_required
 def index():
-    ocorrencias = Ocorrencia.query.order_by(Ocorrencia.data_registro.desc()).all()
-    return render_template('ocorrencias/index.html', ocorrencias=ocorrencias)
+    # Renderiza apenas a primeira página; as demais são carregadas via /dados
+    page, dt_config = ocorrencias_listing.first_page(Ocorrencia.query)
+    return render_template('ocorrencias/index.html', ocorrencias=page.items, dt_config=dt_config)
+
+@ocorrencias_bp.route('/dados')
+@login_required
+def dados():
+    """Endpoint JSON do DataTables (paginação, ordenação e pesquisa no servidor)"""
+    return ocorrencias_listing.json_response(Ocorrencia.query, request.args)
 
 @ocorrencias_bp.route('/novo', methods=['GET', 'POST'])
 @login_required
@@ -1,39 +1,78 @@
 from flask import (
-    Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app, session
+    Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app, session,
+    Response
 )
 from flask_login import login_required, current_user
 from app import db, email_sender
-from models import Pessoa
-from forms import PessoaForm
-from utils import format_cpf, format_telefone
+from models import Pessoa, Ingresso
+from forms import PessoaForm, CrachasForm
+from utils import format_cpf, format_telefone, only_digits, normalize_search, get_brasil_datetime
+from listing import ServerSideListing, Column, starts_with, search_digits
+from cache import TTLCache, cached_json_response
+from commit_hooks import on_commit
+from badges import Badge, generate_badge_sheet, MAX_BADGES
 import re
 
 pessoas_bp = Blueprint('pessoas', __name__, url_prefix='/pessoas')
 
+# Listagem paginada no servidor (colunas na mesma ordem da tabela em index.html)
+pessoas_listing = ServerSideListing(
+    endpoint='pessoas.dados',
+    template='pessoas/_celulas.html',
+    columns=[
+        Column('cpf', Pessoa.cpf, search=Pessoa.cpf_digitos, normalize=search_digits),
+        Column('nome', Pessoa.nome, search=Pessoa.nome_normalizado),
+        Column('telefone', Pessoa.telefone),
+        Column('empresa', Pessoa.empresa),
+        Column('acoes', css_class='text-center'),
+    ],
+    default_order=[(1, 'asc')],
+    tiebreaker=Pessoa.cpf
+)
+
+# Cache das consultas por CPF feitas pelos formulários (a cada blur e leitura de QR)
+pessoas_por_cpf = TTLCache('pessoas.buscar_por_cpf', maxsize=2048, ttl=120)
+
+def _invalidar_pessoas_por_cpf(changes):
+    for change in changes:
+        pessoas_por_cpf.invalidate(change.values['cpf'], change.previous['cpf'])
+
+on_commit(Pessoa, _invalidar_pessoas_por_cpf)
+
+def _consulta_pessoas(busca):
+    """Consulta base de pessoas, opcionalmente filtrada pelo termo de busca"""
+    termo = normalize_search(busca)
+    if not termo:
+        return Pessoa.query
+    
+    # Termo só com dígitos (e pontuação de CPF): busca pelo início do CPF
+    if re.fullmatch(r'[0-9.\-/ ]+', termo) and only_digits(termo):
+        return Pessoa.query.filter(starts_with(Pessoa.cpf_digitos, only_digits(termo)))
+    
+    # Busca pelo início do nome ou de qualquer palavra do nome, sobre a coluna
+    # normalizada (sem acentos e em minúsculas)
+    return Pessoa.query.filter(
+        db.or_(
+            starts_with(Pessoa.nome_normalizado, termo),
+            Pessoa.nome_normalizado.contains(f' {termo}', autoescape=True)
+        )
+    )
+
 @pessoas_bp.route('/')
 @login_required
 def index():
     busca = request.args.get('busca', '').strip()
     
-    if busca:
-        # Remove caracteres especiais do termo de busca para comparação de CPF
-        busca_cpf = re.sub(r'[^0-9]', '', busca)
-        
-        # Buscar por CPF ou nome
-        pessoas = Pessoa.query.filter(
-            db.or_(
-                # Busca por CPF (removendo formatação)
-                Pessoa.cpf.like(f'%{busca}%'),
-                # Busca por CPF sem formatação
-                db.func.replace(db.func.replace(db.func.replace(Pessoa.cpf, '.', ''), '-', ''), '/', '').like(f'%{busca_cpf}%'),
-                # Busca por nome (case insensitive)
-                Pessoa.nome.ilike(f'%{busca}%')
-            )
-        ).order_by(Pessoa.nome).all()
-    else:
-        pessoas = Pessoa.query.order_by(Pessoa.nome).all()
-    
-    return render_template('pessoas/index.html', pessoas=pessoas)
+    # Renderiza apenas a primeira página; as demais são carregadas via /dados
+    page, dt_config = pessoas_listing.first_page(_consulta_pessoas(busca), busca=busca or None)
+    return render_template('pessoas/index.html', pessoas=page.items, total=page.total, dt_config=dt_config)
+
+@pessoas_bp.route('/dados')
+@login_required
+def dados():
+    """Endpoint JSON do DataTables (paginação, ordenação e pesquisa no servidor)"""
+    busca = request.args.get('busca', '').strip()
+    return pessoas_listing.json_response(_consulta_pessoas(busca), request.args)
 
 @pessoas_bp.route('/novo', methods=['GET', 'POST'])
 @login_required
@@ -141,8 +180,8 @@ def confirmar_exclusao(cpf):
     
     pessoa = Pessoa.query.get_or_404(cpf)
     
-    # Contar ingressos associados a esta pessoa
-    ingressos_count = len(pessoa.ingressos) if hasattr(pessoa, 'ingressos') else 0
+    # Contar ingressos associados a esta pessoa (COUNT no banco, sem carregar os registros)
+    ingressos_count = Ingresso.query.filter_by(cpf=pessoa.cpf).count()
     
     # Renderiza a página de confirmação de exclusão
     return render_template(
@@ -174,6 +213,58 @@ def excluir(cpf):
     
     return redirect(url_for('pessoas.index'))
 
+def _pessoas_dos_crachas(cpfs, empresa):
+    """Pessoas dos CPFs (na ordem informada) ou da empresa (por nome) e CPFs não encontrados"""
+    if cpfs:
+        encontradas = {}
+        for inicio in range(0, len(cpfs), 500):
+            for pessoa in Pessoa.query.filter(Pessoa.cpf.in_(cpfs[inicio:inicio + 500])):
+                encontradas[pessoa.cpf] = pessoa
+        return ([encontradas[cpf] for cpf in cpfs if cpf in encontradas],
+                [cpf for cpf in cpfs if cpf not in encontradas])
+    
+    pessoas = Pessoa.query.filter(
+        db.func.lower(db.func.trim(Pessoa.empresa)) == empresa.strip().lower()
+    ).order_by(Pessoa.nome).limit(MAX_BADGES + 1).all()
+    return pessoas, []
+
+@pessoas_bp.route('/crachas', methods=['GET', 'POST'])
+@login_required
+def crachas():
+    """Folha de crachás com QR de check-in para uma lista de CPFs ou uma empresa"""
+    form = CrachasForm()
+    if not form.validate_on_submit():
+        return render_template('pessoas/crachas.html', form=form)
+    
+    # CPFs separados por linha, vírgula ou ponto e vírgula, sem repetições
+    cpfs = []
+    for valor in re.split(r'[\s,;]+', form.cpfs.data or ''):
+        if only_digits(valor):
+            cpf = format_cpf(valor)
+            if cpf not in cpfs:
+                cpfs.append(cpf)
+    empresa = (form.empresa.data or '').strip()
+    if not cpfs and not empresa:
+        flash('Informe os CPFs ou a empresa.', 'danger')
+        return render_template('pessoas/crachas.html', form=form)
+    
+    pessoas, nao_encontrados = _pessoas_dos_crachas(cpfs, empresa)
+    if nao_encontrados:
+        flash(f"CPFs não cadastrados: {', '.join(nao_encontrados)}", 'danger')
+        return render_template('pessoas/crachas.html', form=form)
+    if not pessoas:
+        flash('Nenhuma pessoa encontrada para a empresa informada.', 'warning')
+        return render_template('pessoas/crachas.html', form=form)
+    if len(pessoas) > MAX_BADGES:
+        flash(f'Gere no máximo {MAX_BADGES} crachás por vez.', 'danger')
+        return render_template('pessoas/crachas.html', form=form)
+    
+    badges = [Badge(pessoa.cpf, pessoa.nome, pessoa.empresa) for pessoa in pessoas]
+    sheet = generate_badge_sheet(badges, int(form.por_pagina.data))
+    response = Response(sheet, mimetype='application/pdf')
+    response.headers['Content-Disposition'] = f'attachment; filename=crachas_{get_brasil_datetime().strftime("%Y%m%d_%H%M")}.pdf'
+    return response
+
 @pessoas_bp.route('/visualizar/<string:cpf>')
 @login_required
 def visualizar(cpf):
@@ -185,16 +276,18 @@ def visualizar(cpf):
 @login_required
 def buscar_por_cpf(cpf):
     formatted_cpf = format_cpf(cpf)
-    pessoa = Pessoa.query.filter_by(cpf=formatted_cpf).first()
     
-    if pessoa:
-        return jsonify({
+    def carregar():
+        pessoa = Pessoa.query.filter_by(cpf=formatted_cpf).first()
+        if not pessoa:
+            return None
+        return {
             'nome': pessoa.nome,
             'telefone': pessoa.telefone,
             'empresa': pessoa.empresa
-        })
+        }
     
-    return jsonify({}), 404
+    return cached_json_response(pessoas_por_cpf.get_or_load(formatted_cpf, carregar))
 
 @pessoas_bp.route('/limpar-session', methods=['POST'])
 @login_required
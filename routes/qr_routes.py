@@ -1,8 +1,9 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
-from flask_login import login_required
+from flask import Blueprint, render_template, redirect, url_for, flash, request, abort, Response
+from flask_login import login_required, current_user
 from models import db, Pessoa, Ingresso
-from qr_code import generate_person_qr_code, generate_entrance_qr_code
-from utils import get_brasil_datetime, format_cpf
+from qr_code import qr_code_image, person_payload, entrance_payload, MIMETYPES
+from utils import get_brasil_datetime, format_cpf, only_digits
+from occupancy import occupancy
 import re
 
 qr_bp = Blueprint('qr', __name__)
@@ -22,14 +23,10 @@ def gerar_qrcode_pessoa(cpf):
         flash('Pessoa não encontrada.', 'danger')
         return redirect(url_for('pessoas.index'))
     
-    # Gera o QR code se não existir
-    if not pessoa.qr_code_url:
-        pessoa.qr_code_url = generate_person_qr_code(pessoa)
-        db.session.commit()
-    
     return render_template('qr/pessoa_qr.html', 
                            pessoa=pessoa, 
-                           qr_code_url=pessoa.qr_code_url,
+                           qr_code_url=url_for('qr.imagem_pessoa', cpf=cpf_normalizado, formato='png'),
+                           qr_code_svg_url=url_for('qr.imagem_pessoa', cpf=cpf_normalizado, formato='svg'),
                            title=f'QR Code - {pessoa.nome}')
 
 @qr_bp.route('/gerar-qrcode-ingresso/<int:id>')
@@ -39,20 +36,38 @@ def gerar_qrcode_ingresso(id):
     # Busca o ingresso
     ingresso = Ingresso.query.get_or_404(id)
     
-    # Gera o QR code se não existir
-    if not ingresso.qr_code_url:
-        ingresso.qr_code_url = generate_entrance_qr_code(ingresso)
-        db.session.commit()
-    
     # Também busca a pessoa relacionada
     pessoa = Pessoa.query.filter_by(cpf=ingresso.cpf).first()
     
     return render_template('qr/ingresso_qr.html', 
                            ingresso=ingresso, 
                            pessoa=pessoa,
-                           qr_code_url=ingresso.qr_code_url,
+                           qr_code_url=url_for('qr.imagem_ingresso', id=id, formato='png'),
+                           qr_code_svg_url=url_for('qr.imagem_ingresso', id=id, formato='svg'),
                            title=f'QR Code - Ingresso {id}')
 
+def _qr_response(data, formato):
+    """Imagem do QR com ETag forte; o conteúdo nunca muda para o mesmo código"""
+    entry = qr_code_image(data, formato)
+    response = Response(entry.value, mimetype=MIMETYPES[formato])
+    response.set_etag(entry.etag)
+    response.headers['Cache-Control'] = 'private, max-age=86400'
+    return response.make_conditional(request)
+
+@qr_bp.route('/qrcode/pessoa/<cpf>.<any(png, svg):formato>')
+@login_required
+def imagem_pessoa(cpf, formato):
+    """Imagem do QR de check-in de uma pessoa (PNG ou SVG)"""
+    if len(only_digits(cpf)) != 11:
+        abort(404)
+    return _qr_response(person_payload(cpf), formato)
+
+@qr_bp.route('/qrcode/ingresso/<int:id>.<any(png, svg):formato>')
+@login_required
+def imagem_ingresso(id, formato):
+    """Imagem do QR de check-out de um ingresso (PNG ou SVG)"""
+    return _qr_response(entrance_payload(id), formato)
+
 @qr_bp.route('/quick-checkin/<cpf>')
 @login_required
 def quick_checkin(cpf):
@@ -69,7 +84,7 @@ def quick_checkin(cpf):
         return redirect(url_for('ingressos.index'))
     
     # Verifica se a pessoa já tem um ingresso aberto (sem saída registrada)
-    ingresso_aberto = Ingresso.query.filter_by(cpf=pessoa.cpf, saida=None).first()
+    ingresso_aberto = occupancy.open_ingresso(pessoa.cpf)
     
     if ingresso_aberto:
         flash(f'A pessoa {pessoa.nome} já possui um ingresso aberto. Registre a saída primeiro.', 'warning')
@@ -106,9 +121,9 @@ def processar_checkin():
     # Obtém a data e hora atual
     current_time = get_brasil_datetime()
     
-    # Formata data e hora
-    data_atual = current_time.strftime('%d/%m/%Y')
-    hora_atual = current_time.strftime('%H:%M')
+    # Data e hora atuais
+    data_atual = current_time.date()
+    hora_atual = current_time.time()
     
     # Cria um novo ingresso
     novo_ingresso = Ingresso(
@@ -121,14 +136,10 @@ def processar_checkin():
         observacoes=observacoes
     )
     
-    # Salva no banco de dados
+    # Salva no banco de dados (o QR code de check-out é gerado sob demanda)
     db.session.add(novo_ingresso)
     db.session.commit()
     
-    # Gera QR code para o novo ingresso
-    novo_ingresso.qr_code_url = generate_entrance_qr_code(novo_ingresso)
-    db.session.commit()
-    
     flash(f'Check-in registrado com sucesso para {pessoa.nome}!', 'success')
     
     # Redireciona para visualização do QR code 
@@ -168,10 +179,11 @@ def processar_checkout(ingresso_id):
     
     # Obtém a hora atual para registrar a saída
     current_time = get_brasil_datetime()
-    hora_atual = current_time.strftime('%H:%M')
+    hora_atual = current_time.time()
     
     # Atualiza a hora de saída
     ingresso.saida = hora_atual
+    ingresso.saida_registrada_por = current_user.id
     db.session.commit()
     
     # Busca a pessoa relacionada
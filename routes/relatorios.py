@@ -1,12 +1,16 @@
 from flask import (
-    Blueprint, render_template, send_file, request
+    Blueprint, render_template, send_file, request, Response, stream_with_context,
+    redirect, url_for, flash, jsonify, abort, current_app
 )
-from flask_login import login_required
-from models import Pessoa, Ingresso, Empresa, Entrega, Correspondencia, Ocorrencia
+from flask_login import login_required, current_user
+from app import db
 from forms import RelatorioForm
-from utils import generate_pdf_report, get_brasil_datetime
+from models import ReportJob
+from report_cache import report_cache
+from report_jobs import job_pool, check_stale, live_progress, QueueFull, CONCLUIDO
+from reports import REPORTS, EXPORT_FORMATS
+from utils import get_brasil_datetime
 import os
-import tempfile
 
 relatorios_bp = Blueprint('relatorios', __name__, url_prefix='/relatorios')
 
@@ -25,6 +29,21 @@ def index():
         tipo_relatorio = form.tipo_relatorio.data
         data_inicio = form.data_inicio.data
         data_fim = form.data_fim.data
+        formato = form.formato.data
+        
+        # Spreadsheet/data formats are streamed while the rows are read
+        if formato in EXPORT_FORMATS:
+            return exportar_relatorio(tipo_relatorio, data_inicio, data_fim, formato)
+        
+        # Long PDFs are rendered by the background pool, off the request
+        if form.segundo_plano.data:
+            try:
+                job = job_pool.submit(current_app._get_current_object(), current_user.id,
+                                      tipo_relatorio, data_inicio, data_fim)
+            except QueueFull:
+                flash('Muitos relatórios em geração no momento. Tente novamente em alguns instantes.', 'warning')
+                return render_template('relatorios/index.html', form=form)
+            return redirect(url_for('relatorios.tarefa', job_id=job.id))
         
         # Generate and send the report
         return gerar_relatorio(tipo_relatorio, data_inicio, data_fim)
@@ -32,163 +51,124 @@ def index():
     return render_template('relatorios/index.html', form=form)
 
 def gerar_relatorio(tipo_relatorio, data_inicio, data_fim):
-    # Create a temporary file to store the report
-    fd, temp_path = tempfile.mkstemp(suffix='.pdf')
-    os.close(fd)
+    report = REPORTS[tipo_relatorio]
+    cache = report_cache()
     
     filename = f"{tipo_relatorio}_{data_inicio.strftime('%Y%m%d')}_{data_fim.strftime('%Y%m%d')}.pdf"
     
-    # Format date strings for display
-    data_inicio_str = data_inicio.strftime("%d/%m/%Y")
-    data_fim_str = data_fim.strftime("%d/%m/%Y")
+    def render(path):
+        # Generate the PDF report; rows are streamed from the database page by page
+        report.render_pdf(data_inicio, data_fim, path)
     
-    if tipo_relatorio == 'ingressos':
-        # Get ingressos within date range
-        ingressos = Ingresso.query.join(Pessoa).filter(
-            Ingresso.data.between(data_inicio_str, data_fim_str)
-        ).order_by(Ingresso.data.desc(), Ingresso.entrada.desc()).all()
-        
-        # Prepare data for report
-        data = []
-        for ingresso in ingressos:
-            pessoa = Pessoa.query.get(ingresso.cpf)
-            data.append([
-                ingresso.data, 
-                ingresso.entrada, 
-                ingresso.saida or "-", 
-                pessoa.nome, 
-                pessoa.cpf, 
-                ingresso.motivo, 
-                ingresso.pessoa_setor
-            ])
-        
-        headers = ["Data", "Entrada", "Saída", "Nome", "CPF", "Motivo", "Pessoa/Setor"]
-        title = "Relatório de Ingressos"
-        
-    elif tipo_relatorio == 'pessoas':
-        # Get all pessoas
-        pessoas = Pessoa.query.order_by(Pessoa.nome).all()
-        
-        # Prepare data for report
-        data = []
-        for pessoa in pessoas:
-            data.append([
-                pessoa.cpf,
-                pessoa.nome,
-                pessoa.telefone or "-",
-                pessoa.empresa or "-"
-            ])
-        
-        headers = ["CPF", "Nome", "Telefone", "Empresa"]
-        title = "Relatório de Pessoas Cadastradas"
-        
-    elif tipo_relatorio == 'empresas':
-        # Get all empresas
-        empresas = Empresa.query.order_by(Empresa.nome_empresa).all()
-        
-        # Prepare data for report
-        data = []
-        for empresa in empresas:
-            data.append([
-                empresa.cnpj,
-                empresa.nome_empresa,
-                empresa.telefone_empresa or "-",
-                empresa.nome_func or "-",
-                empresa.telefone_func or "-"
-            ])
-        
-        headers = ["CNPJ", "Empresa", "Telefone", "Funcionário", "Telefone Func."]
-        title = "Relatório de Empresas"
-        
-    elif tipo_relatorio == 'entregas':
-        # Get entregas within date range
-        entregas = Entrega.query.join(Empresa).filter(
-            Entrega.data_registro.between(data_inicio_str, data_fim_str)
-        ).order_by(Entrega.data_registro.desc(), Entrega.hora_registro.desc()).all()
-        
-        # Prepare data for report
-        data = []
-        for entrega in entregas:
-            empresa = Empresa.query.get(entrega.cnpj)
-            status = "Pendente" if not entrega.data_envio else "Enviado"
-            data.append([
-                entrega.data_registro,
-                entrega.hora_registro,
-                empresa.nome_empresa,
-                entrega.nota_fiscal or "-",
-                status,
-                entrega.data_envio or "-",
-                entrega.hora_envio or "-"
-            ])
-        
-        headers = ["Data", "Hora", "Empresa", "Nota Fiscal", "Status", "Data Envio", "Hora Envio"]
-        title = "Relatório de Entregas"
-        
-    elif tipo_relatorio == 'correspondencias':
-        # Convert string dates to datetime objects for comparison
-        data_inicio_dt = data_inicio
-        data_fim_dt = data_fim
-        
-        # Get correspondencias within date range
-        correspondencias = Correspondencia.query.filter(
-            Correspondencia.data_recebimento.between(data_inicio_dt, data_fim_dt)
-        ).order_by(Correspondencia.data_recebimento.desc()).all()
-        
-        # Prepare data for report
-        data = []
-        for correspondencia in correspondencias:
-            status = "Pendente" if not correspondencia.data_destinacao else "Entregue"
-            data.append([
-                correspondencia.data_recebimento.strftime("%d/%m/%Y"),
-                correspondencia.hora_recebimento.strftime("%H:%M"),
-                correspondencia.remetente,
-                correspondencia.destinatario,
-                correspondencia.tipo,
-                correspondencia.setor_encomenda,
-                status
-            ])
-        
-        headers = ["Data", "Hora", "Remetente", "Destinatário", "Tipo", "Setor", "Status"]
-        title = "Relatório de Correspondências"
-        
-    elif tipo_relatorio == 'ocorrencias':
-        # Convert string dates to datetime objects for comparison
-        data_inicio_dt = data_inicio
-        data_fim_dt = data_fim
-        
-        # Get ocorrencias within date range
-        ocorrencias = Ocorrencia.query.filter(
-            Ocorrencia.data_registro.between(data_inicio_dt, data_fim_dt)
-        ).order_by(Ocorrencia.data_registro.desc()).all()
-        
-        # Prepare data for report
-        data = []
-        for ocorrencia in ocorrencias:
-            data.append([
-                ocorrencia.data_registro.strftime("%d/%m/%Y"),
-                ocorrencia.hora_registro.strftime("%H:%M"),
-                ocorrencia.vigilante,
-                ocorrencia.envolvidos,
-                ocorrencia.gravidade.upper(),
-                ocorrencia.ocorrencia[:100] + "..." if len(ocorrencia.ocorrencia) > 100 else ocorrencia.ocorrencia
-            ])
-        
-        headers = ["Data", "Hora", "Vigilante", "Envolvidos", "Gravidade", "Descrição"]
-        title = "Relatório de Ocorrências"
+    # Same report over the same data version: serve the cached file
+    key = cache.key(report, data_inicio, data_fim)
+    artifact = cache.open(key) if key else None
+    if artifact is None and key:
+        artifact = cache.store(key, render)
     
-    # Generate the PDF report
-    generate_pdf_report(
-        data=data,
-        title=title,
-        headers=headers,
-        filename=temp_path,
-        date_range=(data_inicio_str, data_fim_str)
-    )
+    if artifact is None:
+        # No data versions available: render once, without caching. The open
+        # file stays readable after removal, and any leftover is cleaned up
+        # by the cache eviction
+        temp_path = cache.temp_path()
+        render(temp_path)
+        artifact = open(temp_path, 'rb')
+        os.remove(temp_path)
     
     # Send the file for download
     return send_file(
-        temp_path,
+        artifact,
+        as_attachment=True,
+        download_name=filename,
+        mimetype='application/pdf',
+        etag=key or False
+    )
+
+def exportar_relatorio(tipo_relatorio, data_inicio, data_fim, formato):
+    """
+    Stream the report as CSV, XLSX or JSON-lines. The response starts right
+    away and each batch of rows is sent as soon as it is read from the database.
+    """
+    report = REPORTS[tipo_relatorio]
+    extensao, mimetype, exportar = EXPORT_FORMATS[formato]
+    
+    filename = f"{tipo_relatorio}_{data_inicio.strftime('%Y%m%d')}_{data_fim.strftime('%Y%m%d')}.{extensao}"
+    
+    # stream_with_context keeps the database session alive while the generator runs
+    return Response(
+        stream_with_context(exportar(report, report.values(data_inicio, data_fim))),
+        mimetype=mimetype,
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+def _get_job_or_404(job_id):
+    """Job of the current user (admins can see every job)"""
+    job = db.session.get(ReportJob, job_id)
+    if job is None or (job.user_id != current_user.id and current_user.role != 'admin'):
+        abort(404)
+    return check_stale(job)
+
+def _job_status(job):
+    linhas, paginas = live_progress(job)
+    return {
+        'id': job.id,
+        'tipo': job.tipo,
+        'status': job.status,
+        'linhas': linhas,
+        'paginas': paginas,
+        'erro': job.erro,
+        'status_url': url_for('relatorios.tarefa_status', job_id=job.id),
+        'download_url': url_for('relatorios.tarefa_download', job_id=job.id) if job.status == CONCLUIDO else None,
+    }
+
+@relatorios_bp.route('/tarefas', methods=['POST'])
+@login_required
+def criar_tarefa():
+    """Submit a PDF report job; returns the job id and the polling URLs"""
+    form = RelatorioForm()
+    if not form.validate_on_submit():
+        return jsonify({'erro': 'Dados inválidos.', 'campos': form.errors}), 400
+    
+    try:
+        job = job_pool.submit(current_app._get_current_object(), current_user.id,
+                              form.tipo_relatorio.data, form.data_inicio.data, form.data_fim.data)
+    except QueueFull:
+        return jsonify({'erro': 'Muitos relatórios em geração no momento.'}), 429
+    
+    return jsonify(_job_status(job)), 202
+
+@relatorios_bp.route('/tarefas/<job_id>')
+@login_required
+def tarefa(job_id):
+    job = _get_job_or_404(job_id)
+    return render_template('relatorios/tarefa.html', job=job, report=REPORTS[job.tipo])
+
+@relatorios_bp.route('/tarefas/<job_id>/status')
+@login_required
+def tarefa_status(job_id):
+    return jsonify(_job_status(_get_job_or_404(job_id)))
+
+@relatorios_bp.route('/tarefas/<job_id>/download')
+@login_required
+def tarefa_download(job_id):
+    job = _get_job_or_404(job_id)
+    if job.status != CONCLUIDO:
+        return jsonify({'erro': 'O relatório ainda não está pronto.', 'status': job.status}), 409
+    
+    artifact = report_cache().open(job.chave)
+    if artifact is None:
+        # Removed by the cache size limit
+        flash('O arquivo deste relatório expirou. Gere o relatório novamente.', 'warning')
+        return redirect(url_for('relatorios.index'))
+    
+    filename = f"{job.tipo}_{job.data_inicio.strftime('%Y%m%d')}_{job.data_fim.strftime('%Y%m%d')}.pdf"
+    return send_file(
+        artifact,
         as_attachment=True,
         download_name=filename,
-        mimetype='application/pdf'
+        mimetype='application/pdf',
+        etag=job.chave
     )
@@ -0,0 +1,255 @@
+"""
+Eventos de entrada e saída enviados em lote pelos leitores das catracas.
+
+Cada evento traz uma chave de idempotência gerada pelo leitor. O lote é
+aplicado em uma única transação e o resultado de cada evento aplicado fica
+gravado em scan_events com a sua chave; reenviar o mesmo evento (por exemplo,
+quando a resposta se perdeu) devolve o resultado gravado em vez de registrar
+o movimento de novo. Eventos com erro não são gravados e podem ser reenviados.
+
+As consultas são feitas uma vez por lote (chaves, pessoas, visitas em aberto
+e ingressos), não por evento, e todas as inserções e alterações vão em um
+único flush.
+
+Formato de cada evento:
+    {"chave": "uuid", "tipo": "entrada", "cpf": "...", "motivo": "...",
+     "pessoa_setor": "...", "observacoes": "...", "momento": "AAAA-MM-DDTHH:MM:SS"}
+    {"chave": "uuid", "tipo": "saida", "cpf": "..." ou "ingresso_id": 123,
+     "momento": "..."}
+"""
+import json
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import Ingresso, Pessoa, ScanEvent
+from utils import format_cpf, get_brasil_datetime
+
+ENTRADA = 'entrada'
+SAIDA = 'saida'
+
+OK = 'ok'
+IGNORADO = 'ignorado'
+ERRO = 'erro'
+
+# Eventos por lote
+MAX_EVENTS = 500
+
+MAX_KEY_LENGTH = 64
+
+# Chaves mais antigas são apagadas a cada lote
+RETENTION = timedelta(days=30)
+
+# Tipos aceitos em cada campo do evento (ausente ou null também é aceito)
+FIELD_TYPES = {
+    'tipo': (str,),
+    'cpf': (str, int),
+    'ingresso_id': (int,),
+    'motivo': (str,),
+    'pessoa_setor': (str,),
+    'observacoes': (str,),
+    'momento': (str,),
+}
+
+# Fuso de Brasília, usado para converter momentos com fuso informado
+_BRASILIA = timezone(timedelta(hours=-3))
+
+
+class InvalidBatch(Exception):
+    """Lote fora do formato esperado (nenhum evento é aplicado)"""
+
+
+def _momento(value):
+    """Momento do evento no horário de Brasília (sem fuso), ou agora"""
+    if not value:
+        return get_brasil_datetime()
+    momento = datetime.fromisoformat(value)
+    if momento.tzinfo is not None:
+        momento = momento.astimezone(_BRASILIA).replace(tzinfo=None)
+    return momento
+
+
+def _result(evento, status, mensagem, ingresso_id=None):
+    return {'chave': evento.get('chave'), 'tipo': evento.get('tipo'), 'status': status,
+            'ingresso_id': ingresso_id, 'mensagem': mensagem}
+
+
+def _field_error(evento):
+    """Mensagem do primeiro campo com tipo inválido, ou None"""
+    for field, types in FIELD_TYPES.items():
+        value = evento.get(field)
+        # bool é subclasse de int, mas true/false não é CPF nem id
+        if value is not None and (isinstance(value, bool) or not isinstance(value, types)):
+            return f'Campo {field} com tipo inválido.'
+    return None
+
+
+def _validate(eventos):
+    """
+    Confere o formato do lote e os tipos dos campos de cada evento.
+
+    Returns:
+        dict: Mensagem de erro por posição dos eventos com campos inválidos
+
+    Raises:
+        InvalidBatch: Se o lote estiver fora do formato
+    """
+    if not isinstance(eventos, list) or not eventos:
+        raise InvalidBatch('Informe a lista de eventos.')
+    if len(eventos) > MAX_EVENTS:
+        raise InvalidBatch(f'Envie no máximo {MAX_EVENTS} eventos por lote.')
+    for evento in eventos:
+        if not isinstance(evento, dict):
+            raise InvalidBatch('Cada evento deve ser um objeto.')
+        chave = evento.get('chave')
+        if not isinstance(chave, str) or not 0 < len(chave) <= MAX_KEY_LENGTH:
+            raise InvalidBatch(f'Cada evento precisa de uma chave de até {MAX_KEY_LENGTH} caracteres.')
+    invalidos = {}
+    for posicao, evento in enumerate(eventos):
+        erro = _field_error(evento)
+        if erro:
+            invalidos[posicao] = erro
+    return invalidos
+
+
+class _Batch:
+    """Estado do lote: registros carregados de uma vez e visitas abertas/fechadas no próprio lote"""
+    def __init__(self, eventos):
+        cpfs = {format_cpf(str(evento['cpf'])) for evento in eventos if evento.get('cpf')}
+        ids = {evento['ingresso_id'] for evento in eventos
+               if isinstance(evento.get('ingresso_id'), int)}
+
+        self.pessoas = {cpf for (cpf,) in db.session.query(Pessoa.cpf).filter(Pessoa.cpf.in_(cpfs))} if cpfs else set()
+        self.ingressos = {ingresso.id: ingresso for ingresso in
+                          Ingresso.query.filter(Ingresso.id.in_(ids))} if ids else {}
+        # Visita em aberto mais recente de cada CPF (índice parcial ix_ingressos_abertos)
+        self.abertos = {}
+        if cpfs:
+            abertos = Ingresso.query.filter(Ingresso.cpf.in_(cpfs), Ingresso.saida.is_(None)).order_by(
+                Ingresso.data, Ingresso.entrada, Ingresso.id
+            )
+            for ingresso in abertos:
+                self.abertos[ingresso.cpf] = ingresso
+                self.ingressos[ingresso.id] = ingresso
+
+    def entrada(self, evento, momento):
+        cpf = format_cpf(str(evento.get('cpf') or ''))
+        motivo = (evento.get('motivo') or '').strip()
+        pessoa_setor = (evento.get('pessoa_setor') or '').strip()
+        if not cpf:
+            return _result(evento, ERRO, 'Informe o CPF.')
+        if cpf not in self.pessoas:
+            return _result(evento, ERRO, 'Pessoa não cadastrada.')
+        if not motivo or not pessoa_setor:
+            return _result(evento, ERRO, 'Informe o motivo e a pessoa/setor.')
+        if cpf in self.abertos:
+            return _result(evento, IGNORADO, 'A pessoa já possui um ingresso aberto.', self.abertos[cpf].id)
+
+        ingresso = Ingresso(cpf=cpf, data=momento.date(), entrada=momento.time(), saida=None,
+                            motivo=motivo[:200], pessoa_setor=pessoa_setor[:100],
+                            observacoes=evento.get('observacoes'))
+        db.session.add(ingresso)
+        self.abertos[cpf] = ingresso
+        return ingresso
+
+    def saida(self, evento, momento, user_id):
+        if evento.get('ingresso_id') is not None:
+            ingresso = self.ingressos.get(evento['ingresso_id'])
+            if ingresso is None:
+                return _result(evento, ERRO, 'Ingresso não encontrado.')
+        elif evento.get('cpf'):
+            ingresso = self.abertos.get(format_cpf(str(evento['cpf'])))
+            if ingresso is None:
+                return _result(evento, IGNORADO, 'Nenhum ingresso aberto para o CPF.')
+        else:
+            return _result(evento, ERRO, 'Informe o CPF ou o ingresso.')
+
+        if ingresso.saida is not None:
+            return _result(evento, IGNORADO, 'Saída já registrada.', ingresso.id)
+
+        ingresso.saida = momento.time()
+        ingresso.saida_registrada_por = user_id
+        if self.abertos.get(ingresso.cpf) is ingresso:
+            del self.abertos[ingresso.cpf]
+        return ingresso
+
+
+def _apply(eventos, user_id, invalidos):
+    chaves = {evento['chave'] for evento in eventos}
+    gravados = {
+        evento.chave: evento for evento in ScanEvent.query.filter(ScanEvent.chave.in_(chaves))
+    }
+    batch = _Batch([evento for posicao, evento in enumerate(eventos) if posicao not in invalidos])
+
+    resultados = []
+    # Eventos aplicados neste lote: (resultado, ingresso) - o id só existe após o flush
+    aplicados = {}
+    for posicao, evento in enumerate(eventos):
+        chave = evento['chave']
+        if posicao in invalidos:
+            resultado = _result(evento, ERRO, invalidos[posicao])
+        elif chave in gravados:
+            resultado = dict(json.loads(gravados[chave].resultado), repetido=True)
+        elif chave in aplicados:
+            resultado = aplicados[chave][0]
+        else:
+            try:
+                momento = _momento(evento.get('momento'))
+            except (TypeError, ValueError):
+                resultado = _result(evento, ERRO, 'Momento inválido (use AAAA-MM-DDTHH:MM:SS).')
+            else:
+                if evento.get('tipo') == ENTRADA:
+                    resultado = batch.entrada(evento, momento)
+                elif evento.get('tipo') == SAIDA:
+                    resultado = batch.saida(evento, momento, user_id)
+                else:
+                    resultado = _result(evento, ERRO, "Tipo deve ser 'entrada' ou 'saida'.")
+
+            if isinstance(resultado, Ingresso):
+                ingresso = resultado
+                mensagem = 'Entrada registrada.' if evento['tipo'] == ENTRADA else 'Saída registrada.'
+                resultado = _result(evento, OK, mensagem)
+                aplicados[chave] = (resultado, ingresso)
+            elif resultado['status'] == IGNORADO:
+                aplicados[chave] = (resultado, None)
+        resultados.append(resultado)
+
+    # Um único flush para todas as inserções e alterações; em seguida os ids
+    # das entradas novas já existem para a resposta e para scan_events
+    db.session.flush()
+    for chave, (resultado, ingresso) in aplicados.items():
+        if ingresso is not None:
+            resultado['ingresso_id'] = ingresso.id
+        db.session.add(ScanEvent(chave=chave, user_id=user_id, tipo=resultado['tipo'],
+                                 ingresso_id=resultado['ingresso_id'], resultado=json.dumps(resultado)))
+    return resultados
+
+
+def apply_events(eventos, user_id):
+    """
+    Aplica um lote de eventos dos leitores em uma única transação.
+
+    Args:
+        eventos (list): Eventos no formato descrito no módulo
+        user_id (int): Usuário do leitor
+
+    Returns:
+        list: Resultado de cada evento, na ordem recebida (status ok,
+        ignorado ou erro; repetido=True para chaves já aplicadas)
+
+    Raises:
+        InvalidBatch: Se o lote estiver fora do formato
+    """
+    invalidos = _validate(eventos)
+    ScanEvent.query.filter(ScanEvent.criado_em < datetime.now() - RETENTION).delete()
+    try:
+        resultados = _apply(eventos, user_id, invalidos)
+        db.session.commit()
+    except IntegrityError:
+        # Outro envio do mesmo lote gravou as chaves primeiro: reaplica, e as
+        # chaves já gravadas devolvem o resultado registrado
+        db.session.rollback()
+        resultados = _apply(eventos, user_id, invalidos)
+        db.session.commit()
+    return resultados
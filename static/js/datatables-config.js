@@ -61,7 +61,17 @@ document.addEventListener('DOMContentLoaded', function() {
             
             // Mescla configurações padrão com específicas
             const config = { ...defaultConfig, ...tableConfig };
-            
+
+            // Tabelas paginadas no servidor: as linhas chegam via AJAX, então os
+            // tooltips precisam ser inicializados a cada nova página desenhada
+            if (config.serverSide) {
+                config.drawCallback = function() {
+                    this.api().table().body().querySelectorAll('[data-bs-toggle="tooltip"]').forEach(function(el) {
+                        bootstrap.Tooltip.getOrCreateInstance(el);
+                    });
+                };
+            }
+
             // Inicializa a tabela
             $(this).DataTable(config);
         } else {
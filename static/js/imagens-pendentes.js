@@ -0,0 +1,42 @@
+// Troca os marcadores das imagens de entregas em processamento pela imagem
+// pronta, consultando o status a cada poucos segundos enquanto houver marcadores
+(function() {
+    const INTERVALO = 3000;
+
+    function trocar(marcador, imagem) {
+        if (imagem.status === 'pronta') {
+            marcador.outerHTML = imagem.html;
+        } else if (imagem.status === 'erro') {
+            marcador.dataset.status = 'erro';
+            marcador.title = 'Erro ao processar a imagem';
+            marcador.innerHTML = '<i class="fas fa-exclamation-triangle text-danger"></i>';
+        }
+    }
+
+    function consultar() {
+        // Uma consulta por tamanho de marcador (o HTML da imagem vem no mesmo tamanho)
+        const porTamanho = {};
+        document.querySelectorAll('.imagem-pendente:not([data-status="erro"])').forEach(marcador => {
+            (porTamanho[marcador.dataset.tamanho] = porTamanho[marcador.dataset.tamanho] || new Set())
+                .add(marcador.dataset.imagemId);
+        });
+        Object.entries(porTamanho).forEach(([tamanho, ids]) => {
+            fetch('/entregas/imagens/status?tamanho=' + tamanho + '&ids=' + [...ids].join(','),
+                  {credentials: 'same-origin'})
+                .then(resposta => resposta.ok ? resposta.json() : {imagens: []})
+                .then(dados => {
+                    dados.imagens.forEach(imagem => {
+                        document.querySelectorAll('.imagem-pendente[data-tamanho="' + tamanho +
+                                                  '"][data-imagem-id="' + imagem.id + '"]')
+                            .forEach(marcador => trocar(marcador, imagem));
+                    });
+                })
+                .catch(() => {});
+        });
+    }
+
+    // As linhas da listagem chegam por AJAX, então os marcadores são procurados a cada consulta
+    document.addEventListener('DOMContentLoaded', function() {
+        setInterval(consultar, INTERVALO);
+    });
+})();
@@ -175,6 +175,90 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
 
+    // Autocomplete de CPF, CNPJ e nomes (campos com data-autocomplete="pessoa|empresa").
+    // Ao escolher uma sugestão, o documento vai para o campo indicado em
+    // data-autocomplete-target (ou para o próprio campo), que recebe o evento
+    // 'autocomplete:selecionado' com os dados da sugestão.
+    var autocompleteInputs = document.querySelectorAll('[data-autocomplete]');
+    autocompleteInputs.forEach(function(input) {
+        const tipo = input.getAttribute('data-autocomplete');
+        const target = document.querySelector(input.getAttribute('data-autocomplete-target')) || input;
+        const menu = document.createElement('div');
+        menu.className = 'dropdown-menu w-100';
+        input.parentNode.style.position = 'relative';
+        input.parentNode.appendChild(menu);
+        input.setAttribute('autocomplete', 'off');
+
+        let timer = null;
+        let controller = null;
+
+        function fechar() {
+            menu.classList.remove('show');
+            menu.innerHTML = '';
+        }
+
+        function escolher(item) {
+            const documento = item.cpf || item.cnpj;
+            target.value = documento;
+            if (input !== target) {
+                input.value = item.nome;
+            }
+            fechar();
+            target.dispatchEvent(new CustomEvent('autocomplete:selecionado', { detail: item, bubbles: true }));
+        }
+
+        function mostrar(resultados) {
+            menu.innerHTML = '';
+            if (!resultados.length) {
+                fechar();
+                return;
+            }
+            resultados.forEach(function(item) {
+                const opcao = document.createElement('button');
+                opcao.type = 'button';
+                opcao.className = 'dropdown-item';
+                const nome = document.createElement('strong');
+                nome.textContent = item.nome;
+                const documento = document.createElement('small');
+                documento.className = 'text-muted ms-2';
+                documento.textContent = item.cpf || item.cnpj;
+                opcao.appendChild(nome);
+                opcao.appendChild(documento);
+                opcao.addEventListener('mousedown', function(e) {
+                    // mousedown para escolher antes do blur fechar o menu
+                    e.preventDefault();
+                    escolher(item);
+                });
+                menu.appendChild(opcao);
+            });
+            menu.classList.add('show');
+        }
+
+        input.addEventListener('input', function() {
+            const termo = input.value.trim();
+            clearTimeout(timer);
+            if (termo.replace(/\W/g, '').length < 2) {
+                fechar();
+                return;
+            }
+            timer = setTimeout(function() {
+                if (controller) controller.abort();
+                controller = new AbortController();
+                fetch('/api/autocomplete?tipo=' + tipo + '&q=' + encodeURIComponent(termo), { signal: controller.signal })
+                    .then(response => response.ok ? response.json() : { resultados: [] })
+                    .then(data => mostrar(data.resultados))
+                    .catch(error => {
+                        if (error.name !== 'AbortError') console.error('Error:', error);
+                    });
+            }, 150);
+        });
+
+        input.addEventListener('keydown', function(e) {
+            if (e.key === 'Escape') fechar();
+        });
+        input.addEventListener('blur', fechar);
+    });
+
     // Handle delete confirmation modals - evitar execução na seção de empresas
     if (!window.location.pathname.includes('/empresas')) {
         var deleteButtons = document.querySelectorAll('.btn-delete');
@@ -0,0 +1,250 @@
+"""
+Limpeza dos arquivos órfãos das entregas e dos QR antigos.
+
+As exclusões removem os arquivos depois do commit (image_jobs.release), mas
+os conteúdos gravados há menos de MIN_AGE, uma falha nessa etapa, a exclusão
+em cascata das entregas de uma empresa e os PNGs de QR gravados por versões
+anteriores deixam arquivos sem registro.
+Esta limpeza confere cada pasta com os registros que a referenciam:
+
+    repositório   UPLOAD_STORE_DIR          EntregaImagem.content_hash
+    legado        static/uploads/entregas   Entrega.imagem_filename e EntregaImagem.filename
+    qrcodes       static/qrcodes            Pessoa.qr_code_url e Ingresso.qr_code_url
+
+As pastas são percorridas em lotes de `lote` arquivos, com uma consulta ao
+banco por lote, logo antes de remover os órfãos dele; a memória não cresce
+com o número de arquivos. Arquivos mais novos que MIN_AGE são mantidos (foto
+gravada cujo registro ainda não teve commit).
+
+Uso:
+    python storage_gc.py                      # remove os órfãos e mostra o relatório
+    python storage_gc.py --simular            # só o relatório
+    python storage_gc.py --lote 200
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+from sqlalchemy import inspect
+
+from app import db
+from models import Entrega, EntregaImagem, Pessoa, Ingresso
+from image_jobs import UPLOAD_FOLDER
+from qr_code import QR_FOLDER
+from upload_store import upload_store, is_hash, TEMP_FOLDER, MIN_AGE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH = 500
+
+
+class Area:
+    """
+    Pasta conferida com os registros do banco.
+
+    Args:
+        name (str): Nome no relatório
+        directory (str): Pasta dos arquivos
+        key: Função nome do arquivo -> chave procurada no banco (None: nunca referenciado)
+        referenced: Função lista de chaves -> conjunto das que têm registro
+        recursive (bool): Inclui as subpastas
+    """
+    def __init__(self, name, directory, key, referenced, recursive=False):
+        self.name = name
+        self.directory = directory
+        self.key = key
+        self.referenced = referenced
+        self.recursive = recursive
+
+    def files(self):
+        """Arquivos da pasta: (caminho, nome, os.stat_result)"""
+        if not os.path.isdir(self.directory):
+            return
+        for folder, subfolders, names in os.walk(self.directory):
+            if not self.recursive:
+                subfolders.clear()
+            for name in names:
+                path = os.path.join(folder, name)
+                try:
+                    yield path, name, os.stat(path)
+                except FileNotFoundError:
+                    continue  # Removido durante a varredura
+
+
+class Report:
+    """Totais de uma área"""
+    def __init__(self, name):
+        self.name = name
+        self.files = 0
+        self.bytes = 0
+        self.orphans = 0
+        self.orphan_bytes = 0
+        self.removed = 0
+        self.reclaimed = 0
+        self.errors = 0
+
+
+def _store_key(store, path, name):
+    # Temporários de envios interrompidos e arquivos estranhos não têm registro
+    if os.path.dirname(path) == os.path.join(store.directory, TEMP_FOLDER):
+        return None
+    return name[:64] if is_hash(name[:64]) else None
+
+
+def _referenced_hashes(keys):
+    return {row[0] for row in db.session.query(EntregaImagem.content_hash).filter(
+        EntregaImagem.content_hash.in_(keys)
+    ).distinct()}
+
+
+def _existing(*columns):
+    """Colunas que existem no banco (as colunas legadas faltam em bancos antigos)"""
+    tables = inspect(db.engine).get_table_names()
+    return [column for column in columns if column.table.name in tables and column.name in
+            [col['name'] for col in inspect(db.engine).get_columns(column.table.name)]]
+
+
+def _referenced_in(columns):
+    def referenced(keys):
+        # Na pasta antiga também ficam as imagens ainda não movidas para o
+        # repositório (antes da migração 14)
+        found = set()
+        for column in columns:
+            found |= {row[0] for row in db.session.query(column).filter(column.in_(keys))}
+        return found
+    return referenced
+
+
+def _qr_references(columns):
+    # Coluna legada: os QR são gerados sob demanda e ninguém grava mais nela,
+    # então basta ler as URLs uma vez
+    names = set()
+    for column in columns:
+        for (url,) in db.session.query(column).filter(column.isnot(None)):
+            names.add(url.replace('\\', '/').rsplit('/', 1)[-1])
+    return names
+
+
+def areas():
+    """Pastas conferidas, na ordem do relatório"""
+    store = upload_store()
+    legacy_columns = _existing(Entrega.__table__.c.imagem_filename, EntregaImagem.__table__.c.filename)
+    qr_columns = _existing(Pessoa.__table__.c.qr_code_url, Ingresso.__table__.c.qr_code_url)
+    qr_references = None
+
+    def referenced_qr(keys):
+        nonlocal qr_references
+        if qr_references is None:
+            qr_references = _qr_references(qr_columns)
+        return qr_references & set(keys)
+
+    basedir = os.path.dirname(os.path.abspath(__file__))
+    return [
+        Area('Imagens das entregas (repositório)', store.directory,
+             lambda path, name: _store_key(store, path, name), _referenced_hashes, recursive=True),
+        Area('Imagens antigas das entregas', UPLOAD_FOLDER,
+             lambda path, name: name, _referenced_in(legacy_columns)),
+        Area('QR de pessoas e ingressos (PNG antigos)', os.path.join(basedir, QR_FOLDER),
+             lambda path, name: name, referenced_qr),
+    ]
+
+
+def _remove(orphans, report):
+    for path, size in orphans:
+        try:
+            # Gravado de novo durante a varredura (envio do mesmo conteúdo)
+            if time.time() - os.stat(path).st_mtime < MIN_AGE:
+                continue
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            report.errors += 1
+            logger.error(f'Erro ao remover {path}: {e}')
+            continue
+        report.removed += 1
+        report.reclaimed += size
+
+
+def _collect_batch(area, batch, report, dry_run):
+    """Consulta as chaves do lote e remove os arquivos sem registro"""
+    keys = list({key for _, _, _, key in batch if key is not None})
+    referenced = area.referenced(keys) if keys else set()
+    db.session.commit()  # Não segura a transação durante as remoções
+
+    limit = time.time() - MIN_AGE
+    orphans = [(path, size) for path, size, mtime, key in batch
+               if key not in referenced and mtime < limit]
+    report.orphans += len(orphans)
+    report.orphan_bytes += sum(size for _, size in orphans)
+    if not dry_run:
+        _remove(orphans, report)
+
+
+def collect(batch_size=DEFAULT_BATCH, dry_run=False):
+    """
+    Remove os arquivos sem registro de todas as áreas.
+
+    Args:
+        batch_size (int): Arquivos por consulta ao banco
+        dry_run (bool): Só conta os órfãos, sem remover
+
+    Returns:
+        list: Um Report por área
+    """
+    reports = []
+    for area in areas():
+        report = Report(area.name)
+        batch = []
+        for path, name, stat in area.files():
+            report.files += 1
+            report.bytes += stat.st_size
+            batch.append((path, stat.st_size, stat.st_mtime, area.key(path, name)))
+            if len(batch) >= batch_size:
+                _collect_batch(area, batch, report, dry_run)
+                batch = []
+        if batch:
+            _collect_batch(area, batch, report, dry_run)
+        reports.append(report)
+    return reports
+
+
+def _size(size):
+    if size < 1024 * 1024:
+        return f'{size / 1024:.1f} KB'
+    return f'{size / 1024 / 1024:.1f} MB'
+
+
+def print_report(reports, dry_run=False):
+    for report in reports:
+        print(f"{report.name}: {report.files} arquivos, {_size(report.bytes)}")
+        print(f"    órfãos: {report.orphans} ({_size(report.orphan_bytes)})")
+        if not dry_run:
+            print(f"    removidos: {report.removed}, recuperados {_size(report.reclaimed)}"
+                  + (f", {report.errors} erros" if report.errors else ""))
+    total = sum(report.bytes for report in reports)
+    if dry_run:
+        print(f"Total: {_size(total)}, {_size(sum(report.orphan_bytes for report in reports))} em órfãos "
+              f"(simulação, nada foi removido)")
+    else:
+        print(f"Total: {_size(total - sum(report.reclaimed for report in reports))} após a limpeza, "
+              f"{_size(sum(report.reclaimed for report in reports))} recuperados")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Limpeza dos arquivos órfãos das entregas e dos QR')
+    parser.add_argument('--simular', action='store_true', help='Só mostra o relatório, sem remover')
+    parser.add_argument('--lote', type=int, default=DEFAULT_BATCH, help='Arquivos por consulta ao banco')
+    args = parser.parse_args(argv)
+
+    from main import app
+    with app.app_context():
+        reports = collect(args.lote, dry_run=args.simular)
+    print_report(reports, dry_run=args.simular)
+    return 1 if any(report.errors for report in reports) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
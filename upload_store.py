@@ -0,0 +1,164 @@
+"""
+Repositório de arquivos enviados, endereçados pelo conteúdo.
+
+Cada arquivo é gravado com o nome do SHA-256 do seu conteúdo, em dois níveis
+de subdiretórios com os primeiros caracteres do hash (ab/cd/abcd...), para
+que nenhum diretório fique com dezenas de milhares de arquivos. Arquivos
+derivados (versões reduzidas de uma imagem) ficam ao lado do original, com o
+mesmo hash e um sufixo.
+
+O mesmo conteúdo enviado duas vezes é gravado uma vez só; os registros que o
+usam (EntregaImagem.content_hash) são a contagem de referências, e os
+arquivos só são removidos quando nenhum registro aponta mais para o hash.
+
+O repositório fica fora de static/, então os arquivos só são acessíveis
+pelas rotas com login (ou pelo proxy, via X-Accel-Redirect).
+"""
+import glob
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+
+from flask import current_app
+
+# Caracteres do hash em cada nível de subdiretório
+SHARD_LEVELS = (2, 2)
+
+BLOCK_SIZE = 1024 * 1024
+
+TEMP_FOLDER = 'tmp'
+
+# Tempo mínimo desde a última gravação para um arquivo sem registro ser
+# removido (envio do mesmo conteúdo cujo registro ainda não teve commit)
+MIN_AGE = 3600
+
+_HASH = re.compile(r'[0-9a-f]{64}')
+
+
+def is_hash(value):
+    """Se o valor é um SHA-256 em hexadecimal (seguro para montar caminhos)"""
+    return bool(value) and _HASH.fullmatch(value) is not None
+
+
+def file_hash(path):
+    """SHA-256 do arquivo, lido em blocos"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ContentStore:
+    """
+    Diretório de arquivos nomeados pelo SHA-256 do conteúdo.
+
+    Args:
+        directory (str): Raiz do repositório
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, TEMP_FOLDER), exist_ok=True)
+
+    def shard(self, content_hash):
+        """Subdiretório do hash (ab/cd)"""
+        parts, start = [], 0
+        for size in SHARD_LEVELS:
+            parts.append(content_hash[start:start + size])
+            start += size
+        return os.path.join(self.directory, *parts)
+
+    def path(self, content_hash, suffix=''):
+        """Caminho do arquivo (ou de um derivado, com `suffix`) do hash"""
+        return os.path.join(self.shard(content_hash), content_hash + suffix)
+
+    def exists(self, content_hash, suffix=''):
+        return os.path.exists(self.path(content_hash, suffix))
+
+    def temp_file(self, suffix='.tmp'):
+        """Arquivo temporário no mesmo disco do repositório (para os.replace atômico)"""
+        return tempfile.NamedTemporaryFile(dir=os.path.join(self.directory, TEMP_FOLDER),
+                                           suffix=suffix, delete=False)
+
+    def _commit(self, temp_path, content_hash):
+        # Conteúdo já existente: descarta a cópia nova (deduplicação). A data
+        # do arquivo é atualizada para a limpeza de órfãos (storage_gc) não o
+        # remover antes do commit do registro novo
+        destination = self.path(content_hash)
+        if os.path.exists(destination):
+            os.remove(temp_path)
+            os.utime(destination)
+        else:
+            os.makedirs(self.shard(content_hash), exist_ok=True)
+            os.replace(temp_path, destination)
+        return content_hash
+
+    def put_stream(self, stream):
+        """
+        Grava o conteúdo de um arquivo aberto, calculando o hash na cópia.
+
+        Returns:
+            str: SHA-256 do conteúdo
+        """
+        digest = hashlib.sha256()
+        with self.temp_file() as temp:
+            try:
+                for block in iter(lambda: stream.read(BLOCK_SIZE), b''):
+                    digest.update(block)
+                    temp.write(block)
+            except Exception:
+                temp.close()
+                os.remove(temp.name)
+                raise
+        return self._commit(temp.name, digest.hexdigest())
+
+    def put_file(self, path, move=False):
+        """
+        Grava um arquivo do disco no repositório.
+
+        Args:
+            path (str): Arquivo de origem
+            move (bool): Move em vez de copiar (a origem deixa de existir)
+
+        Returns:
+            str: SHA-256 do conteúdo
+        """
+        content_hash = file_hash(path)
+        if self.exists(content_hash):
+            os.utime(self.path(content_hash))
+            if move:
+                os.remove(path)
+            return content_hash
+
+        if move:
+            try:
+                # No mesmo disco basta renomear
+                os.makedirs(self.shard(content_hash), exist_ok=True)
+                os.replace(path, self.path(content_hash))
+                return content_hash
+            except OSError:
+                pass  # Outro disco: cópia pelo temporário
+        with self.temp_file() as temp, open(path, 'rb') as f:
+            shutil.copyfileobj(f, temp, BLOCK_SIZE)
+        self._commit(temp.name, content_hash)
+        if move:
+            os.remove(path)
+        return content_hash
+
+    def remove(self, content_hash):
+        """Remove o arquivo do hash e todos os seus derivados"""
+        for path in glob.glob(glob.escape(self.path(content_hash)) + '*'):
+            os.remove(path)
+
+
+_stores = {}
+
+
+def upload_store():
+    """Repositório de arquivos enviados do diretório configurado na aplicação atual"""
+    directory = current_app.config['UPLOAD_STORE_DIR']
+    if directory not in _stores:
+        _stores[directory] = ContentStore(directory)
+    return _stores[directory]
@@ -1,12 +1,15 @@
 import re
+from xml.sax.saxutils import escape
 from unidecode import unidecode
 from datetime import datetime, timedelta
 from reportlab.lib.pagesizes import landscape, A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.enums import TA_CENTER
 from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.platypus import Table, TableStyle, Paragraph, Spacer
 from reportlab.lib.units import inch
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen.canvas import Canvas
 
 def format_cpf(cpf):
     """Format CPF to standard format: XXX.XXX.XXX-XX"""
@@ -44,6 +47,14 @@ def normalize_string(text):
     """Remove accents and special characters from a string"""
     return unidecode(str(text))
 
+def only_digits(value):
+    """Keep only the digits of a string (CPF, CNPJ)"""
+    return re.sub(r'[^0-9]', '', value or '')
+
+def normalize_search(text):
+    """Normalize text for search: no accents, lowercase and single spaces"""
+    return ' '.join(normalize_string(text or '').lower().split())
+
 def get_brasil_datetime():
     """
     Retorna o horário atual ajustado para o fuso horário de Brasília (UTC-3)
@@ -53,85 +64,232 @@ def get_brasil_datetime():
     """
     return datetime.now() - timedelta(hours=3)
 
-def generate_pdf_report(data, title, headers, filename, date_range=None):
+# Estilos dos relatórios em PDF, criados uma única vez
+REPORT_STYLES = getSampleStyleSheet()
+REPORT_STYLES.add(ParagraphStyle(
+    name='ReportTitle',
+    parent=REPORT_STYLES['Heading1'],
+    fontSize=14,
+    alignment=TA_CENTER,
+    spaceAfter=12
+))
+
+# Define cor verde personalizada do VigiAPP
+VERDE_VIGIAPP = colors.HexColor('#2f9e41')
+
+REPORT_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), VERDE_VIGIAPP),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+    ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.white),
+    ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
+    ('ALIGN', (0, 1), (-1, -1), 'LEFT'),
+    ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 1), (-1, -1), 9),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+])
+
+# Células com texto longo são quebradas em linhas, com o mesmo corpo das demais
+REPORT_STYLES.add(ParagraphStyle(
+    name='ReportCell',
+    parent=REPORT_STYLES['Normal'],
+    fontName='Helvetica',
+    fontSize=9,
+    leading=11
+))
+
+# Alturas das linhas: o cabeçalho é fixo e as linhas de uma só linha de texto
+# também; só as células que não cabem na largura da coluna são medidas
+REPORT_HEADER_HEIGHT = 28
+REPORT_ROW_HEIGHT = 18
+REPORT_CELL_PADDING = 12  # Padding horizontal padrão da Table (6 + 6)
+REPORT_CELL_VPADDING = 6  # Padding vertical padrão da Table (3 + 3)
+
+# Margens da página: esquerda, direita, superior, inferior
+REPORT_MARGINS = (72, 72, 72, 18)
+
+
+class _RowSource:
+    """Iterador de linhas com leitura antecipada de uma linha"""
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._next = next(self._rows, None)
+        self.count = 0
+
+    def has_more(self):
+        return self._next is not None
+
+    def take(self):
+        row = self._next
+        self._next = next(self._rows, None)
+        self.count += 1
+        return row
+
+
+def _cell(value, width):
+    """Texto da célula, ou um Paragraph quando não cabe em uma linha da coluna"""
+    text = '' if value is None else str(value)
+    if stringWidth(text, 'Helvetica', 9) <= width:
+        return text
+    return Paragraph(escape(text), REPORT_STYLES['ReportCell'])
+
+
+def _row_height(cells, widths):
+    """Altura da linha: a da célula mais alta, no mínimo REPORT_ROW_HEIGHT"""
+    height = 0
+    for cell, width in zip(cells, widths):
+        if isinstance(cell, Paragraph):
+            height = max(height, cell.wrap(width, 1e6)[1])
+    return max(REPORT_ROW_HEIGHT, height + REPORT_CELL_VPADDING)
+
+
+def _split_row(cells, widths, available):
+    """
+    Divide uma linha mais alta que uma página inteira: o que cabe em
+    `available` fica nesta página e o restante de cada célula segue na próxima.
+    """
+    first, rest = [], []
+    for cell, width in zip(cells, widths):
+        if not isinstance(cell, Paragraph):
+            first.append(cell)
+            rest.append('')
+            continue
+        cell.wrap(width, 1e6)
+        parts = cell.split(width, available - REPORT_CELL_VPADDING)
+        if len(parts) == 2:
+            first.append(parts[0])
+            rest.append(parts[1])
+        elif parts:
+            first.append(parts[0])
+            rest.append('')
+        else:
+            first.append('')
+            rest.append(cell)
+    return first, rest
+
+
+def _table_chunk(rows, heights, headers, col_widths):
+    """Tabela de uma página: cabeçalho e as linhas informadas, com as alturas já medidas"""
+    return Table(
+        [headers] + rows,
+        colWidths=col_widths,
+        rowHeights=[REPORT_HEADER_HEIGHT] + heights,
+        style=REPORT_TABLE_STYLE
+    )
+
+
+def generate_pdf_report(data, title, headers, filename, date_range=None, col_weights=None,
+                        on_progress=None):
     """
     Generate a PDF report from data
     
+    The rows are consumed lazily, one page at a time, so `data` can be a
+    generator over a database cursor and only the rows of the current page
+    are held in memory. Memory still grows with the number of pages: the
+    reportlab canvas keeps every finished page (about 16 KB each) until the
+    file is saved, so a 2,000-page report peaks at about 35 MB. The budget
+    is checked by report_memory.py.
+    
+    Cells that don't fit the column width are wrapped, never cut; a row
+    taller than a whole page continues on the next one.
+    
     Args:
-        data (list): List of data rows
+        data (iterable): Data rows
         title (str): Report title
         headers (list): Column headers
         filename (str): Output filename
         date_range (tuple, optional): Start and end date for report period
+        col_weights (list, optional): Relative width of each column
+        on_progress (callable, optional): Called as on_progress(rows, pages)
+            after each page is laid out
     
     Returns:
         str: Path to the generated PDF file
     """
-    # Create a PDF document
-    doc = SimpleDocTemplate(
-        filename,
-        pagesize=landscape(A4),
-        rightMargin=72, leftMargin=72,
-        topMargin=72, bottomMargin=18
-    )
+    pagesize = landscape(A4)
+    page_width, page_height = pagesize
+    left, right, top, bottom = REPORT_MARGINS
+    width = page_width - left - right
     
-    # Styles for the document
-    styles = getSampleStyleSheet()
-    styles.add(ParagraphStyle(
-        name='ReportTitle',
-        parent=styles['Heading1'],
-        fontSize=14,
-        alignment=TA_CENTER,
-        spaceAfter=12
-    ))
-    
-    # Content elements
+    # Content elements of the first page, above the table
     elements = []
     
     # Add title
-    elements.append(Paragraph(f"<b>{title}</b>", styles['ReportTitle']))
+    elements.append(Paragraph(f"<b>{title}</b>", REPORT_STYLES['ReportTitle']))
     elements.append(Spacer(1, 0.25 * inch))
     
     # Add date range if provided
     if date_range:
         date_start, date_end = date_range
         date_text = f"Período: {date_start} a {date_end}"
-        elements.append(Paragraph(date_text, styles['Normal']))
+        elements.append(Paragraph(date_text, REPORT_STYLES['Normal']))
         elements.append(Spacer(1, 0.25 * inch))
     
     # Generation info
     generation_info = f"Gerado em: {get_brasil_datetime().strftime('%d/%m/%Y %H:%M:%S')}"
-    elements.append(Paragraph(generation_info, styles['Normal']))
+    elements.append(Paragraph(generation_info, REPORT_STYLES['Normal']))
     elements.append(Spacer(1, 0.25 * inch))
     
-    # Create the table with headers and data
-    table_data = [headers] + data
-    
-    table = Table(table_data, repeatRows=1)
-    
-    # Define cor verde personalizada do VigiAPP
-    verde_vigiapp = colors.HexColor('#2f9e41')
-    
-    # Apply table style
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), verde_vigiapp),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-        ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.white),
-        ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
-        ('ALIGN', (0, 1), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 1), (-1, -1), 9),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-    ]))
-    
-    elements.append(table)
-    
-    # Build the PDF
-    doc.build(elements)
+    # Column widths fixed for the whole report, filling the page width
+    col_weights = col_weights or [1] * len(headers)
+    total_weight = float(sum(col_weights))
+    col_widths = [width * weight / total_weight for weight in col_weights]
+    
+    canvas = Canvas(filename, pagesize=pagesize, pageCompression=1)
+    canvas.setTitle(title)
+    source = _RowSource(data)
+    text_widths = [w - REPORT_CELL_PADDING for w in col_widths]
+    page_capacity = page_height - top - bottom - REPORT_HEADER_HEIGHT
+    pending = None  # Linha lida que não coube na página anterior: (células, altura)
+    pages = 0
+    
+    # One page per iteration: rows are read and measured until the next one
+    # doesn't fit, and each page gets its own table. At least one page, so
+    # an empty report still shows the header
+    while pages == 0 or pending or source.has_more():
+        y = page_height - top
+        if pages == 0:
+            for element in elements:
+                _, height = element.wrapOn(canvas, width, y - bottom)
+                element.drawOn(canvas, left, y - height)
+                y -= height + element.getSpaceAfter()
+        
+        available = y - bottom - REPORT_HEADER_HEIGHT
+        rows, heights = [], []
+        while pending or source.has_more():
+            if pending is None:
+                cells = [_cell(value, w) for value, w in zip(source.take(), text_widths)]
+                pending = (cells, _row_height(cells, text_widths))
+            cells, height = pending
+            if height <= available:
+                rows.append(cells)
+                heights.append(height)
+                available -= height
+                pending = None
+            elif not rows and height > page_capacity:
+                # Taller than a whole page: split it instead of cutting text
+                first, rest = _split_row(cells, text_widths, available)
+                rows.append(first)
+                heights.append(min(_row_height(first, text_widths), available))
+                pending = (rest, _row_height(rest, text_widths))
+                break
+            else:
+                break
+        
+        if rows or pages == 0:
+            table = _table_chunk(rows, heights, headers, col_widths)
+            _, height = table.wrapOn(canvas, width, y - bottom)
+            table.drawOn(canvas, left, y - height)
+        
+        canvas.showPage()
+        pages += 1
+        if on_progress:
+            on_progress(source.count, pages)
+    
+    canvas.save()
     
     return filename